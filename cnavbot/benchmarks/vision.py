@@ -0,0 +1,388 @@
+"""
+Benchmarks the target detection hot path
+
+Runs on synthetic frames (or JPEGs recorded by the camera service) at
+several resolutions and blob counts, reports per-stage timings, frames per
+second and how far memory peaks during each case:
+
+    $ python -m cnavbot.benchmarks.vision
+    $ python -m cnavbot.benchmarks.vision --frames /data/frames --json
+
+--tracking compares detecting on every frame of a moving target with
+TargetTracker, which mostly searches a window around the prediction.
+--threshold table looks frames up in a ColourTable instead of converting
+them to HSV, --colours sets the number of colour classes detected at once:
+
+    $ python -m cnavbot.benchmarks.vision --threshold table --colours 4
+"""
+from __future__ import absolute_import, division, print_function
+import argparse
+import ctypes
+import gc
+import glob
+import json
+import os
+import resource
+import sys
+import timeit
+
+from cnavbot import settings
+from cnavbot.services import vision
+
+
+cv2 = settings.CV2
+numpy = settings.NUMPY
+
+RESOLUTIONS = ((320, 240), (640, 480), (1280, 720))
+BLOB_COUNTS = (1, 10, 100)
+STAGES = (
+    'decode', 'resize', 'blur', 'hsv', 'threshold', 'contours', 'selection',
+)
+
+
+def target_colour():
+    """Returns a pixel value that falls within the target colour range"""
+    hsv = numpy.array([[[
+        (low + high) // 2 for low, high in zip(
+            settings.TARGET_COLOUR_LOW, settings.TARGET_COLOUR_HIGH
+        )
+    ]]], dtype=numpy.uint8)
+    # Inverse of the COLOR_RGB2HSV conversion the detector does
+    return cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB)[0, 0]
+
+
+def benchmark_colours(count):
+    """Returns count colour classes, the target one and hue shifts of it"""
+    (low_h, low_s, low_v), (high_h, high_s, high_v) = (
+        settings.TARGET_COLOUR_LOW, settings.TARGET_COLOUR_HIGH
+    )
+    colours = []
+    for index in range(count):
+        # Kept clear of the wrap around at 180
+        shifted_h = (low_h + 20 * index) % (180 - (high_h - low_h))
+        colours.append((
+            (shifted_h, low_s, low_v),
+            (shifted_h + high_h - low_h, high_s, high_v),
+        ))
+    return colours
+
+
+def synthetic_frame(resolution, blobs, seed=0):
+    """Returns a noisy frame with the given number of target coloured blobs"""
+    width, height = resolution
+    random = numpy.random.RandomState(seed)
+    frame = random.randint(0, 100, (height, width, 3)).astype(numpy.uint8)
+    colour = target_colour()
+    size = max(min(width, height) // 20, 4)
+
+    for _ in range(blobs):
+        x = random.randint(0, width - size)
+        y = random.randint(0, height - size)
+        frame[y:y + size, x:x + size] = colour
+
+    return frame
+
+
+def frame_paths(path):
+    return sorted(glob.glob(os.path.join(path, '*.jpg')))
+
+
+def recorded_frames(path):
+    frames = []
+    for file_path in frame_paths(path):
+        with open(file_path, 'rb') as image_file:
+            frames.append(numpy.frombuffer(image_file.read(), numpy.uint8))
+    return frames
+
+
+def encode(frame):
+    return cv2.imencode('.jpg', frame)[1]
+
+
+def run_stages(detector, jpeg, timings):
+    """Runs the detection pipeline stage by stage, adding up the timings"""
+    stages = (
+        ('decode', lambda _: detector.crop(
+            cv2.imdecode(jpeg, cv2.IMREAD_COLOR)
+        )[0]),
+        ('resize', detector.resize),
+        ('blur', detector.blur),
+    )
+    if detector.table is None:
+        stages += (
+            ('hsv', detector.convert),
+            ('threshold', detector.in_ranges),
+        )
+    else:
+        stages += (('threshold', detector.lookup), )
+    stages += (
+        ('contours', detector.bounding_boxes),
+        ('selection', detector.largest),
+    )
+
+    result = None
+    for stage, function in stages:
+        started_at = timeit.default_timer()
+        result = function(result)
+        timings[stage] += timeit.default_timer() - started_at
+
+        if stage == 'decode':
+            detector.allocate(result)
+
+    return result
+
+
+def moving_target_frames(resolution, count, seed=0):
+    """Returns noisy frames of a target crossing the frame"""
+    width, height = resolution
+    background = synthetic_frame(resolution, 0, seed)
+    colour = target_colour()
+    size = max(min(width, height) // 20, 4)
+    frames = []
+    for index in range(count):
+        x = int((width - size) * index / max(count - 1, 1))
+        frame = background.copy()
+        frame[height // 2:height // 2 + size, x:x + size] = colour
+        frames.append(frame)
+    return frames
+
+
+def benchmark_tracking(frames, scale=1, rate=30.0, **detector_kwargs):
+    """Returns ms per frame detecting on every frame and when tracking"""
+    detector = vision.TargetDetector(scale=scale, **detector_kwargs)
+    started_at = timeit.default_timer()
+    for frame in frames:
+        detector.detect(frame)
+    detect_ms = 1000 * (timeit.default_timer() - started_at) / len(frames)
+
+    tracker = vision.TargetTracker(detector=vision.TargetDetector(
+        scale=scale, **detector_kwargs
+    ))
+    started_at = timeit.default_timer()
+    for index, frame in enumerate(frames):
+        tracker.update(frame, index / rate)
+    track_ms = 1000 * (timeit.default_timer() - started_at) / len(frames)
+
+    return {
+        'detect_frame_ms': detect_ms,
+        'track_frame_ms': track_ms,
+        'speedup': detect_ms / track_ms if track_ms else 0.0,
+        'full_detections': tracker.full_detections,
+        'window_updates': tracker.window_updates,
+    }
+
+
+def memory_status():
+    """Resident and peak resident memory in KB, None without /proc"""
+    try:
+        with open('/proc/self/status') as status:
+            fields = dict(
+                line.split(':', 1) for line in status if ':' in line
+            )
+        return tuple(
+            int(fields[field].split()[0]) for field in ('VmRSS', 'VmHWM')
+        )
+    except (IOError, KeyError, ValueError):
+        return None
+
+
+def release_memory():
+    """Hands memory freed by earlier cases back to the OS where glibc can"""
+    gc.collect()
+    try:
+        ctypes.CDLL(None).malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def reset_peak_memory():
+    """
+    Resets the process's peak resident memory to its current size, so the
+    peak covers one case rather than every case run before it
+    """
+    release_memory()
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except IOError:
+        return None
+    return memory_status()
+
+
+def benchmark(frames, iterations, scale=1, **detector_kwargs):
+    """
+    Returns average per-stage timings in ms, frames per second and how far
+    resident memory peaked above its size at the start of the case
+    """
+    before = reset_peak_memory()
+    detector = vision.TargetDetector(scale=scale, **detector_kwargs)
+    timings = dict.fromkeys(STAGES, 0.0)
+    count = iterations * len(frames)
+
+    for _ in range(iterations):
+        for jpeg in frames:
+            run_stages(detector, jpeg, timings)
+
+    total = sum(timings.values())
+    after = memory_status() if before else None
+    return {
+        'stages_ms': {
+            stage: 1000 * elapsed / count
+            for stage, elapsed in timings.items()
+        },
+        'frame_ms': 1000 * total / count,
+        'fps': count / total if total else 0.0,
+        'peak_memory_kb': after[1] - before[0] if after else None,
+        # High-water mark of the whole process so far, not of this case
+        'process_peak_kb': (
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        ),
+    }
+
+
+def parse_resolution(value):
+    width, height = value.split('x')
+    return int(width), int(height)
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument(
+        '--resolutions',
+        type=lambda value: [parse_resolution(r) for r in value.split(',')],
+        default=RESOLUTIONS,
+        help='comma separated, e.g. 320x240,640x480',
+    )
+    parser.add_argument(
+        '--blobs',
+        type=lambda value: [int(count) for count in value.split(',')],
+        default=BLOB_COUNTS,
+        help='comma separated numbers of blobs in synthetic frames',
+    )
+    parser.add_argument(
+        '--frames', help='directory with recorded JPEG frames'
+    )
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--scale', type=float, default=settings.TARGET_SCALE)
+    parser.add_argument(
+        '--threshold',
+        choices=vision.THRESHOLDINGS,
+        default=settings.TARGET_THRESHOLD,
+        help='threshold with an HSV conversion or a colour table',
+    )
+    parser.add_argument(
+        '--colours',
+        type=int,
+        default=1,
+        help='number of colour classes to detect',
+    )
+    parser.add_argument(
+        '--json', action='store_true', help='print results as JSON'
+    )
+    parser.add_argument(
+        '--tracking',
+        action='store_true',
+        help='compare detecting on every frame with tracking',
+    )
+    parser.add_argument(
+        '--max-frame-ms',
+        type=float,
+        help='exit with an error if any case is slower than this',
+    )
+    return parser.parse_args(args)
+
+
+def cases(options):
+    if options.frames:
+        yield 'recorded', recorded_frames(options.frames)
+        return
+
+    for resolution in options.resolutions:
+        for blobs in options.blobs:
+            name = '{}x{} {} blobs'.format(resolution[0], resolution[1], blobs)
+            yield name, [encode(synthetic_frame(resolution, blobs))]
+
+
+def detector_kwargs(options):
+    return {
+        'scale': options.scale,
+        'thresholding': options.threshold,
+        'colours': benchmark_colours(options.colours),
+    }
+
+
+def report(results):
+    print('{:<24}{:>9}{:>8}'.format('case', 'frame ms', 'fps') + ''.join(
+        '{:>11}'.format(stage) for stage in STAGES
+    ) + '{:>12}'.format('peak KB'))
+
+    for name, result in results:
+        print('{:<24}{:>9.2f}{:>8.1f}'.format(
+            name, result['frame_ms'], result['fps']
+        ) + ''.join(
+            '{:>11.3f}'.format(result['stages_ms'][stage]) for stage in STAGES
+        ) + '{:>12}'.format(
+            '-' if result['peak_memory_kb'] is None
+            else result['peak_memory_kb']
+        ))
+
+
+def report_tracking(results):
+    print('{:<24}{:>11}{:>11}{:>9}{:>7}{:>8}'.format(
+        'case', 'detect ms', 'track ms', 'speedup', 'full', 'window'
+    ))
+    for name, result in results:
+        print('{:<24}{:>11.2f}{:>11.2f}{:>9.1f}{:>7}{:>8}'.format(
+            name,
+            result['detect_frame_ms'],
+            result['track_frame_ms'],
+            result['speedup'],
+            result['full_detections'],
+            result['window_updates'],
+        ))
+
+
+def main_tracking(options):
+    results = [
+        ('{}x{}'.format(*resolution), benchmark_tracking(
+            moving_target_frames(resolution, options.iterations * 5),
+            **detector_kwargs(options)
+        ))
+        for resolution in options.resolutions
+    ]
+    if options.json:
+        print(json.dumps(dict(results), indent=2, sort_keys=True))
+    else:
+        report_tracking(results)
+    return 0
+
+
+def main(args=None):
+    options = parse_args(sys.argv[1:] if args is None else args)
+    if options.tracking:
+        return main_tracking(options)
+    if options.frames and not frame_paths(options.frames):
+        print('No JPEG frames in {}'.format(options.frames), file=sys.stderr)
+        return 1
+
+    results = [
+        (name, benchmark(
+            frames, options.iterations, **detector_kwargs(options)
+        ))
+        for name, frames in cases(options)
+    ]
+
+    if options.json:
+        print(json.dumps(dict(results), indent=2, sort_keys=True))
+    else:
+        report(results)
+
+    if options.max_frame_ms and any(
+            result['frame_ms'] > options.max_frame_ms
+            for _, result in results):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""
+Clocks for time, sleeps and deadlines
+
+Services take a clock instead of calling the time module, RealClock by
+default. VirtualClock time only moves when it's slept on or advanced, so
+tests, simulations and benchmarks run as fast as the code allows rather
+than in wall-clock time.
+"""
+from __future__ import absolute_import
+import ctypes
+import sys
+import time
+
+
+class Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def monotonic_function():
+    """
+    time.monotonic, on Python 2 clock_gettime(CLOCK_MONOTONIC) on Linux, so
+    intervals aren't thrown by the wall clock being stepped (e.g. by NTP)
+    """
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+    if not sys.platform.startswith('linux'):
+        return time.time
+    try:
+        clock_gettime = ctypes.CDLL(None, use_errno=True).clock_gettime
+    except (OSError, AttributeError):
+        return time.time
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(Timespec)]
+    # CLOCK_MONOTONIC
+    clock_id = 1
+
+    def monotonic():
+        timespec = Timespec()
+        if clock_gettime(clock_id, ctypes.byref(timespec)):
+            raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+        return timespec.tv_sec + timespec.tv_nsec * 1e-9
+    return monotonic
+
+
+class Deadline(object):
+    """A point in the clock's monotonic time, None never expires"""
+
+    def __init__(self, clock, seconds=None):
+        self.clock = clock
+        self.at = None if seconds is None else clock.monotonic() + seconds
+
+    def remaining(self):
+        """Returns seconds left (never negative), None if there's no limit"""
+        if self.at is None:
+            return None
+        return max(self.at - self.clock.monotonic(), 0)
+
+    def expired(self):
+        return self.at is not None and self.clock.monotonic() >= self.at
+
+    def sleep(self, seconds):
+        """Sleeps for seconds but not past the deadline"""
+        remaining = self.remaining()
+        if remaining is not None:
+            seconds = min(seconds, remaining)
+        self.clock.sleep(seconds)
+
+
+class Clock(object):
+
+    def time(self):
+        """Returns seconds since the epoch"""
+        raise NotImplementedError
+
+    def monotonic(self):
+        """Returns seconds that never go backwards, for measuring intervals"""
+        raise NotImplementedError
+
+    def sleep(self, seconds):
+        raise NotImplementedError
+
+    def deadline(self, seconds=None):
+        return Deadline(self, seconds)
+
+
+class RealClock(Clock):
+    """Wall-clock time, calls into the time module on every use"""
+
+    def time(self):
+        return time.time()
+
+    monotonic = staticmethod(monotonic_function())
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class VirtualClock(Clock):
+    """Time that only moves when slept on or advanced"""
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        self.now += max(seconds, 0)
+
+
+REAL_CLOCK = RealClock()
@@ -0,0 +1,214 @@
+"""
+End to end latency of published messages
+
+Publishers stamp JSON payloads with a per topic sequence number and the
+capture and publish times under TRACE_KEY. Subscribers pass what they
+receive through a Tracer, which strips the stamp, adds the receive time and
+later processed and actuated stages, keeps latency percentiles per topic
+and stage (all measured from capture), counts sequence gaps and tells
+whether a message is too old to act on.
+
+Stages are wall-clock times, so services on other hosts need their clocks
+in sync. Messages without a stamp (e.g. from cnav-sense or camera file
+paths) only get stages from receive on.
+"""
+from __future__ import absolute_import, division
+from collections import deque, namedtuple
+import logging
+import threading
+
+from cnavbot import clock, metrics, settings
+
+
+logger = logging.getLogger()
+
+TRACE_KEY = '_trace'
+STAGES = ('capture', 'publish', 'receive', 'processed', 'actuated')
+
+LATENCY = metrics.histogram(
+    'cnavbot_message_latency_seconds',
+    'Time from a message being captured to each stage',
+    labels=('topic', 'stage'),
+)
+GAPS = metrics.counter(
+    'cnavbot_message_gaps_total',
+    'Messages missed between two that were received',
+    labels=('topic', ),
+)
+STALE = metrics.counter(
+    'cnavbot_message_stale_total',
+    'Messages rejected for being older than the max age',
+    labels=('topic', ),
+)
+
+Trace = namedtuple('Trace', ('topic', 'sequence', 'stages'))
+
+
+class Stamper(object):
+    """Numbers and timestamps the payloads a service publishes"""
+
+    def __init__(self, *args, **kwargs):
+        self.enabled = kwargs.pop('enabled', settings.MESSAGE_TRACING)
+        self.clock = kwargs.pop('clock', clock.REAL_CLOCK)
+        self.sequences = {}
+
+    def stamp(self, topic, data, captured_at=None):
+        """Adds the trace to a dict payload, returns the payload"""
+        if not self.enabled:
+            return data
+        sequence = self.sequences.get(topic, 0) + 1
+        self.sequences[topic] = sequence
+        now = self.clock.time()
+        data[TRACE_KEY] = {
+            'sequence': sequence,
+            'capture': now if captured_at is None else captured_at,
+            'publish': now,
+        }
+        return data
+
+
+def split(data):
+    """Returns (payload without the trace, trace stamp or None)"""
+    if isinstance(data, dict) and TRACE_KEY in data:
+        data = dict(data)
+        return data, data.pop(TRACE_KEY)
+    return data, None
+
+
+def percentile(values, percent):
+    """Nearest rank percentile of sorted values"""
+    index = max(int(round(percent / 100 * len(values))) - 1, 0)
+    return values[index]
+
+
+class Tracer(object):
+    """Subscriber side of the tracing, safe to share between threads"""
+
+    def __init__(self, *args, **kwargs):
+        # In seconds, 0 for no limit
+        self.max_age = kwargs.pop('max_age', settings.MESSAGE_MAX_AGE)
+        self.window = kwargs.pop('window', settings.MESSAGE_LATENCY_WINDOW)
+        self.report_interval = kwargs.pop(
+            'report_interval', settings.MESSAGE_LATENCY_REPORT_INTERVAL
+        )
+        self.clock = kwargs.pop('clock', clock.REAL_CLOCK)
+        self.lock = threading.Lock()
+        # (topic, stage) to latest latencies
+        self.latencies = {}
+        # Topic to the trace of the latest message received
+        self.current = {}
+        self.gaps = {}
+        self.repeats = {}
+        self.stale = {}
+        self.reported_at = self.clock.monotonic()
+
+    def observe(self, trace, stage, at):
+        """Records stage of the message at time at, holding the lock"""
+        trace.stages[stage] = at
+        start = trace.stages.get('capture', trace.stages.get('receive'))
+        key = (trace.topic, stage)
+        if key not in self.latencies:
+            self.latencies[key] = deque(maxlen=self.window)
+        self.latencies[key].append(at - start)
+        LATENCY.labels(trace.topic, stage).observe(at - start)
+
+    def check_sequence(self, topic, sequence):
+        """Counts messages missed or received again, holding the lock"""
+        last = self.current.get(topic)
+        if sequence is None or last is None or last.sequence is None:
+            return
+        if sequence == last.sequence:
+            self.repeats[topic] = self.repeats.get(topic, 0) + 1
+        elif sequence > last.sequence + 1:
+            missed = sequence - last.sequence - 1
+            self.gaps[topic] = self.gaps.get(topic, 0) + missed
+            GAPS.labels(topic).inc(missed)
+            logger.debug(
+                'Missed %s %s messages before %s', missed, topic, sequence
+            )
+
+    def receive(self, topic, data):
+        """Records the receive stage, returns (payload, trace)"""
+        now = self.clock.time()
+        payload, stamp = split(data)
+        stamp = stamp or {}
+        trace = Trace(topic, stamp.get('sequence'), {})
+
+        with self.lock:
+            self.check_sequence(topic, trace.sequence)
+            for stage in ('capture', 'publish'):
+                if stage in stamp:
+                    self.observe(trace, stage, stamp[stage])
+            self.observe(trace, 'receive', now)
+            self.current[topic] = trace
+        self.maybe_report()
+        return payload, trace
+
+    def mark(self, topic, stage):
+        """Records a later stage of the latest message on topic"""
+        with self.lock:
+            trace = self.current.get(topic)
+            if trace is not None and stage not in trace.stages:
+                self.observe(trace, stage, self.clock.time())
+
+    def age(self, trace):
+        stages = trace.stages
+        return self.clock.time() - stages.get('capture', stages['receive'])
+
+    def fresh(self, trace):
+        """False, and counted as stale, if the message is over max_age"""
+        if not self.max_age or self.age(trace) <= self.max_age:
+            return True
+        with self.lock:
+            self.stale[trace.topic] = self.stale.get(trace.topic, 0) + 1
+        STALE.labels(trace.topic).inc()
+        return False
+
+    def percentiles(self, topic, stage, percents=(50, 90, 99)):
+        """Returns {percent: latency in seconds}, empty if none recorded"""
+        with self.lock:
+            latencies = sorted(self.latencies.get((topic, stage), ()))
+        if not latencies:
+            return {}
+        return {
+            percent: percentile(latencies, percent) for percent in percents
+        }
+
+    @property
+    def stats(self):
+        with self.lock:
+            topics = sorted(set(topic for topic, _ in self.latencies))
+        return {
+            topic: {
+                'stages': {
+                    stage: self.percentiles(topic, stage)
+                    for stage in STAGES
+                    if (topic, stage) in self.latencies
+                },
+                'gaps': self.gaps.get(topic, 0),
+                'repeats': self.repeats.get(topic, 0),
+                'stale': self.stale.get(topic, 0),
+            }
+            for topic in topics
+        }
+
+    def report(self):
+        for topic, stats in sorted(self.stats.items()):
+            logger.info('{} messages: {}, {} gaps, {} stale'.format(
+                topic,
+                ', '.join(
+                    '{} p50 {:.3f}s p99 {:.3f}s'.format(
+                        stage, stats['stages'][stage][50],
+                        stats['stages'][stage][99],
+                    )
+                    for stage in STAGES if stage in stats['stages']
+                ),
+                stats['gaps'],
+                stats['stale'],
+            ))
+
+    def maybe_report(self):
+        now = self.clock.monotonic()
+        if now - self.reported_at >= self.report_interval:
+            self.reported_at = now
+            self.report()
@@ -0,0 +1,208 @@
+"""
+Logging for control loop hot paths
+
+install() puts the root logger in hot path mode: records go onto a queue
+and are formatted and written by a background thread, debug records are
+rate limited per call site so a sensor read in a tight loop can't flood the
+log files, and a ring buffer trace of every record is kept unformatted and
+only written out when an error is logged.
+
+Record args are formatted later on another thread, hot paths should log
+immutable values (numbers, strings, namedtuple readings). The thread doesn't
+survive a fork, so a child process starts its own on the first record it
+logs, e.g. the services the supervisor forks after main installed it.
+"""
+from __future__ import absolute_import
+from collections import deque
+from multiprocessing import util
+from Queue import Full, Queue
+import atexit
+import logging
+import os
+import threading
+import time
+
+from cnavbot import clock
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most rate records per second through from each call site below
+    level, the next one let through says how many were suppressed
+    """
+
+    def __init__(self, rate, level=logging.INFO, clock=clock.REAL_CLOCK):
+        super(RateLimitFilter, self).__init__()
+        self.interval = 1.0 / rate
+        self.level = level
+        self.clock = clock
+        # (path, line) to (last let through at, suppressed since)
+        self.call_sites = {}
+
+    def filter(self, record):
+        if record.levelno >= self.level:
+            return True
+
+        key = (record.pathname, record.lineno)
+        now = self.clock.monotonic()
+        allowed_at, suppressed = self.call_sites.get(key, (None, 0))
+        if allowed_at is not None and now - allowed_at < self.interval:
+            self.call_sites[key] = (allowed_at, suppressed + 1)
+            return False
+
+        self.call_sites[key] = (now, 0)
+        if suppressed:
+            record.msg = '{} ({} similar suppressed)'.format(
+                record.msg, suppressed
+            )
+        return True
+
+
+class QueueHandler(logging.Handler):
+    """
+    Puts records on a queue for a QueueListener, drops them when it's full
+    rather than blocking the caller. In a forked child it moves to a queue
+    and listener of its own, passing records to the listener's handlers.
+    """
+
+    def __init__(self, queue, listener=None):
+        super(QueueHandler, self).__init__()
+        self.queue = queue
+        self.listener = listener
+        self.dropped = 0
+        self.pid = os.getpid()
+
+    def after_fork(self):
+        self.pid = os.getpid()
+        self.queue = Queue(maxsize=self.queue.maxsize)
+        if self.listener is not None:
+            self.listener = start_listener(
+                self.queue, self.listener.handlers
+            )
+
+    def prepare(self, record):
+        if record.exc_info:
+            # Tracebacks can't wait, the frames they refer to change
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info
+            )
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        if self.pid != os.getpid():
+            self.after_fork()
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+
+class QueueListener(threading.Thread):
+    """Passes records from the queue on to handlers in the background"""
+    daemon = True
+    sentinel = None
+
+    def __init__(self, queue, handlers):
+        super(QueueListener, self).__init__(name='log-listener')
+        self.queue = queue
+        self.handlers = handlers
+
+    def handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is self.sentinel:
+                return
+            self.handle(record)
+
+    def stop(self):
+        """Writes out the records still queued"""
+        if not self.is_alive():
+            return
+        self.queue.put(self.sentinel)
+        self.join()
+
+
+def start_listener(queue, handlers):
+    """
+    Starts a QueueListener that's stopped at exit, including the exit of a
+    multiprocessing child, which skips atexit
+    """
+    listener = QueueListener(queue, handlers)
+    listener.start()
+    atexit.register(listener.stop)
+    util.Finalize(None, listener.stop, exitpriority=0)
+    return listener
+
+
+class TraceHandler(logging.Handler):
+    """
+    Keeps the latest records in a ring buffer as unformatted tuples, writes
+    them to path when a record at dump_level or above comes in
+    """
+
+    def __init__(self, size, path, dump_level=logging.ERROR):
+        super(TraceHandler, self).__init__()
+        self.records = deque(maxlen=size)
+        self.path = path
+        self.dump_level = dump_level
+
+    def emit(self, record):
+        self.records.append(
+            (record.created, record.levelname, record.msg, record.args)
+        )
+        if record.levelno >= self.dump_level:
+            try:
+                with open(self.path, 'a') as trace:
+                    self.dump(trace)
+            except Exception:
+                self.handleError(record)
+
+    def dump(self, stream):
+        """Writes out and clears the trace"""
+        stream.write('--- Trace of the last {} records\n'.format(
+            len(self.records)
+        ))
+        while self.records:
+            created, level, message, args = self.records.popleft()
+            message = str(message)
+            if args:
+                message = message % args
+            stream.write('{}.{:03d} {} {}\n'.format(
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created)),
+                int(created % 1 * 1000),
+                level,
+                message,
+            ))
+
+
+def install(logger, debug_rate=0, queue_size=10000, trace_size=0,
+            trace_path=None):
+    """
+    Moves the handlers of logger behind a queue, rate limits records below
+    INFO to debug_rate per second per call site (0 for no limit) and keeps
+    a trace of the last trace_size records (0 for none)
+
+    Returns the QueueListener, which is stopped at exit.
+    """
+    handlers = list(logger.handlers)
+    for handler in handlers:
+        logger.removeHandler(handler)
+
+    queue = Queue(maxsize=queue_size)
+    listener = start_listener(queue, handlers)
+
+    queue_handler = QueueHandler(queue, listener)
+    if debug_rate:
+        queue_handler.addFilter(RateLimitFilter(debug_rate))
+    logger.addHandler(queue_handler)
+    if trace_size:
+        logger.addHandler(TraceHandler(trace_size, trace_path))
+    return listener
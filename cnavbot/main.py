@@ -5,8 +5,9 @@ import logging
 sys.path.append(os.getcwd())
 
 from cnavbot import settings
-from cnavbot.utils import log_exceptions
-from cnavbot.services import bot, bluetooth, camera
+from cnavbot.supervisor import Supervised, Supervisor
+from cnavbot.utils import log_exceptions, log_startup
+from cnavbot.services import bot, bluetooth, camera, position
 
 
 logger = logging.getLogger()
@@ -14,20 +15,43 @@ logger = logging.getLogger()
 
 def run():
     logger.info("Starting...")
+    log_startup('main')
+
+    services = []
 
     if settings.BOT_ENABLED:
-        bot.Service().start()
+        services.append(Supervised(
+            name='bot',
+            start=bot.start,
+            cpus=settings.SUPERVISOR_BOT_CPUS,
+        ))
 
     if settings.BLUETOOTH_ENABLED:
-        bluetooth.Service().start()
+        services.append(Supervised(
+            name='bluetooth',
+            start=bluetooth.start,
+            cpus=settings.SUPERVISOR_BLUETOOTH_CPUS,
+        ))
+
+    if settings.POSITION_ENABLED:
+        services.append(Supervised(
+            name='position',
+            start=position.start,
+            cpus=settings.SUPERVISOR_POSITION_CPUS,
+        ))
 
     if settings.CAMERA_ENABLED:
-        camera.Service().start()
+        services.append(Supervised(
+            name='camera',
+            start=camera.start,
+            cpus=settings.SUPERVISOR_CAMERA_CPUS,
+        ))
 
-    logger.info("Done")
+    Supervisor(services=services).run()
 
 
 if __name__ == '__main__':
+    settings.configure_logging()
     with log_exceptions():
         if settings.RUNNING_ON_PI:
             run()
@@ -0,0 +1,219 @@
+"""
+Minimal in-process Prometheus metrics
+
+Metrics are created with counter(), gauge() and histogram() and exposed by
+serve() on an HTTP endpoint in the Prometheus text format. When metrics are
+disabled the factories return a shared no-op metric, so instrumented hot
+paths only pay for an empty method call.
+"""
+from __future__ import absolute_import
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from bisect import bisect_left
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+from cnavbot import settings
+
+
+logger = logging.getLogger()
+
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, documentation, labels=(), label_values=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        self.label_values = label_values
+        self.lock = threading.Lock()
+        self.children = {}
+
+    def labels(self, *values):
+        """Returns the child metric for the given label values"""
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.__class__(
+                    self.name,
+                    self.documentation,
+                    labels=self.label_names,
+                    label_values=values,
+                    **self.child_kwargs()
+                ))
+        return child
+
+    def child_kwargs(self):
+        return {}
+
+    def format_labels(self, extra=()):
+        pairs = list(zip(self.label_names, self.label_values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(
+            '{}="{}"'.format(name, value) for name, value in pairs
+        ) + '}'
+
+    def samples(self):
+        """Yields (suffix, labels, value) of the metric and its children"""
+        metrics = self.children.values() if self.label_names else (self, )
+        for metric in metrics:
+            for sample in metric.own_samples():
+                yield sample
+
+    def exposition(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.documentation),
+            '# TYPE {} {}'.format(self.name, self.type),
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append('{}{}{} {}'.format(
+                self.name, suffix, labels, float(value)
+            ))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super(Counter, self).__init__(*args, **kwargs)
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def own_samples(self):
+        yield '', self.format_labels(), self.value
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, *args, **kwargs):
+        self.buckets = tuple(kwargs.pop('buckets', DEFAULT_BUCKETS))
+        super(Histogram, self).__init__(*args, **kwargs)
+        # One more for +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def child_kwargs(self):
+        return {'buckets': self.buckets}
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        started_at = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - started_at)
+
+    def own_samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf', ), self.counts):
+            cumulative += count
+            yield '_bucket', self.format_labels(extra=(('le', bound), )), (
+                cumulative
+            )
+        yield '_sum', self.format_labels(), self.sum
+        yield '_count', self.format_labels(), cumulative
+
+
+class NullMetric(object):
+    """Stands in for every metric when metrics are disabled"""
+
+    def labels(self, *values):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+    @contextmanager
+    def time(self):
+        yield
+
+
+NULL_METRIC = NullMetric()
+
+registry = []
+
+
+def register(metric_class, name, documentation, **kwargs):
+    if not settings.METRICS_ENABLED:
+        return NULL_METRIC
+    metric = metric_class(name, documentation, **kwargs)
+    registry.append(metric)
+    return metric
+
+
+def counter(name, documentation, labels=()):
+    return register(Counter, name, documentation, labels=labels)
+
+
+def gauge(name, documentation, labels=()):
+    return register(Gauge, name, documentation, labels=labels)
+
+
+def histogram(name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+    return register(
+        Histogram, name, documentation, labels=labels, buckets=buckets
+    )
+
+
+def exposition():
+    return '\n'.join(metric.exposition() for metric in registry) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = exposition()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port):
+    """Serves the metrics of this process on the port in the background"""
+    if not settings.METRICS_ENABLED:
+        return None
+
+    server = HTTPServer(('', port), MetricsHandler)
+    thread = threading.Thread(
+        target=server.serve_forever, name='metrics-server'
+    )
+    thread.daemon = True
+    thread.start()
+    logger.info('Serving metrics on port {}'.format(port))
+    return server
@@ -0,0 +1,568 @@
+"""
+Record and replay of the bot's sensor, frame and motor streams
+
+With RECORDING_PATH set the bot appends every pi2go motor command and
+sensor reading that changed, cnav-sense reading, beacon scan, position
+estimate and camera frame it processes to a log. Replay reads the log back
+through mmap and stands in for the driver, the sense client and the
+subscribers, so bot modes and detection can be run against a real run on a
+laptop, at recorded speed or as fast as possible:
+
+    $ python -m cnavbot.recording /tmp/run.rec --mode camera
+    $ python -m cnavbot.recording /tmp/run.rec --mode wander --realtime
+
+A log is two files: path holds the payloads back to back after a magic
+header and path.idx one fixed size (timestamp, stream, offset, length)
+entry per record. Stream 0 declares the others as they're first recorded.
+At most RECORDING_FLUSH_INTERVAL of records is lost in a crash, a partly
+written last record is ignored and cut off before the log is appended to.
+
+Replay returns the latest reading recorded at or before replay time, so
+control code reading at other times than the recorded run still sees what
+the bot saw then, which is also why an unchanged sensor reading needn't be
+recorded again. Sensor events from the GPIO backend read the pins directly
+and aren't recorded, record with BOT_SENSOR_BACKEND=polling: its polls
+only add a record when a sensor changes.
+"""
+from __future__ import absolute_import, division, print_function
+from collections import namedtuple
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import timeit
+
+from cnavbot import clock, metrics, settings, simulator
+from cnavbot.services import control
+
+
+cv2 = settings.CV2
+numpy = settings.NUMPY
+
+RECORDS = metrics.counter(
+    'cnavbot_recording_records_total',
+    'Records appended to the recording log',
+    labels=('stream', ),
+)
+
+MAGIC = b'CNAVREC1'
+# Timestamp, stream, payload offset and length
+INDEX_ENTRY = struct.Struct('<dIQI')
+INDEX_DTYPE = [
+    ('timestamp', '<f8'),
+    ('stream', '<u4'),
+    ('offset', '<u8'),
+    ('length', '<u4'),
+]
+# Height, width, channels and encoding
+FRAME_HEADER = struct.Struct('<HHHB')
+FRAME_RAW = 0
+FRAME_JPEG = 1
+
+# Stream of stream declarations
+DECLARATIONS = 0
+KIND_JSON = 'json'
+KIND_FRAME = 'frame'
+
+# Driver functions whose results are recorded, the arguments of the others
+SENSORS = (
+    'irLeft', 'irRight', 'irCentre', 'irAll', 'irLeftLine', 'irRightLine',
+    'getDistance', 'getSwitch',
+)
+# Driver functions that move the bot
+MOTOR_COMMANDS = (
+    'forward', 'reverse', 'spinLeft', 'spinRight', 'turnForward',
+    'turnReverse', 'go', 'stop',
+)
+
+
+def index_path(path):
+    return path + '.idx'
+
+
+def encode_frame(frame, quality=0):
+    """Returns the frame payload, JPEG encoded unless quality is 0"""
+    height, width = frame.shape[:2]
+    channels = frame.shape[2] if frame.ndim == 3 else 1
+    if not quality:
+        return FRAME_HEADER.pack(
+            height, width, channels, FRAME_RAW
+        ) + frame.tobytes()
+    _, encoded = cv2.imencode(
+        '.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality]
+    )
+    return FRAME_HEADER.pack(
+        height, width, channels, FRAME_JPEG
+    ) + encoded.tobytes()
+
+
+def decode_frame(payload):
+    height, width, channels, encoding = FRAME_HEADER.unpack_from(payload)
+    data = numpy.frombuffer(
+        payload, dtype=numpy.uint8, offset=FRAME_HEADER.size
+    )
+    if encoding == FRAME_JPEG:
+        return cv2.imdecode(
+            data, cv2.IMREAD_COLOR if channels == 3 else cv2.IMREAD_GRAYSCALE
+        )
+    shape = (height, width, channels) if channels > 1 else (height, width)
+    return data.reshape(shape)
+
+
+def truncate(path, size):
+    if os.path.exists(path) and os.path.getsize(path) > size:
+        with open(path, 'r+b') as truncated:
+            truncated.truncate(size)
+
+
+def repair(path):
+    """
+    Truncates a log left by a crash to its last complete record, so that
+    records appended to it line up with their index entries again
+    """
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    if size < len(MAGIC):
+        truncate(path, 0)
+        truncate(index_path(path), 0)
+        return
+
+    entries = numpy.zeros(0, dtype=INDEX_DTYPE)
+    if os.path.exists(index_path(path)):
+        with open(index_path(path), 'rb') as index:
+            data = index.read()
+        entries = numpy.frombuffer(
+            data, dtype=INDEX_DTYPE, count=len(data) // INDEX_ENTRY.size
+        )
+    ends = entries['offset'] + entries['length']
+    # Records are appended in order, so keep those before the first one
+    # whose payload didn't make it to the data file
+    incomplete = numpy.flatnonzero(ends > size)
+    count = int(incomplete[0]) if len(incomplete) else len(entries)
+    truncate(index_path(path), count * INDEX_ENTRY.size)
+    truncate(path, int(ends[count - 1]) if count else len(MAGIC))
+
+
+class Recorder(object):
+    """
+    Appends timestamped readings to a log, numpy arrays as frames and
+    anything else as JSON. Safe to share between threads, appends to an
+    existing log rather than replacing it.
+    """
+
+    def __init__(self, path, *args, **kwargs):
+        self.path = path
+        self.frame_quality = kwargs.pop(
+            'frame_quality', settings.RECORDING_FRAME_QUALITY
+        )
+        # In seconds
+        self.flush_interval = kwargs.pop(
+            'flush_interval', settings.RECORDING_FLUSH_INTERVAL
+        )
+        self.clock = kwargs.pop('clock', clock.REAL_CLOCK)
+        self.lock = threading.Lock()
+
+        # Stream name to id
+        self.streams = {}
+        repair(path)
+        if os.path.exists(path) and os.path.getsize(path):
+            with Recording(path) as recording:
+                self.streams = dict(recording.streams)
+
+        self.data = open(path, 'ab')
+        self.index = open(index_path(path), 'ab')
+        self.data.seek(0, os.SEEK_END)
+        if not self.data.tell():
+            self.data.write(MAGIC)
+        self.offset = self.data.tell()
+        self.flushed_at = self.clock.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def stream(self, name, kind, timestamp):
+        """Returns the id of stream name, holding the lock"""
+        if name not in self.streams:
+            self.streams[name] = len(self.streams) + 1
+            self.write(DECLARATIONS, timestamp, json.dumps({
+                'name': name, 'id': self.streams[name], 'kind': kind,
+            }))
+        return self.streams[name]
+
+    def write(self, stream, timestamp, payload):
+        self.data.write(payload)
+        self.index.write(
+            INDEX_ENTRY.pack(timestamp, stream, self.offset, len(payload))
+        )
+        self.offset += len(payload)
+
+    def record(self, name, value):
+        timestamp = self.clock.time()
+        if hasattr(value, 'shape'):
+            kind, payload = KIND_FRAME, encode_frame(value, self.frame_quality)
+        else:
+            kind, payload = KIND_JSON, json.dumps(value)
+
+        with self.lock:
+            self.write(self.stream(name, kind, timestamp), timestamp, payload)
+            now = self.clock.monotonic()
+            if now - self.flushed_at >= self.flush_interval:
+                self.flush()
+                self.flushed_at = now
+        RECORDS.labels(name).inc()
+
+    def flush(self):
+        # Data first, so that the index doesn't point past it
+        self.data.flush()
+        self.index.flush()
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self.data.close()
+            self.index.close()
+
+
+def map_file(path):
+    """Read only mmap of the file, empty string if it's empty"""
+    with open(path, 'rb') as mapped:
+        if not os.fstat(mapped.fileno()).st_size:
+            return b''
+        return mmap.mmap(mapped.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class Recording(object):
+    """Memory mapped log written by a Recorder"""
+
+    def __init__(self, path):
+        self.path = path
+        self.data = map_file(path)
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise Exception("Invalid recording '{}'".format(path))
+
+        self.index = map_file(index_path(path))
+        count = len(self.index) // INDEX_ENTRY.size
+        entries = numpy.zeros(0, dtype=INDEX_DTYPE)
+        if count:
+            entries = numpy.frombuffer(
+                self.index, dtype=INDEX_DTYPE, count=count
+            )
+        # Left by a crash in the middle of writing a record
+        entries = entries[
+            entries['offset'] + entries['length'] <= len(self.data)
+        ]
+
+        # Stream name to id and id to kind and index entries
+        self.streams = {}
+        self.kinds = {}
+        self.entries = {}
+        for entry in entries[entries['stream'] == DECLARATIONS]:
+            declaration = json.loads(self.payload(entry))
+            self.streams[declaration['name']] = declaration['id']
+            self.kinds[declaration['id']] = declaration['kind']
+        for stream in self.streams.values():
+            self.entries[stream] = entries[entries['stream'] == stream]
+
+        recorded = entries[entries['stream'] != DECLARATIONS]
+        self.size = len(recorded)
+        self.start = float(recorded['timestamp'].min()) if self.size else 0.0
+        self.end = float(recorded['timestamp'].max()) if self.size else 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for mapped in (self.data, self.index):
+            if mapped:
+                mapped.close()
+
+    def payload(self, entry):
+        offset = int(entry['offset'])
+        return self.data[offset:offset + int(entry['length'])]
+
+    def count(self, name):
+        """Number of records in stream name"""
+        if name not in self.streams:
+            return 0
+        return len(self.entries[self.streams[name]])
+
+    def read(self, name, position):
+        """Returns (timestamp, value) of the record at position in stream"""
+        stream = self.streams[name]
+        entry = self.entries[stream][position]
+        payload = self.payload(entry)
+        if self.kinds[stream] == KIND_FRAME:
+            return float(entry['timestamp']), decode_frame(payload)
+        return float(entry['timestamp']), json.loads(payload)
+
+    def find(self, name, at):
+        """
+        Position of the latest record of stream name at or before at, the
+        first one if at is earlier
+        """
+        if not self.count(name):
+            raise Exception("Invalid stream '{}', it was never recorded in "
+                            "'{}'".format(name, self.path))
+        timestamps = self.entries[self.streams[name]]['timestamp']
+        return max(int(numpy.searchsorted(timestamps, at, 'right')) - 1, 0)
+
+    def latest(self, name, at):
+        return self.read(name, self.find(name, at))[1]
+
+    def records(self, name):
+        """Yields (timestamp, value) of every record in stream name"""
+        for position in range(self.count(name)):
+            yield self.read(name, position)
+
+
+class RecordingDriver(object):
+    """
+    Wraps the pi2go driver, recording every call made to it except sensor
+    readings unchanged since the last one recorded
+    """
+
+    def __init__(self, driver, recorder):
+        self.driver = driver
+        self.recorder = recorder
+        # Sensor: last reading recorded
+        self.readings = {}
+
+    def __getattr__(self, name):
+        attribute = getattr(self.driver, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args):
+            result = attribute(*args)
+            if name not in SENSORS:
+                self.recorder.record('driver.' + name, list(args))
+            elif name not in self.readings or self.readings[name] != result:
+                self.readings[name] = result
+                self.recorder.record('driver.' + name, result)
+            return result
+        # Motors tell commands apart by name
+        call.__name__ = name
+        return call
+
+
+class RecordingSense(object):
+    """Wraps the cnav-sense client, recording every reading made with it"""
+
+    def __init__(self, sense, recorder):
+        self.sense = sense
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        value = getattr(self.sense, name)
+        if not callable(value):
+            self.recorder.record('sense.' + name, value)
+        return value
+
+
+class ReplayEnded(Exception):
+    """Raised by a Replay once replay time is past the end of the recording"""
+
+
+class Replay(object):
+    """
+    Replay time and the readings recorded at it
+
+    Replay time runs from the start of the recording with clock, a virtual
+    one that moves on only when the bot sleeps unless realtime.
+    """
+
+    def __init__(self, recording, realtime=False):
+        self.recording = recording
+        self.clock = clock.REAL_CLOCK if realtime else clock.VirtualClock()
+        self.started_at = self.clock.monotonic()
+
+    def time(self):
+        return self.recording.start + self.clock.monotonic() - self.started_at
+
+    def now(self):
+        """Replay time, raises ReplayEnded past the end of the recording"""
+        at = self.time()
+        if at > self.recording.end:
+            raise ReplayEnded()
+        return at
+
+    def latest(self, name):
+        return self.recording.latest(name, self.now())
+
+
+class ReplayDriver(object):
+    """
+    Stands in for the pi2go driver, sensor functions return the recorded
+    readings and other calls are kept in commands
+    """
+
+    def __init__(self, replay):
+        self.replay = replay
+        # (replay time, function, args)
+        self.commands = []
+
+    def __getattr__(self, name):
+        if name in SENSORS:
+            def call():
+                return self.replay.latest('driver.' + name)
+        else:
+            def call(*args):
+                self.commands.append((self.replay.time(), name, args))
+        call.__name__ = name
+        return call
+
+
+class ReplaySense(object):
+    """Stands in for the cnav-sense client with the recorded readings"""
+
+    def __init__(self, replay):
+        self.replay = replay
+
+    def display_text(self, text):
+        pass
+
+    def __getattr__(self, name):
+        return self.replay.latest('sense.' + name)
+
+
+Message = namedtuple('Message', ('data', ))
+
+
+class ReplaySubscriber(object):
+    """Receives the latest message recorded in stream name"""
+
+    def __init__(self, replay, name):
+        self.replay = replay
+        self.name = name
+
+    def receive(self):
+        return Message(self.replay.latest(self.name))
+
+
+class ReplayCamera(object):
+    """
+    Stands in for the camera subscriber, and the frame buffer with shared
+    transport, with the recorded frames
+    """
+    name = 'frame'
+
+    def __init__(self, replay, shared=None):
+        self.replay = replay
+        if shared is None:
+            shared = settings.CAMERA_TRANSPORT == (
+                settings.CAMERA_TRANSPORT_SHARED
+            )
+        self.shared = shared
+
+    def receive(self):
+        recording = self.replay.recording
+        position = recording.find(self.name, self.replay.now())
+        if not self.shared:
+            return Message(recording.read(self.name, position)[1])
+        return Message({
+            'slot': position,
+            'sequence': position,
+            'timestamp': recording.read(self.name, position)[0],
+        })
+
+    def read(self, data):
+        return self.replay.recording.read(self.name, data['slot'])[1]
+
+
+# Bot mode steps that can be replayed
+MODES = dict(simulator.MODES, camera='drive_to_next_camera_target')
+
+
+def replay(path, mode, realtime=False, rate=20, bot_kwargs=None):
+    """Runs a bot mode step at rate against a recording, returns stats"""
+    # Imported here so that recordings can be read without the service deps
+    from cnavbot.services import bot
+
+    with Recording(path) as recording:
+        replayed = Replay(recording, realtime=realtime)
+        driver = ReplayDriver(replayed)
+        camera = ReplayCamera(replayed)
+        replay_bot = bot.Bot(
+            driver=driver,
+            clock=replayed.clock,
+            sense=ReplaySense(replayed),
+            camera=camera,
+            bluetooth=ReplaySubscriber(replayed, 'bluetooth'),
+            position=ReplaySubscriber(replayed, 'position'),
+            # Not recording the replay
+            recorder=False,
+            **(bot_kwargs or {})
+        )
+        replay_bot.frame_buffer = camera
+        loop = control.ControlLoop(
+            step=getattr(replay_bot, MODES[mode]),
+            rate=rate,
+            report_interval=float('inf'),
+            clock=replayed.clock,
+        )
+
+        started_at = timeit.default_timer()
+        try:
+            loop.run()
+        except ReplayEnded:
+            pass
+        replay_bot.cleanup()
+
+        stats = {
+            'replayed_seconds': recording.end - recording.start,
+            'wall_seconds': timeit.default_timer() - started_at,
+            'ticks': loop.ticks,
+            'overruns': loop.overruns,
+            'motor_commands': len([
+                command for command in driver.commands
+                if command[1] in MOTOR_COMMANDS
+            ]),
+            'recorded_motor_commands': sum(
+                recording.count('driver.' + name) for name in MOTOR_COMMANDS
+            ),
+        }
+    stats['speedup'] = stats['replayed_seconds'] / stats['wall_seconds']
+    return stats
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('path', help='recording log, see RECORDING_PATH')
+    parser.add_argument('--mode', choices=sorted(MODES), default='camera')
+    parser.add_argument(
+        '--realtime', action='store_true',
+        help='replay at recorded speed rather than as fast as possible',
+    )
+    parser.add_argument(
+        '--json', action='store_true', help='print results as JSON'
+    )
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    options = parse_args(sys.argv[1:] if args is None else args)
+    stats = replay(
+        options.path,
+        options.mode,
+        realtime=options.realtime,
+        bot_kwargs={'publisher': None},
+    )
+
+    if options.json:
+        print(json.dumps(stats, indent=2, sort_keys=True))
+    else:
+        for name, value in sorted(stats.items()):
+            print('{:<24}{:>12.2f}'.format(name, value))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
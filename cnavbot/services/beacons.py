@@ -0,0 +1,133 @@
+from __future__ import absolute_import
+from collections import deque
+import logging
+
+from cnavbot import clock, settings
+
+
+logger = logging.getLogger()
+
+# Fields of an advertisement string returned by the iBeacon scanner:
+# 'mac,uuid,major,minor,txpower,rssi'
+UUID_FIELD = 1
+TXPOWER_FIELD = 4
+RSSI_FIELD = 5
+
+
+class BeaconEstimator(object):
+    """
+    Smoothed RSSI of one beacon, kept across scans
+
+    The last readings are kept in a fixed size ring buffer, a reading
+    further than outlier_threshold median absolute deviations from their
+    median is rejected, the rest feed an exponential moving average.
+    """
+    __slots__ = (
+        'samples', 'alpha', 'outlier_threshold', 'rssi', 'txpower',
+        'updated_at', 'rejected',
+    )
+    # Readings needed before outliers are rejected
+    minimum_samples = 3
+
+    def __init__(self, window, alpha, outlier_threshold):
+        self.samples = deque(maxlen=window)
+        self.alpha = alpha
+        self.outlier_threshold = outlier_threshold
+        self.rssi = None
+        self.txpower = None
+        self.updated_at = None
+        self.rejected = 0
+
+    def is_outlier(self, rssi):
+        if len(self.samples) < self.minimum_samples:
+            return False
+        ordered = sorted(self.samples)
+        median = ordered[len(ordered) // 2]
+        deviations = sorted(abs(sample - median) for sample in ordered)
+        # At least 1 dBm, readings are integers
+        deviation = max(deviations[len(deviations) // 2], 1)
+        return abs(rssi - median) > self.outlier_threshold * deviation
+
+    def update(self, rssi, txpower, now):
+        """Returns False if the reading was rejected as an outlier"""
+        outlier = self.is_outlier(rssi)
+        # Outliers still go to the window so that a real change of signal
+        # strength gets through after a few readings
+        self.samples.append(rssi)
+        if outlier:
+            self.rejected += 1
+            return False
+
+        if self.rssi is None:
+            self.rssi = float(rssi)
+        else:
+            self.rssi += self.alpha * (rssi - self.rssi)
+        self.txpower = txpower
+        self.updated_at = now
+        return True
+
+
+class BeaconFilter(object):
+    """Streams advertisements into per-beacon estimators"""
+
+    def __init__(self, *args, **kwargs):
+        beacons = kwargs.pop('beacons', settings.BEACONS)
+        window = kwargs.pop('window', settings.BLUETOOTH_RSSI_WINDOW)
+        alpha = kwargs.pop('alpha', settings.BLUETOOTH_RSSI_ALPHA)
+        outlier_threshold = kwargs.pop(
+            'outlier_threshold', settings.BLUETOOTH_RSSI_OUTLIER_THRESHOLD
+        )
+        # In seconds, beacons not heard from for this long are dropped
+        self.timeout = kwargs.pop('timeout', settings.BLUETOOTH_BEACON_TIMEOUT)
+        self.clock = kwargs.pop('clock', clock.REAL_CLOCK)
+
+        self.index = {
+            beacon: BeaconEstimator(window, alpha, outlier_threshold)
+            for beacon in beacons
+        }
+        self.changed = set()
+
+    def update(self, advertisement, now=None):
+        """Feeds one raw advertisement string, returns True if it was used"""
+        fields = advertisement.split(',')
+        uuid = fields[UUID_FIELD]
+        estimator = self.index.get(uuid)
+        if estimator is None:
+            return False
+
+        if estimator.update(
+                int(fields[RSSI_FIELD]),
+                int(fields[TXPOWER_FIELD]),
+                now or self.clock.time()):
+            self.changed.add(uuid)
+            return True
+        return False
+
+    @property
+    def rejected(self):
+        return sum(
+            estimator.rejected for estimator in self.index.itervalues()
+        )
+
+    def update_all(self, advertisements):
+        now = self.clock.time()
+        for advertisement in advertisements:
+            self.update(advertisement, now)
+
+    def pop_changed(self):
+        """Returns beacons updated since the last call"""
+        changed, self.changed = self.changed, set()
+        return changed
+
+    def estimates(self, now=None):
+        """
+        Returns the smoothed RSSI and latest txpower of every beacon heard
+        from recently
+        """
+        # Beacons never heard from have no updated_at and compare as stale
+        stale_before = (now or self.clock.time()) - self.timeout
+        return {
+            uuid: {'rssi': estimator.rssi, 'txpower': estimator.txpower}
+            for uuid, estimator in self.index.iteritems()
+            if estimator.updated_at >= stale_before
+        }
@@ -1,6 +1,6 @@
-from collections import defaultdict
+from Queue import Empty, Full, Queue
 import logging
-import time
+import threading
 
 from zmqservices import messages, services, pubsub
 from cnavconstants.publishers import (
@@ -8,14 +8,79 @@ from cnavconstants.publishers import (
 )
 import cnavconstants.topics
 
-from cnavbot import settings
-from cnavbot.utils import log_exceptions
+from cnavbot import clock, latency, metrics, settings
+from cnavbot.services import beacons
+from cnavbot.utils import log_exceptions, log_startup
 
 
-numpy = settings.NUMPY
-
 logger = logging.getLogger()
 
+ADVERTISEMENTS = metrics.counter(
+    'cnavbot_bluetooth_advertisements_total', 'Advertisements received'
+)
+PROCESSED = metrics.counter(
+    'cnavbot_bluetooth_advertisements_processed_total',
+    'Advertisements fed to the beacon filter',
+)
+DROPPED = metrics.counter(
+    'cnavbot_bluetooth_advertisements_dropped_total',
+    'Advertisements dropped because the queue was full',
+)
+REJECTED = metrics.counter(
+    'cnavbot_bluetooth_rejected_total',
+    'Beacon readings rejected as outliers',
+)
+
+
+class AdvertisementReader(threading.Thread):
+    """
+    Reads advertisements off the HCI socket as they arrive
+
+    Advertisements are queued for the publishing loop, when it falls behind
+    and the queue is full new advertisements are dropped and counted.
+    """
+
+    def __init__(self, socket, scanner, *args, **kwargs):
+        queue_size = kwargs.pop('queue_size', settings.BLUETOOTH_QUEUE_SIZE)
+        super(AdvertisementReader, self).__init__(
+            name='hci-reader', *args, **kwargs
+        )
+        self.daemon = True
+        self.socket = socket
+        self.scanner = scanner
+        self.queue = Queue(maxsize=queue_size)
+        self.received = 0
+        self.dropped = 0
+        self.processed = 0
+
+    def read(self):
+        """Blocks until the next HCI event and queues its advertisements"""
+        for advertisement in self.scanner.parse_events(
+                self.socket, loop_count=1):
+            self.received += 1
+            ADVERTISEMENTS.inc()
+            try:
+                self.queue.put_nowait(advertisement)
+            except Full:
+                self.dropped += 1
+                DROPPED.inc()
+
+    def run(self):
+        with log_exceptions():
+            while True:
+                self.read()
+
+    def drain(self):
+        """Yields the queued advertisements without blocking"""
+        while True:
+            try:
+                advertisement = self.queue.get_nowait()
+            except Empty:
+                return
+            self.processed += 1
+            PROCESSED.inc()
+            yield advertisement
+
 
 class Bluetooth(services.PublisherResource):
     topics = {
@@ -27,59 +92,82 @@ class Bluetooth(services.PublisherResource):
 
         self.driver = kwargs.pop('driver', settings.BLUETOOTH_DRIVER)
         self.scanner = kwargs.pop('scanner', settings.IBEACON_SCANNER)
+        self.clock = kwargs.pop('clock', clock.REAL_CLOCK)
+        self.beacons = kwargs.pop('beacons', None) or beacons.BeaconFilter(
+            clock=self.clock
+        )
+        self.stamper = latency.Stamper(clock=self.clock)
+        self.reader = None
+        # Beacons in the last published estimates and when they were sent
+        self.published = None
+        self.published_at = None
 
     def run(self):
         with log_exceptions():
+            metrics.serve(settings.METRICS_BLUETOOTH_PORT)
             self.connect()
+            log_startup(self.__class__.__name__)
             logger.info("Scanning with bluetooth")
+            reported_at = self.clock.monotonic()
 
             while True:
-                time.sleep(settings.BLUETOOTH_SCAN_INTERVAL)
+                self.clock.sleep(settings.BLUETOOTH_PUBLISH_INTERVAL)
+
+                self.publish(self.scan())
 
-                self.publisher.send(messages.JSON(
-                    topic=self.topics['scan'],
-                    data=self.scan(),
-                ))
+                now = self.clock.monotonic()
+                if now - reported_at >= settings.BLUETOOTH_REPORT_INTERVAL:
+                    self.report()
+                    reported_at = now
 
     def connect(self):
         logger.info("Connecting to bluetooth device...")
         self.socket = self.driver.hci_open_dev(0)
         self.scanner.hci_le_set_scan_parameters(self.socket)
         self.scanner.hci_enable_le_scan(self.socket)
+        self.reader = AdvertisementReader(self.socket, self.scanner)
+        self.reader.start()
 
     def scan(self):
-        logger.debug("Scanning with bluetooth...")
-        parsed = [
-            self.parse(result) for result in
-            self.scanner.parse_events(self.socket, loop_count=100)
-        ]
-        return self.filter_beacons(results=parsed)
-
-    @staticmethod
-    def parse(result):
-        mac, uuid, major, minor, txpower, rssi = result.split(",")
-
-        return {
-            'mac': mac,
-            'uuid': uuid,
-            'major': major,
-            'minor': minor,
-            'txpower': txpower,
-            'rssi': rssi,
-        }
-
-    @staticmethod
-    def filter_beacons(results):
-        rssis_per_beacon = defaultdict(list)
-
-        for result in results:
-            if result['uuid'] in settings.BEACONS:
-                rssis_per_beacon[result['uuid']].append(int(result['rssi']))
-
-        return {
-            beacon: numpy.mean(rssis)
-            for beacon, rssis in rssis_per_beacon.iteritems()
-        }
+        """Feeds advertisements read so far to the filter, returns estimates"""
+        rejected = self.beacons.rejected
+        self.beacons.update_all(self.reader.drain())
+        REJECTED.inc(self.beacons.rejected - rejected)
+        return self.beacons.estimates()
+
+    def publish(self, data):
+        """
+        Publishes the estimates when one moved, a beacon expired or
+        BLUETOOTH_REPUBLISH_INTERVAL has passed, returns True if it did
+        """
+        now = self.clock.monotonic()
+        changed = self.beacons.pop_changed()
+        expired = self.published is not None and set(data) != self.published
+        due = self.published_at is None or (
+            now - self.published_at >= settings.BLUETOOTH_REPUBLISH_INTERVAL
+        )
+        if not (changed or expired or due):
+            return False
+
+        self.publisher.send(messages.JSON(
+            topic=self.topics['scan'],
+            # Copied so the trace doesn't count as a published beacon
+            data=self.stamper.stamp(self.topics['scan'], dict(data)),
+        ))
+        self.published = set(data)
+        self.published_at = now
+        return True
+
+    def report(self):
+        logger.info(
+            'Bluetooth: {} advertisements received, {} processed, {} dropped, '
+            '{} beacon readings rejected'.format(
+                self.reader.received,
+                self.reader.processed,
+                self.reader.dropped,
+                self.beacons.rejected,
+            )
+        )
 
 
 class Service(services.PublisherService):
@@ -92,6 +180,7 @@ class Service(services.PublisherService):
 
 
 def start():
+    settings.configure_logging()
     return Service().start()
 
 
@@ -1,3 +1,4 @@
+import functools
 import logging
 import os
 import time
@@ -7,15 +8,25 @@ import cnavconstants.topics
 import cnavconstants.publishers
 import cnavconstants.servers
 
-from cnavbot import settings
-from cnavbot.services import bluetooth, camera, pi2go, sense
-from cnavbot.utils import log_exceptions
+from cnavbot import clock, latency, metrics, recording, settings
+from cnavbot.services import (
+    bluetooth, camera, control, edges, frames, heading, odometry, pi2go,
+    position, sense, vision,
+)
+from cnavbot.utils import log_exceptions, log_startup
 
 cv2 = settings.CV2
-numpy = settings.NUMPY
 
 logger = logging.getLogger()
 
+DETECTION_LATENCY = metrics.histogram(
+    'cnavbot_bot_detection_seconds', 'Time taken to find a target in a frame'
+)
+FRAME_AGE = metrics.histogram(
+    'cnavbot_bot_frame_age_seconds',
+    'Time between a frame being published and the bot reading it',
+)
+
 
 class Bot(services.PublisherResource):
     topics = {
@@ -41,23 +52,74 @@ class Bot(services.PublisherResource):
         super(Bot, self).__init__(*args, **kwargs)
 
         self.driver = kwargs.get('driver', settings.BOT_DRIVER)
+        self.clock = kwargs.get('clock', clock.REAL_CLOCK)
+        self._wire_recording(kwargs.get('recorder'))
         self.driver.init()
 
         self.name = kwargs.get('name', settings.BOT_DEFAULT_NAME)
 
-        self.motors = pi2go.Motors(driver=self.driver)
-        self.lights = pi2go.Lights(driver=self.driver)
-        self.line_sensor = pi2go.LineSensor(driver=self.driver)
-        self.obstacle_sensor = pi2go.ObstacleSensor(driver=self.driver)
+        self._wire_sensors(kwargs.get('edges'))
+        self._wire_tracing(kwargs.get('tracer'))
+
+        drivers = {'driver': self.driver, 'clock': self.clock}
+        self.odometry = odometry.Odometry(clock=self.clock)
+        self.motors = pi2go.Motors(
+            edges=self.edges, listener=self.odometry.command, **drivers
+        )
+        self.lights = pi2go.Lights(**drivers)
+        self.line_sensor = pi2go.LineSensor(edges=self.edges, **drivers)
+        self.obstacle_sensor = pi2go.ObstacleSensor(
+            edges=self.edges, **drivers
+        )
+
+        self.bluetooth = (
+            kwargs.get('bluetooth') or bluetooth.Service.get_subscriber()
+        )
+        self.position = (
+            kwargs.get('position') or position.Service.get_subscriber()
+        )
+        self.camera = kwargs.get('camera') or camera.Service.get_subscriber()
+        self.frame_buffer = None
+        self.detector = None
+        self.tracker = None
+        self.control_loop = None
+
+        self._wire_sense(kwargs.get('sense'))
+
+    def _wire_recording(self, recorder):
+        """False not to record even with RECORDING_PATH set, e.g. replays"""
+        self.recorder = recorder
+        if self.recorder is None and settings.RECORDING_PATH:
+            self.recorder = recording.Recorder(
+                settings.RECORDING_PATH, clock=self.clock
+            )
+        if self.recorder:
+            self.driver = recording.RecordingDriver(self.driver, self.recorder)
+
+    def _wire_sensors(self, sensor_edges):
+        self.edges = sensor_edges
+        if self.edges is None and settings.BOT_SENSOR_EVENTS:
+            self.edges = edges.EdgeSensors(
+                edges.create_backend(self.driver), clock=self.clock
+            )
+        if self.edges is not None:
+            self.edges.start()
 
-        self.bluetooth = bluetooth.Service.get_subscriber()
-        self.camera = camera.Service.get_subscriber()
+    def _wire_tracing(self, tracer):
+        self.tracer = tracer or latency.Tracer(clock=self.clock)
 
-        if settings.CNAV_SENSE_ENABLED:
-            self.sense = sense.Client()
+    def _wire_sense(self, sense_client):
+        self.sense = sense_client
+        if self.sense is None and settings.CNAV_SENSE_ENABLED:
+            self.sense = sense.Client(tracer=self.tracer)
+        if self.sense is not None and self.recorder:
+            self.sense = recording.RecordingSense(self.sense, self.recorder)
 
     def run(self):
         with log_exceptions():
+            metrics.serve(settings.METRICS_BOT_PORT)
+            log_startup(self.__class__.__name__)
+
             if settings.BOT_WAIT_FOR_BUTTON_PRESS:
                 self.wait_till_switch_pressed()
 
@@ -87,11 +149,35 @@ class Bot(services.PublisherResource):
 
     def cleanup(self):
         logger.info('Cleaning up')
+        if self.edges is not None:
+            self.edges.stop()
+        self.motors.close()
         self.driver.cleanup()
+        if self.recorder:
+            self.recorder.close()
+
+    def run_loop(self, step, **kwargs):
+        """Runs the mode step at BOT_CONTROL_LOOP_RATE until interrupted"""
+        self.control_loop = control.ControlLoop(
+            step=functools.partial(step, **kwargs),
+            name=step.__name__,
+            clock=self.clock,
+            # Run the next step as soon as a sensor changes
+            wait=self.edges and self.edges.wait_for_change,
+        )
+        self.control_loop.run()
 
     @property
     def yaw(self):
-        return self.sense.yaw
+        yaw = self.sense.yaw
+        self.odometry.yaw(yaw)
+        self.tracer.mark(cnavconstants.topics.ORIENTATION, 'processed')
+        return yaw
+
+    @property
+    def pose(self):
+        """Dead reckoned position and heading, see odometry.Odometry"""
+        return self.odometry.pose()
 
     def wait_for_joystick_direction(self):
         logger.info('Waiting for direction from the joystick...')
@@ -102,23 +188,77 @@ class Bot(services.PublisherResource):
             if joystick_direction:
                 return joystick_direction
             else:
-                time.sleep(1)
+                self.clock.sleep(1)
+
+    def receive(self, subscriber, topic):
+        """
+        Returns the data of the latest message on topic, waiting for one no
+        older than MESSAGE_MAX_AGE
+        """
+        while True:
+            data, trace = self.tracer.receive(topic, subscriber.receive().data)
+            if self.tracer.fresh(trace):
+                return data
+
+    def record(self, stream, value):
+        """Appends value to the recording if there's one, returns it"""
+        if self.recorder:
+            self.recorder.record(stream, value)
+        return value
 
     @property
     def bluetooth_scan_results(self):
-        return self.bluetooth.receive().data
+        return self.record('bluetooth', self.receive(
+            self.bluetooth, bluetooth.Bluetooth.topics['scan']
+        ))
+
+    @property
+    def position_estimate(self):
+        """Dict with x and y in metres, error and confidence"""
+        return self.record('position', self.receive(
+            self.position, position.Position.topics['position']
+        ))
 
     @property
     def camera_image(self):
-        return self.camera.receive().data
+        """
+        Image file path or, with shared transport, a copy of the frame that
+        the next read reuses
+        """
+        topic = camera.Camera.topics['pictures']
+        if settings.CAMERA_TRANSPORT != settings.CAMERA_TRANSPORT_SHARED:
+            return self.receive(self.camera, topic)
+
+        while True:
+            data = self.receive(self.camera, topic)
+            FRAME_AGE.observe(time.time() - data['timestamp'])
+            if self.frame_buffer is None:
+                self.frame_buffer = self.open_frame_buffer()
+                if self.frame_buffer is None:
+                    continue
+            frame = self.frame_buffer.read(data)
+            if frame is not None:
+                return frame
+
+    def open_frame_buffer(self):
+        """The camera's FrameBuffer, None until the camera has created it"""
+        try:
+            return frames.FrameBuffer()
+        except (EnvironmentError, ValueError) as exception:
+            logger.debug('No frame buffer yet: %s', exception)
+            return None
+
+    @property
+    def lines(self):
+        return self.line_sensor.snapshot(since=self.motors.last_moved)
 
     @property
     def left_line(self):
-        return self.line_sensor.left()
+        return self.lines.left
 
     @property
     def right_line(self):
-        return self.line_sensor.right()
+        return self.lines.right
 
     @property
     def switch_pressed(self):
@@ -134,36 +274,45 @@ class Bot(services.PublisherResource):
             if self.switch_pressed:
                 return
             else:
-                time.sleep(1)
+                self.clock.sleep(1)
+
+    @property
+    def obstacles(self):
+        """Obstacle sensor snapshot, re-read whenever the bot has moved"""
+        return self.obstacle_sensor.snapshot(since=self.motors.last_moved)
 
     @property
     def front_obstacle(self):
-        return self.obstacle_sensor.front()
+        return self.obstacles.front
 
     @property
     def front_obstacle_close(self):
         return self.obstacle_sensor.front_close()
 
+    def front_clear(self):
+        return not self.front_obstacle
+
     @property
     def left_obstacle(self):
-        return self.obstacle_sensor.left()
+        return self.obstacles.left
 
     @property
     def right_obstacle(self):
-        return self.obstacle_sensor.right()
+        return self.obstacles.right
 
     @property
     def any_obstacle(self):
-        return any((
-            self.front_obstacle,
-            self.left_obstacle,
-            self.right_obstacle
-        ))
+        obstacles = self.obstacles
+        return any((obstacles.front, obstacles.left, obstacles.right))
 
     @property
     def distance(self):
         return self.obstacle_sensor.distance()
 
+    @property
+    def closing_velocity(self):
+        return self.obstacle_sensor.closing_velocity()
+
     def avoid_left_obstacle(self):
         step_counter = 0
         while self.left_obstacle:
@@ -171,7 +320,10 @@ class Bot(services.PublisherResource):
             if step_counter >= self.full_spin_steps:
                 logger.warning('Failed to avoid left obstacle')
                 return
-            self.motors.right(steps=self.avoid_obstacle_steps)
+            self.motors.right(
+                steps=self.avoid_obstacle_steps,
+                until=lambda: not self.left_obstacle,
+            )
             step_counter += self.avoid_obstacle_steps
 
     def avoid_right_obstacle(self):
@@ -181,19 +333,33 @@ class Bot(services.PublisherResource):
             if step_counter >= self.full_spin_steps:
                 logger.warning('Failed to avoid right obstacle')
                 return
-            self.motors.left(steps=self.avoid_obstacle_steps)
+            self.motors.left(
+                steps=self.avoid_obstacle_steps,
+                until=lambda: not self.right_obstacle,
+            )
             step_counter += self.avoid_obstacle_steps
 
     def avoid_front_obstacle(self):
         while self.front_obstacle:
             logger.debug('Avoiding front obstacle')
             if not self.right_obstacle:
-                self.motors.right(steps=self.avoid_obstacle_steps)
+                self.motors.right(
+                    steps=self.avoid_obstacle_steps, until=self.front_clear
+                )
             elif not self.left_obstacle:
-                self.motors.left(steps=self.avoid_obstacle_steps)
+                self.motors.left(
+                    steps=self.avoid_obstacle_steps, until=self.front_clear
+                )
+            elif self.front_obstacle_close:
+                self.motors.reverse(
+                    steps=self.avoid_obstacle_steps,
+                    until=lambda: not self.front_obstacle_close,
+                )
             else:
-                while self.front_obstacle_close:
-                    self.motors.reverse(steps=self.avoid_obstacle_steps)
+                # Boxed in by IR, but further than the sonar backs off from
+                self.motors.right(
+                    steps=self.avoid_obstacle_steps, until=self.front_clear
+                )
 
     def avoid_obstacles(self):
         while self.any_obstacle:
@@ -205,12 +371,13 @@ class Bot(services.PublisherResource):
     def wander(self):
         logger.debug('Wandering')
         self.avoid_obstacles()
-        self.motors.forward(steps=self.forward_steps)
+        self.motors.forward(
+            steps=self.forward_steps, until=lambda: self.any_obstacle
+        )
 
     def wander_continuously(self):
         logger.info('Wandering...')
-        while True:
-            self.wander()
+        self.run_loop(self.wander)
 
     def follow_line(self):
         last_left = False
@@ -220,11 +387,17 @@ class Bot(services.PublisherResource):
         elif self.left_line:
             last_left = True
             last_right = False
-            self.motors.right(steps=self.follow_line_steps)
+            self.motors.right(
+                steps=self.follow_line_steps,
+                until=lambda: not self.left_line,
+            )
         elif self.right_line:
             last_right = True
             last_left = False
-            self.motors.left(steps=self.follow_line_steps)
+            self.motors.left(
+                steps=self.follow_line_steps,
+                until=lambda: not self.right_line,
+            )
         elif self.left_line and self.right_line:
             self.reverse(steps=self.avoid_obstacle_steps)
             if last_right:
@@ -234,8 +407,7 @@ class Bot(services.PublisherResource):
 
     def follow_line_continuously(self):
         logger.info('Following line...')
-        while True:
-            self.follow_line()
+        self.run_loop(self.follow_line)
 
     def follow_line_and_avoid_obstacles(self):
         self.avoid_obstacles()
@@ -243,22 +415,23 @@ class Bot(services.PublisherResource):
 
     def follow_line_and_avoid_obstacles_continuously(self):
         logger.info('Following line and avoiding obstacles...')
-        while True:
-            self.follow_line_and_avoid_obstacles()
+        self.run_loop(self.follow_line_and_avoid_obstacles)
 
     def turn_to_direction(
             self,
             direction,
             tolerance=settings.BOT_DIRECTION_TOLERANCE):
 
-        direction_upper = direction + tolerance
-        direction_lower = direction - tolerance
-
-        while not (direction_lower <= self.yaw <= direction_upper):
-            if self.yaw > direction:
-                self.motors.left(steps=0.5)
-            else:
-                self.motors.right(steps=0.5)
+        """Turns the shorter way round to direction, returns turn stats"""
+        controller = heading.HeadingController(
+            tolerance=tolerance, clock=self.clock
+        )
+        return controller.turn(
+            target=direction,
+            read_yaw=lambda: self.yaw,
+            spin=self.motors.spin,
+            stop=self.motors.stop,
+        )
 
     def drive_in_direction(self, direction, initial_direction=None):
         initial_direction = initial_direction or self.yaw
@@ -280,60 +453,48 @@ class Bot(services.PublisherResource):
             direction
         ))
 
-        while True:
-            self.drive_in_direction(direction=direction)
+        self.run_loop(self.drive_in_direction, direction=direction)
+
+    def drive_in_direction_following_line(self, direction):
+        self.drive_in_direction(direction=direction)
+        self.follow_line()
 
     def drive_in_direction_following_line_continuously(self, direction):
         logger.info('Driving in direction following line: {}...'.format(
             direction
         ))
 
-        while True:
-            self.drive_in_direction(direction=direction)
-            self.follow_line()
-
-    def find_target_in_image(self, image_path, delete_image=True):
-        image = cv2.imread(image_path)
-        image = cv2.medianBlur(image, 5)
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
-        target_colour_threshold = cv2.inRange(
-            image,
-            numpy.array(settings.TARGET_COLOUR_LOW),
-            numpy.array(settings.TARGET_COLOUR_HIGH)
-        )
-
-        # Find the contours
-        contours, hierarchy = cv2.findContours(
-            target_colour_threshold,
-            cv2.RETR_LIST,
-            cv2.CHAIN_APPROX_SIMPLE
+        self.run_loop(
+            self.drive_in_direction_following_line, direction=direction
         )
 
-        # Go through each contour
-        found_area = -1
-        found_x = -1
-
-        for contour in contours:
-            x, _, width, height = cv2.boundingRect(contour)
-            cx = x + (width / 2)
-            area = width * height
+    def find_target_in_image(self, image, delete_image=True):
+        """Accepts either an image file path or an already decoded frame"""
+        image_path = None
+        if isinstance(image, basestring):
+            image_path = image
+            image = cv2.imread(image_path)
+        self.record('frame', image)
 
-            if found_area < area:
-                found_area = area
-                found_x = cx
+        with DETECTION_LATENCY.time():
+            target = self.detect_target(image)
+        self.tracer.mark(camera.Camera.topics['pictures'], 'processed')
 
-        if found_area > 0:
-            target = {
-                'x': found_x, 'area': found_area
-            }
-        else:
-            target = None
-
-        if delete_image:
+        if image_path and delete_image:
             os.remove(image_path)
 
         return target
 
+    def detect_target(self, image):
+        if self.detector is None:
+            self.detector = vision.TargetDetector()
+        if not settings.TARGET_TRACKING:
+            return self.detector.detect(image)
+
+        if self.tracker is None:
+            self.tracker = vision.TargetTracker(detector=self.detector)
+        return self.tracker.update(image, self.clock.monotonic())
+
     def turn_to_camera_target(self, target_x):
         image_center_x = settings.CAMERA_RESOLUTION_X / 2.0
         direction = (target_x - image_center_x) / image_center_x
@@ -344,7 +505,7 @@ class Bot(services.PublisherResource):
 
     def search_for_target(self):
         target_found = self.find_target_in_image(
-            image_path=self.camera_image
+            image=self.camera_image
         )
         multiplier = 1
         steps = 1
@@ -358,7 +519,7 @@ class Bot(services.PublisherResource):
             for x in xrange(multiplier):
                 self.motors.right(steps=1)
                 target_found = self.find_target_in_image(
-                    image_path=self.camera_image
+                    image=self.camera_image
                 )
 
             multiplier = multiplier * 2
@@ -367,7 +528,7 @@ class Bot(services.PublisherResource):
                 for x in xrange(multiplier):
                     self.motors.left(steps=1)
                     target_found = self.find_target_in_image(
-                        image_path=self.camera_image
+                        image=self.camera_image
                     )
 
             multiplier = multiplier * 2
@@ -380,19 +541,22 @@ class Bot(services.PublisherResource):
                 self.avoid_obstacles()
                 self.turn_to_camera_target(target['x'])
                 self.motors.forward()
+                self.tracer.mark(camera.Camera.topics['pictures'], 'actuated')
         else:
             logger.info('No targets found')
             self.motors.stop()
+            self.tracer.mark(camera.Camera.topics['pictures'], 'actuated')
             if settings.BOT_SEARCH_FOR_TARGET:
                 self.search_for_target()
 
     def drive_to_camera_target_continuously(self):
         logger.info('Driving to camera target...')
+        self.run_loop(self.drive_to_next_camera_target)
 
-        while True:
-            self.drive_to_camera_target(
-                target=self.find_target_in_image(image_path=self.camera_image)
-            )
+    def drive_to_next_camera_target(self):
+        self.drive_to_camera_target(
+            target=self.find_target_in_image(image=self.camera_image)
+        )
 
 
 class Service(services.PublisherService):
@@ -403,6 +567,7 @@ class Service(services.PublisherService):
 
 
 def start():
+    settings.configure_logging()
     return Service().start()
 
 
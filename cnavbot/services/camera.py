@@ -1,7 +1,6 @@
 import datetime
 import io
 import logging
-import time
 
 from zmqservices import messages, services, pubsub
 from cnavconstants.publishers import (
@@ -9,12 +8,61 @@ from cnavconstants.publishers import (
 )
 import cnavconstants.topics
 
-from cnavbot import settings
-from cnavbot.utils import log_exceptions
+from cnavbot import clock, latency, metrics, settings
+from cnavbot.services import frames
+from cnavbot.utils import log_exceptions, log_startup
 
 
 logger = logging.getLogger()
 
+CAPTURE_LATENCY = metrics.histogram(
+    'cnavbot_camera_capture_seconds', 'Time taken to capture a frame'
+)
+FRAMES = metrics.counter(
+    'cnavbot_camera_frames_total',
+    'Frames captured and published',
+    labels=('state', ),
+)
+FPS = metrics.gauge(
+    'cnavbot_camera_fps', 'Achieved frames per second', labels=('state', )
+)
+
+
+class FrameRate(object):
+    """Measures captured and published frames per second"""
+
+    def __init__(self, report_interval=settings.CAMERA_FPS_REPORT_INTERVAL,
+                 clock=clock.REAL_CLOCK):
+        self.report_interval = report_interval
+        self.captured_fps = 0.0
+        self.published_fps = 0.0
+        self.reset(clock.monotonic())
+
+    def reset(self, now):
+        self.started_at = now
+        self.captured = 0
+        self.published = 0
+
+    def tick(self, now, published):
+        self.captured += 1
+        FRAMES.labels('captured').inc()
+        if published:
+            self.published += 1
+            FRAMES.labels('published').inc()
+
+        elapsed = now - self.started_at
+        if elapsed >= self.report_interval:
+            self.captured_fps = self.captured / elapsed
+            self.published_fps = self.published / elapsed
+            FPS.labels('captured').set(self.captured_fps)
+            FPS.labels('published').set(self.published_fps)
+            logger.info(
+                'Captured {:.1f} fps, published {:.1f} fps'.format(
+                    self.captured_fps, self.published_fps
+                )
+            )
+            self.reset(now)
+
 
 class Camera(services.PublisherResource):
     topics = {
@@ -28,39 +76,126 @@ class Camera(services.PublisherResource):
         self.interval = kwargs.pop('interval', settings.CAMERA_INTERVAL)
         self.resolution = kwargs.pop('resolution', settings.CAMERA_RESOLUTION)
         self.camera = kwargs.pop('camera', settings.CAMERA)
+        self.transport = kwargs.pop('transport', settings.CAMERA_TRANSPORT)
+        self.capture_mode = kwargs.pop(
+            'capture_mode', settings.CAMERA_CAPTURE_MODE
+        )
+        self.framerate = kwargs.pop('framerate', settings.CAMERA_FRAMERATE)
+        self.clock = kwargs.pop('clock', clock.REAL_CLOCK)
+        self.frame_rate = FrameRate(clock=self.clock)
+        self.stamper = latency.Stamper(clock=self.clock)
+        self.frame_buffer = None
 
     def run(self):
         with log_exceptions():
+            metrics.serve(settings.METRICS_CAMERA_PORT)
+
+            if self.transport == settings.CAMERA_TRANSPORT_SHARED:
+                self.frame_buffer = frames.FrameBuffer(
+                    create=True, resolution=self.resolution
+                )
+
             with self.camera.PiCamera() as camera:
                 camera.resolution = self.resolution
-                while True:
-                    time.sleep(self.interval)
-
-                    if self.capture_to_stream:
-                        message = messages.Base64(
-                            topic=self.topics['pictures']
-                        )
-                        destination = io.BytesIO()
-                        capture_args = (destination, 'jpeg')
-                    else:
-                        message = messages.FilePath(
-                            topic=self.topics['pictures']
-                        )
-                        message.set_file_path(file_name=self.get_file_name())
-                        destination = message.file_path
-                        message.data = destination
-                        capture_args = (destination, )
-
-                    self.take_picture(camera, capture_args)
-
-                    if self.capture_to_stream:
-                        message.data = destination.read()
-
-                    self.publisher.send(message)
+                log_startup(self.__class__.__name__)
+
+                if self.capture_mode == settings.CAMERA_CAPTURE_MODE_STREAM:
+                    camera.framerate = self.framerate
+                    self.stream(camera)
+                else:
+                    self.poll(camera)
+
+    def poll(self, camera):
+        """Sleeps and captures from the still port"""
+        while True:
+            self.clock.sleep(self.interval)
+            self.publisher.send(self.capture(camera))
+            self.frame_rate.tick(self.clock.monotonic(), published=True)
+
+    def stream(self, camera):
+        """
+        Captures continuously from the video port, publishing the newest frame
+        once per interval and dropping the rest
+        """
+        if self.frame_buffer is not None:
+            output = frames.FrameOutput(self.frame_buffer)
+            capture_format = 'bgr'
+        else:
+            output = io.BytesIO()
+            capture_format = 'jpeg'
+
+        published_at = 0
+        for _ in camera.capture_continuous(
+                output, capture_format, use_video_port=True):
+            now = self.clock.monotonic()
+            publish = now - published_at >= self.interval
+            if publish:
+                self.publisher.send(self.stream_message(output))
+                published_at = now
+
+            self.frame_rate.tick(now, published=publish)
+            output.seek(0)
+            output.truncate()
+
+    def stream_message(self, output):
+        if self.frame_buffer is not None:
+            return messages.JSON(
+                topic=self.topics['pictures'],
+                data=self.stamper.stamp(
+                    self.topics['pictures'], output.commit()
+                ),
+            )
+        elif self.capture_to_stream:
+            message = messages.Base64(topic=self.topics['pictures'])
+            message.data = output.getvalue()
+            return message
+
+        message = messages.FilePath(topic=self.topics['pictures'])
+        message.set_file_path(file_name=self.get_file_name())
+        message.data = message.file_path
+        with open(message.file_path, 'wb') as picture:
+            picture.write(output.getvalue())
+        return message
+
+    def capture(self, camera):
+        if self.frame_buffer is not None:
+            return self.capture_frame_message(camera)
+        elif self.capture_to_stream:
+            return self.capture_stream_message(camera)
+        return self.capture_file_message(camera)
+
+    def capture_frame_message(self, camera):
+        slot, frame = self.frame_buffer.next_slot()
+        captured_at = self.clock.time()
+        self.take_picture(camera, (frame, 'bgr'))
+
+        return messages.JSON(
+            topic=self.topics['pictures'],
+            data=self.stamper.stamp(
+                self.topics['pictures'],
+                self.frame_buffer.commit(slot),
+                captured_at=captured_at,
+            ),
+        )
+
+    def capture_stream_message(self, camera):
+        message = messages.Base64(topic=self.topics['pictures'])
+        destination = io.BytesIO()
+        self.take_picture(camera, (destination, 'jpeg'))
+        message.data = destination.read()
+        return message
+
+    def capture_file_message(self, camera):
+        message = messages.FilePath(topic=self.topics['pictures'])
+        message.set_file_path(file_name=self.get_file_name())
+        message.data = message.file_path
+        self.take_picture(camera, (message.file_path, ))
+        return message
 
     def take_picture(self, camera, capture_args):
         logger.debug("Taking picture")
-        return camera.capture(*capture_args)
+        with CAPTURE_LATENCY.time():
+            return camera.capture(*capture_args)
 
     @staticmethod
     def get_file_name():
@@ -77,6 +212,7 @@ class Service(services.PublisherService):
 
 
 def start():
+    settings.configure_logging()
     return Service().start()
 
 
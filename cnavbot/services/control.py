@@ -0,0 +1,124 @@
+from __future__ import absolute_import
+import logging
+
+from cnavbot import clock, metrics, settings
+
+
+logger = logging.getLogger()
+
+TICK_LATENCY = metrics.histogram(
+    'cnavbot_control_loop_tick_seconds',
+    'Time taken by a control loop step',
+    labels=('loop', ),
+)
+OVERRUNS = metrics.counter(
+    'cnavbot_control_loop_overruns_total',
+    'Control loop steps that took longer than the tick period',
+    labels=('loop', ),
+)
+
+
+class ControlLoop(object):
+    """
+    Runs a step function at a fixed rate and keeps tick timing stats
+
+    A step that takes longer than the tick period is an overrun: the next
+    tick starts straight away and the schedule is reset rather than trying
+    to catch up. Jitter is how late a tick started compared to schedule.
+    """
+
+    def __init__(self, step, *args, **kwargs):
+        self.step = step
+        self.name = kwargs.pop('name', getattr(step, '__name__', 'loop'))
+        # In Hz, 0 runs steps back to back
+        self.rate = kwargs.pop('rate', settings.BOT_CONTROL_LOOP_RATE)
+        self.period = 1.0 / self.rate if self.rate else 0
+        # In seconds, how often stats are logged
+        self.report_interval = kwargs.pop(
+            'report_interval', settings.BOT_CONTROL_LOOP_REPORT_INTERVAL
+        )
+        self.clock = kwargs.pop('clock', clock.REAL_CLOCK)
+        self.timer = kwargs.pop('timer', self.clock.monotonic)
+        self.sleep = kwargs.pop('sleep', self.clock.sleep)
+        # Called with the time left instead of sleep between ticks, returns
+        # something truthy when it woke up early to run the next tick now
+        self.wait = kwargs.pop('wait', None)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.ticks = 0
+        self.overruns = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.total_jitter = 0.0
+        self.max_jitter = 0.0
+
+    def record(self, scheduled_at, started_at, finished_at):
+        latency = finished_at - started_at
+        jitter = max(started_at - scheduled_at, 0)
+
+        self.ticks += 1
+        TICK_LATENCY.labels(self.name).observe(latency)
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.total_jitter += jitter
+        self.max_jitter = max(self.max_jitter, jitter)
+
+        overrun = self.period and latency > self.period
+        if overrun:
+            self.overruns += 1
+            OVERRUNS.labels(self.name).inc()
+        return overrun
+
+    @property
+    def stats(self):
+        ticks = self.ticks or 1
+        return {
+            'name': self.name,
+            'rate': self.rate,
+            'ticks': self.ticks,
+            'overruns': self.overruns,
+            'mean_latency': self.total_latency / ticks,
+            'max_latency': self.max_latency,
+            'mean_jitter': self.total_jitter / ticks,
+            'max_jitter': self.max_jitter,
+        }
+
+    def report(self):
+        logger.info(
+            '{name} loop: {ticks} ticks at {rate} Hz, {overruns} overruns, '
+            'latency mean {mean_latency:.4f}s max {max_latency:.4f}s, '
+            'jitter mean {mean_jitter:.4f}s max {max_jitter:.4f}s'.format(
+                **self.stats
+            )
+        )
+
+    def tick(self, scheduled_at):
+        """Runs one step, returns when the next one is due"""
+        started_at = self.timer()
+        self.step()
+        finished_at = self.timer()
+
+        if self.record(scheduled_at, started_at, finished_at):
+            return finished_at
+        return scheduled_at + self.period
+
+    def run(self, ticks=None):
+        """Runs the step function forever or for the given number of ticks"""
+        logger.info('Running {} loop at {} Hz'.format(self.name, self.rate))
+        scheduled_at = reported_at = self.timer()
+        last_tick = None if ticks is None else self.ticks + ticks
+
+        while last_tick is None or self.ticks < last_tick:
+            scheduled_at = self.tick(scheduled_at)
+
+            now = self.timer()
+            if now - reported_at >= self.report_interval:
+                self.report()
+                reported_at = now
+
+            if scheduled_at > now:
+                if self.wait is None:
+                    self.sleep(scheduled_at - now)
+                elif self.wait(scheduled_at - now):
+                    scheduled_at = self.timer()
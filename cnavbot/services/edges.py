@@ -0,0 +1,240 @@
+"""
+Interrupt driven IR obstacle and line sensors
+
+EdgeSensors keeps the latest state of every channel and a timestamped queue
+of changes, fed by edge callbacks from a backend: GPIOBackend registers
+RPi.GPIO edge detection on the Pi2Go pins, PollingBackend watches the
+driver from a thread where there are no interrupts (e.g. off the RPi) and
+SimulatedBackend is set by hand in tests. Control code reads the state
+without touching the sensors and can block until something changes.
+"""
+from __future__ import absolute_import
+from collections import deque, namedtuple
+import functools
+import logging
+import threading
+
+from cnavbot import clock, metrics, settings
+from cnavbot.utils import log_exceptions
+
+
+logger = logging.getLogger()
+
+EDGES = metrics.counter(
+    'cnavbot_sensor_edges_total', 'Sensor state changes', labels=('channel', )
+)
+
+Edge = namedtuple('Edge', ('channel', 'detected', 'timestamp'))
+
+# Channel: (pi2go driver function, pi2go pin, whether the driver reading is
+# inverted). The driver functions return True when the pin is pulled low,
+# which is an obstacle for the IR sensors but no line for the line sensors.
+CHANNELS = {
+    'obstacle_left': ('irLeft', 'irFL', False),
+    'obstacle_right': ('irRight', 'irFR', False),
+    'obstacle_front': ('irCentre', 'irMID', False),
+    'line_left': ('irLeftLine', 'lineLeft', True),
+    'line_right': ('irRightLine', 'lineRight', True),
+}
+
+
+def detected(channel, reading):
+    """Turns a driver reading of the channel into True if it sees something"""
+    inverted = CHANNELS[channel][2]
+    return not reading if inverted else reading
+
+
+class GPIOBackend(object):
+    """Edge detection interrupts on the pins of the pi2go driver module"""
+
+    def __init__(self, driver, *args, **kwargs):
+        self.driver = driver
+        self.gpio = driver.GPIO
+        # In milliseconds
+        self.bounce_time = kwargs.pop(
+            'bounce_time', settings.BOT_SENSOR_BOUNCE_TIME
+        )
+
+    def pin(self, channel):
+        return getattr(self.driver, CHANNELS[channel][1])
+
+    def read(self, channel):
+        return detected(channel, self.gpio.input(self.pin(channel)) == 0)
+
+    def start(self, callback):
+        for channel in CHANNELS:
+            self.gpio.add_event_detect(
+                self.pin(channel),
+                self.gpio.BOTH,
+                callback=functools.partial(self.edge, callback, channel),
+                bouncetime=self.bounce_time,
+            )
+
+    def edge(self, callback, channel, pin):
+        # Runs on the RPi.GPIO callback thread
+        callback(channel, self.read(channel))
+
+    def stop(self):
+        for channel in CHANNELS:
+            self.gpio.remove_event_detect(self.pin(channel))
+
+
+class PollingBackend(object):
+    """Reads the driver from a background thread and reports changes"""
+
+    def __init__(self, driver, *args, **kwargs):
+        self.driver = driver
+        # In seconds
+        self.interval = kwargs.pop(
+            'interval', settings.BOT_SENSOR_POLL_INTERVAL
+        )
+        self.clock = kwargs.pop('clock', clock.REAL_CLOCK)
+        self.callback = None
+        self.state = {}
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def read(self, channel):
+        return detected(channel, getattr(self.driver, CHANNELS[channel][0])())
+
+    def poll(self):
+        for channel in CHANNELS:
+            reading = self.read(channel)
+            if reading != self.state.get(channel):
+                self.state[channel] = reading
+                self.callback(channel, reading)
+
+    def run(self):
+        with log_exceptions():
+            while not self.stopped.is_set():
+                self.poll()
+                self.clock.sleep(self.interval)
+
+    def start(self, callback):
+        self.callback = callback
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name='sensor-poller')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+
+class SimulatedBackend(object):
+    """Channels set by hand, set() calls back straight away like an edge"""
+
+    def __init__(self, **states):
+        self.states = dict.fromkeys(CHANNELS, False)
+        self.states.update(states)
+        self.callback = None
+
+    def read(self, channel):
+        return self.states[channel]
+
+    def start(self, callback):
+        self.callback = callback
+
+    def stop(self):
+        self.callback = None
+
+    def set(self, channel, detected):
+        self.states[channel] = detected
+        if self.callback is not None:
+            self.callback(channel, detected)
+
+
+BACKENDS = {
+    settings.BOT_SENSOR_BACKEND_GPIO: GPIOBackend,
+    settings.BOT_SENSOR_BACKEND_POLLING: PollingBackend,
+}
+
+
+def create_backend(driver, name=settings.BOT_SENSOR_BACKEND, **kwargs):
+    if name not in BACKENDS:
+        raise Exception(
+            "Invalid sensor backend '{}', must be one of {}".format(
+                name, sorted(BACKENDS)
+            )
+        )
+    return BACKENDS[name](driver, **kwargs)
+
+
+class EdgeSensors(object):
+    """
+    Latest state of every sensor channel and the queue of changes to it
+
+    Repeated callbacks with an unchanged state (switch bounce, polling) are
+    ignored, so every queued Edge is a real change.
+    """
+
+    def __init__(self, backend, *args, **kwargs):
+        self.backend = backend
+        self.clock = kwargs.pop('clock', clock.REAL_CLOCK)
+        self.events = deque(maxlen=kwargs.pop(
+            'queue_size', settings.BOT_SENSOR_EVENT_QUEUE_SIZE
+        ))
+        self.condition = threading.Condition()
+        self.state = {}
+        # Number of edges since start, including ones dropped from events
+        self.count = 0
+        self.changed_at = None
+
+    def start(self):
+        with self.condition:
+            self.state = {
+                channel: self.backend.read(channel) for channel in CHANNELS
+            }
+            self.changed_at = self.clock.time()
+        self.backend.start(self.edge)
+        logger.info('Watching sensors for changes with {}'.format(
+            self.backend.__class__.__name__
+        ))
+
+    def stop(self):
+        self.backend.stop()
+
+    def edge(self, channel, detected):
+        """Backend callback, may run on an interrupt thread"""
+        with self.condition:
+            if self.state.get(channel) == detected:
+                return
+            edge = Edge(channel, detected, self.clock.time())
+            self.state[channel] = detected
+            self.changed_at = edge.timestamp
+            self.events.append(edge)
+            self.count += 1
+            self.condition.notify_all()
+        EDGES.labels(channel).inc()
+        logger.debug('Sensor edge: %s', edge)
+
+    def detected(self, channel):
+        with self.condition:
+            return self.state[channel]
+
+    def snapshot(self):
+        """Returns (state of every channel, time of the last change)"""
+        with self.condition:
+            return dict(self.state), self.changed_at
+
+    def events_since(self, timestamp):
+        with self.condition:
+            return [edge for edge in self.events if edge.timestamp > timestamp]
+
+    def wait_for_change(self, timeout=None, channels=None):
+        """
+        Blocks until one of channels (any by default) changes, returns the
+        Edge or None on timeout. Waits in real time whatever the clock.
+        """
+        deadline = clock.REAL_CLOCK.deadline(timeout)
+        with self.condition:
+            seen = self.count
+            while True:
+                new = min(self.count - seen, len(self.events))
+                for edge in list(self.events)[len(self.events) - new:]:
+                    if channels is None or edge.channel in channels:
+                        return edge
+                seen = self.count
+                if deadline.expired():
+                    return None
+                self.condition.wait(deadline.remaining())
@@ -0,0 +1,163 @@
+from __future__ import absolute_import
+import logging
+import os
+import time
+
+from cnavbot import settings
+
+
+numpy = settings.NUMPY
+
+logger = logging.getLogger()
+
+
+class FrameBuffer(object):
+    """
+    Ring of raw BGR frames in a memory mapped file (on /dev/shm by default)
+
+    The camera captures straight into one of the slots and publishes only
+    the slot number and sequence number, the bot maps the same file and
+    copies the frame out of the slot - no encoding or disk I/O involved.
+    Each slot's sequence number is -1 while it's being written to, so a
+    frame overwritten while it's copied is dropped rather than torn.
+    """
+    channels = 3
+    # picamera pads unencoded captures to these multiples
+    width_multiple = 32
+    height_multiple = 16
+
+    def __init__(self, create=False, *args, **kwargs):
+        self.path = kwargs.pop('path', settings.FRAME_BUFFER_PATH)
+        self.slots = kwargs.pop('slots', settings.FRAME_BUFFER_SLOTS)
+        width, height = kwargs.pop('resolution', settings.CAMERA_RESOLUTION)
+        self.validate_resolution(width, height)
+        self.shape = (height, width, self.channels)
+
+        header_size = self.slots * numpy.dtype(numpy.int64).itemsize
+        frames_size = self.slots * height * width * self.channels
+
+        if create:
+            # Resized in place, a restarted camera mustn't shrink the file
+            # under the bot's mapping
+            with open(self.path, 'ab') as frame_file:
+                frame_file.truncate(header_size + frames_size)
+
+        mode = 'r+' if create else 'r'
+        self.sequences = numpy.memmap(
+            self.path, dtype=numpy.int64, mode=mode, shape=(self.slots, )
+        )
+        self.frames = numpy.memmap(
+            self.path,
+            dtype=numpy.uint8,
+            mode=mode,
+            offset=header_size,
+            shape=(self.slots, ) + self.shape,
+        )
+        self.sequence = 0
+        # Frames are copied into this by default
+        self.copy = None
+
+    @classmethod
+    def validate_resolution(cls, width, height):
+        if width % cls.width_multiple or height % cls.height_multiple:
+            raise Exception(
+                "Invalid frame resolution '{}x{}', width must be a multiple "
+                "of {} and height a multiple of {}".format(
+                    width, height, cls.width_multiple, cls.height_multiple
+                )
+            )
+
+    @classmethod
+    def exists(cls, path=None):
+        return os.path.exists(path or settings.FRAME_BUFFER_PATH)
+
+    def next_slot(self):
+        """Marks the next slot as being written to and returns its view"""
+        self.sequence += 1
+        slot = self.sequence % self.slots
+        self.sequences[slot] = -1
+        return slot, self.frames[slot]
+
+    def commit(self, slot):
+        """Publishes the slot, returns message data describing the frame"""
+        self.sequences[slot] = self.sequence
+        return {
+            'slot': slot,
+            'sequence': self.sequence,
+            'shape': self.shape,
+            'timestamp': time.time(),
+        }
+
+    def is_current(self, data):
+        """False if the frame has been overwritten since it was published"""
+        return self.sequences[data['slot']] == data['sequence']
+
+    def read(self, data, out=None):
+        """
+        Copies the published frame into out, by default a buffer that the
+        next read reuses. Returns it, None if the frame was overwritten
+        before or while it was copied.
+        """
+        if not self.is_current(data):
+            logger.debug('Frame {} already overwritten'.format(
+                data['sequence']
+            ))
+            return None
+
+        if out is None:
+            if self.copy is None:
+                self.copy = numpy.empty(self.shape, dtype=numpy.uint8)
+            out = self.copy
+        numpy.copyto(out, self.frames[data['slot']])
+
+        if not self.is_current(data):
+            logger.debug('Frame {} overwritten while being read'.format(
+                data['sequence']
+            ))
+            return None
+        return out
+
+    def close(self):
+        del self.frames
+        del self.sequences
+
+
+class FrameOutput(object):
+    """
+    File-like picamera output writing continuous captures into FrameBuffer
+
+    Every capture overwrites the current slot until it's committed, so frames
+    that are not published are dropped rather than queued.
+    """
+
+    def __init__(self, frame_buffer):
+        self.frame_buffer = frame_buffer
+        self.next_slot()
+
+    def next_slot(self):
+        self.slot, frame = self.frame_buffer.next_slot()
+        self.frame = frame.reshape(-1)
+        self.position = 0
+
+    def write(self, data):
+        size = len(data)
+        self.frame[self.position:self.position + size] = numpy.frombuffer(
+            data, dtype=numpy.uint8
+        )
+        self.position += size
+        return size
+
+    def flush(self):
+        pass
+
+    def seek(self, position):
+        self.position = position
+
+    def truncate(self, size=None):
+        pass
+
+    def commit(self):
+        """Publishes the last capture and moves on to the next slot"""
+        data = self.frame_buffer.commit(self.slot)
+        self.next_slot()
+        return data
@@ -0,0 +1,182 @@
+"""
+Closed loop heading control
+
+HeadingController turns the bot to a yaw with a PD controller: spin speed
+is proportional to the wrap-aware heading error, damped by the yaw rate,
+and clamped between a minimum speed that still moves the bot and a maximum
+one. SimulatedHeading stands in for the motors and the compass offline.
+"""
+from __future__ import absolute_import, division
+import logging
+import math
+
+from cnavbot import clock, metrics, settings
+from cnavbot.services.sense import wrap_angle
+
+
+logger = logging.getLogger()
+
+TURN_DURATION = metrics.histogram(
+    'cnavbot_heading_turn_seconds', 'Time taken to turn to a heading'
+)
+TURN_OVERSHOOT = metrics.histogram(
+    'cnavbot_heading_overshoot_degrees',
+    'How far turns went past the target heading',
+    buckets=(1, 2, 5, 10, 20, 45, 90),
+)
+
+
+class HeadingController(object):
+
+    def __init__(self, *args, **kwargs):
+        # Spin speed per degree of error
+        self.kp = kwargs.pop('kp', settings.BOT_HEADING_KP)
+        # Spin speed per degree per second of yaw rate
+        self.kd = kwargs.pop('kd', settings.BOT_HEADING_KD)
+        self.min_speed = kwargs.pop(
+            'min_speed', settings.BOT_HEADING_MIN_SPEED
+        )
+        self.max_speed = kwargs.pop(
+            'max_speed', settings.BOT_HEADING_MAX_SPEED
+        )
+        # In degrees
+        self.tolerance = kwargs.pop(
+            'tolerance', settings.BOT_DIRECTION_TOLERANCE
+        )
+        # In Hz
+        self.rate = kwargs.pop('rate', settings.BOT_HEADING_RATE)
+        # Consecutive ticks within tolerance before the turn is done
+        self.settle_ticks = kwargs.pop(
+            'settle_ticks', settings.BOT_HEADING_SETTLE_TICKS
+        )
+        # In seconds
+        self.timeout = kwargs.pop('timeout', settings.BOT_HEADING_TIMEOUT)
+        self.clock = kwargs.pop('clock', clock.REAL_CLOCK)
+        self.timer = kwargs.pop('timer', self.clock.monotonic)
+        self.sleep = kwargs.pop('sleep', self.clock.sleep)
+        self.last_stats = None
+
+    def speed(self, error, yaw_rate):
+        """Returns signed spin speed, positive turns right"""
+        if abs(error) <= self.tolerance:
+            return 0
+        speed = self.kp * error - self.kd * yaw_rate
+        if abs(speed) < 1:
+            # Damping cancels the error out, coast
+            return 0
+        magnitude = min(max(abs(speed), self.min_speed), self.max_speed)
+        return int(round(math.copysign(magnitude, speed)))
+
+    def turn(self, target, read_yaw, spin, stop):
+        """
+        Turns until yaw settles within tolerance of target or timeout
+
+        Returns stats of the turn: whether it converged, how long it took,
+        number of iterations, overshoot and the final error in degrees.
+        """
+        period = 1.0 / self.rate
+        started_at = previous_at = self.timer()
+        previous_yaw = read_yaw()
+        initial_error = wrap_angle(target - previous_yaw)
+        error = initial_error
+        overshoot = 0.0
+        iterations = settled = 0
+        last_speed = None
+
+        while True:
+            now = self.timer()
+            yaw = read_yaw()
+            error = wrap_angle(target - yaw)
+            elapsed = now - previous_at
+            yaw_rate = 0.0
+            if elapsed > 0:
+                yaw_rate = wrap_angle(yaw - previous_yaw) / elapsed
+            previous_yaw, previous_at = yaw, now
+
+            # Past the target means the error changed sign
+            if error * initial_error < 0:
+                overshoot = max(overshoot, abs(error))
+
+            settled = settled + 1 if abs(error) <= self.tolerance else 0
+            if settled >= self.settle_ticks:
+                break
+            if now - started_at >= self.timeout:
+                logger.warning('Turn to {} timed out at {}'.format(
+                    target, yaw
+                ))
+                break
+
+            speed = self.speed(error, yaw_rate)
+            if speed != last_speed:
+                spin(speed)
+                last_speed = speed
+            iterations += 1
+            self.sleep(max(period - (self.timer() - now), 0))
+
+        stop()
+        duration = self.timer() - started_at
+        TURN_DURATION.observe(duration)
+        TURN_OVERSHOOT.observe(overshoot)
+
+        self.last_stats = {
+            'converged': abs(error) <= self.tolerance,
+            'duration': duration,
+            'iterations': iterations,
+            'overshoot': overshoot,
+            'error': error,
+        }
+        logger.debug(
+            'Turned {initial:.1f} degrees in {duration:.2f}s, '
+            '{iterations} iterations, {overshoot:.1f} overshoot'.format(
+                initial=initial_error, **self.last_stats
+            )
+        )
+        return self.last_stats
+
+
+class SimulatedHeading(object):
+    """
+    Yaw of a bot spinning in place, for testing heading control offline
+
+    Yaw rate follows the commanded speed times gain with a first order lag,
+    speeds below deadband don't move the bot. timer and sleep advance the
+    simulation clock.
+    """
+    # In seconds, integration step
+    resolution = 0.001
+
+    def __init__(self, yaw=0.0, gain=2.0, lag=0.1, deadband=10):
+        self.yaw = yaw
+        # Degrees per second per unit of speed
+        self.gain = gain
+        # In seconds, time constant of the motors
+        self.lag = lag
+        self.deadband = deadband
+        self.yaw_rate = 0.0
+        self.speed = 0
+        self.now = 0.0
+
+    def spin(self, speed):
+        self.speed = speed
+
+    def stop(self):
+        self.speed = 0
+
+    def read_yaw(self):
+        return self.yaw
+
+    def timer(self):
+        return self.now
+
+    def sleep(self, seconds):
+        target_rate = 0.0
+        if abs(self.speed) >= self.deadband:
+            target_rate = self.gain * self.speed
+
+        steps = int(round(seconds / self.resolution))
+        for _ in range(steps):
+            self.yaw_rate += (target_rate - self.yaw_rate) * (
+                self.resolution / self.lag
+            )
+            self.yaw = (self.yaw + self.yaw_rate * self.resolution) % 360
+        self.now += seconds
@@ -0,0 +1,158 @@
+"""
+Dead reckoning from motor commands and compass yaw
+
+Motors report every change of wheel speeds and the pose is integrated up to
+the time it's asked for, so an update is a handful of multiplications
+whatever the rate of commands. The covariance of (x, y, theta) grows with
+distance travelled and turned, yaw samples correct theta (and x, y through
+their correlation with it) with a one dimensional Kalman update.
+
+Distances are in cm, theta in degrees clockwise from the y axis like the
+compass yaw.
+"""
+from __future__ import absolute_import, division
+from collections import namedtuple
+import logging
+import math
+import threading
+
+from cnavbot import clock, settings
+from cnavbot.services.sense import wrap_angle
+
+
+logger = logging.getLogger()
+
+Pose = namedtuple('Pose', ('x', 'y', 'theta', 'covariance', 'timestamp'))
+
+# In degrees^2, any heading is as likely
+UNKNOWN_HEADING_VARIANCE = 180.0 ** 2 / 3
+
+
+def transpose(matrix):
+    return [list(row) for row in zip(*matrix)]
+
+
+def multiply(a, b):
+    return [
+        [sum(a[i][k] * b[k][j] for k in range(len(b)))
+         for j in range(len(b[0]))]
+        for i in range(len(a))
+    ]
+
+
+class Odometry(object):
+
+    def __init__(self, *args, **kwargs):
+        # Wheel speed (-100 to 100) to cm/s and degrees/s of spin
+        self.cm_per_speed = kwargs.pop(
+            'cm_per_speed', settings.BOT_ODOMETRY_CM_PER_SPEED
+        )
+        self.degrees_per_speed = kwargs.pop(
+            'degrees_per_speed', settings.BOT_ODOMETRY_DEGREES_PER_SPEED
+        )
+        # Variance added in cm^2 per cm travelled and degrees^2 per degree
+        # turned
+        self.distance_noise = kwargs.pop(
+            'distance_noise', settings.BOT_ODOMETRY_DISTANCE_NOISE
+        )
+        self.turn_noise = kwargs.pop(
+            'turn_noise', settings.BOT_ODOMETRY_TURN_NOISE
+        )
+        # In degrees^2
+        self.yaw_variance = kwargs.pop(
+            'yaw_variance', settings.BOT_ODOMETRY_YAW_VARIANCE
+        )
+        self.clock = kwargs.pop('clock', clock.REAL_CLOCK)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, x=0.0, y=0.0, theta=None):
+        """Starts again from a known position, heading unknown if None"""
+        with self.lock:
+            self.x, self.y, self.theta = x, y, theta or 0.0
+            self.covariance = [[0.0] * 3 for _ in range(3)]
+            if theta is None:
+                # Taken from the first yaw reading
+                self.covariance[2][2] = UNKNOWN_HEADING_VARIANCE
+            self.left_speed = self.right_speed = 0
+            self.updated_at = self.clock.monotonic()
+            self.distance = 0.0
+
+    def advance(self, now):
+        """Integrates the current wheel speeds up to now, holding the lock"""
+        elapsed = now - self.updated_at
+        self.updated_at = max(now, self.updated_at)
+        if elapsed <= 0 or not (self.left_speed or self.right_speed):
+            return
+
+        distance = (self.left_speed + self.right_speed) / 2 * (
+            self.cm_per_speed * elapsed
+        )
+        turn = (self.left_speed - self.right_speed) / 2 * (
+            self.degrees_per_speed * elapsed
+        )
+        middle = math.radians(self.theta + turn / 2)
+        sin, cos = math.sin(middle), math.cos(middle)
+        self.x += distance * sin
+        self.y += distance * cos
+        self.theta = (self.theta + turn) % 360
+        self.distance += abs(distance)
+
+        # Sensitivity of x, y to theta, in cm per degree
+        jacobian = [
+            [1, 0, math.radians(distance * cos)],
+            [0, 1, -math.radians(distance * sin)],
+            [0, 0, 1],
+        ]
+        covariance = multiply(
+            multiply(jacobian, self.covariance), transpose(jacobian)
+        )
+        # Distance error is along the direction of travel
+        along = self.distance_noise * abs(distance)
+        covariance[0][0] += along * sin * sin
+        covariance[0][1] += along * sin * cos
+        covariance[1][0] += along * sin * cos
+        covariance[1][1] += along * cos * cos
+        covariance[2][2] += self.turn_noise * abs(turn)
+        self.covariance = covariance
+
+    def command(self, left_speed, right_speed, timestamp=None):
+        """Motors listener, called whenever the wheel speeds change"""
+        with self.lock:
+            self.advance(
+                self.clock.monotonic() if timestamp is None else timestamp
+            )
+            self.left_speed, self.right_speed = left_speed, right_speed
+
+    def yaw(self, yaw, timestamp=None):
+        """Corrects the pose with a compass reading"""
+        with self.lock:
+            self.advance(
+                self.clock.monotonic() if timestamp is None else timestamp
+            )
+            covariance = self.covariance
+            gain = [
+                row[2] / (covariance[2][2] + self.yaw_variance)
+                for row in covariance
+            ]
+            innovation = wrap_angle(yaw - self.theta)
+            self.x += gain[0] * innovation
+            self.y += gain[1] * innovation
+            self.theta = (self.theta + gain[2] * innovation) % 360
+            self.covariance = [
+                [covariance[i][j] - gain[i] * covariance[2][j]
+                 for j in range(3)]
+                for i in range(3)
+            ]
+
+    def pose(self):
+        """Returns the pose now, only waits for an update in progress"""
+        with self.lock:
+            self.advance(self.clock.monotonic())
+            return Pose(
+                x=self.x,
+                y=self.y,
+                theta=self.theta,
+                covariance=[list(row) for row in self.covariance],
+                timestamp=self.updated_at,
+            )
@@ -1,25 +1,277 @@
-import time
+from collections import deque, namedtuple
 import logging
+import threading
 
-from cnavbot import settings
+from cnavbot import clock, metrics, settings
+from cnavbot.services import edges
+from cnavbot.utils import log_exceptions
 
 
 logger = logging.getLogger()
 
+SENSOR_READ_LATENCY = metrics.histogram(
+    'cnavbot_sensor_read_seconds',
+    'Time taken to read a sensor snapshot',
+    labels=('sensor', ),
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05),
+)
+STALE_DISTANCE_READS = metrics.counter(
+    'cnavbot_distance_stale_reads_total',
+    'Distance reads that found no recent ping and read the sensor directly',
+)
+MOTOR_COMMANDS = metrics.counter(
+    'cnavbot_motor_commands_total',
+    'Motor commands issued',
+    labels=('command', ),
+)
+
+
+ObstacleReading = namedtuple(
+    'ObstacleReading', ('left', 'right', 'front', 'distance', 'timestamp')
+)
+LineReading = namedtuple('LineReading', ('left', 'right', 'timestamp'))
+DistanceSample = namedtuple('DistanceSample', ('distance', 'timestamp'))
+
+# Wheel directions (left, right) of the driver motor commands
+WHEEL_DIRECTIONS = {
+    'forward': (1, 1),
+    'reverse': (-1, -1),
+    'spinLeft': (-1, 1),
+    'spinRight': (1, -1),
+    'stop': (0, 0),
+}
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
 
 class Driver(object):
 
     def __init__(self, *args, **kwargs):
         self.driver = kwargs.pop('driver', settings.BOT_DRIVER)
+        self.clock = kwargs.pop('clock', clock.REAL_CLOCK)
+
+
+class Completion(object):
+    """Outcome of a timed motor command, set once the motors stop"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.preempted = False
+
+    def done(self):
+        return self.event.is_set()
+
+    def wait(self, timeout=None):
+        """Returns True if the command finished within timeout"""
+        self.event.wait(timeout)
+        return self.done()
+
+    def finish(self, preempted=False):
+        self.preempted = preempted
+        self.event.set()
+
+
+class MotorScheduler(threading.Thread):
+    """
+    Stops the motors in the background once a timed command runs out
+
+    A new command preempts the one that is running, so the caller is free
+    to poll sensors and react while the bot is moving. Deadlines are in the
+    clock's monotonic time, under a virtual clock it's up to whoever
+    advances it to check() them (as Motors.wait does).
+    """
+    daemon = True
+
+    def __init__(self, stop, *args, **kwargs):
+        self.clock = kwargs.pop('clock', clock.REAL_CLOCK)
+        super(MotorScheduler, self).__init__(name='motor-scheduler')
+        self.stop_motors = stop
+        self.condition = threading.Condition()
+        self.deadline = None
+        self.completion = None
+        self.closed = False
+
+    def submit(self, command, duration=None):
+        """
+        Runs command straight away, stops the motors after duration seconds
+        unless another command comes first
+        """
+        completion = Completion()
+        with self.condition:
+            self.preempt()
+            command()
+            if duration:
+                self.deadline = self.clock.monotonic() + duration
+                self.completion = completion
+                self.condition.notify()
+            else:
+                completion.finish()
+        return completion
+
+    def preempt(self):
+        if self.completion is not None:
+            logger.debug('Preempting motor command')
+            self.completion.finish(preempted=True)
+        self.completion = None
+        self.deadline = None
+
+    def remaining(self):
+        """Seconds left of the running command, None if there isn't one"""
+        with self.condition:
+            if self.deadline is None:
+                return None
+            return max(self.deadline - self.clock.monotonic(), 0)
+
+    def expire(self):
+        """Stops the running command if it's run out, holding the lock"""
+        if self.deadline is None or self.clock.monotonic() < self.deadline:
+            return
+        self.stop_motors()
+        self.completion.finish()
+        self.completion = None
+        self.deadline = None
+
+    def check(self):
+        with self.condition:
+            self.expire()
+
+    def close(self):
+        """Drops the running command without stopping, ends the thread"""
+        with self.condition:
+            self.preempt()
+            self.closed = True
+            self.condition.notify()
+
+    def run(self):
+        with self.condition:
+            while not self.closed:
+                self.expire()
+                if self.deadline is None:
+                    self.condition.wait()
+                else:
+                    # Waits in real time, the deadline is re-checked against
+                    # the clock on waking
+                    self.condition.wait(
+                        self.deadline - self.clock.monotonic()
+                    )
+
+
+class DistanceSampler(threading.Thread):
+    """
+    Pings the ultrasonic sensor at a fixed rate in the background
+
+    The last window pings are kept in a ring buffer. Reads return straight
+    away with the median distance, which ignores the odd missed echo, and
+    the closing velocity as the median slope between pairs of pings. Once
+    the latest ping is older than max_age (e.g. the thread died) the pings
+    are stale and reads return None.
+    """
+    daemon = True
+
+    def __init__(self, read_distance, *args, **kwargs):
+        # In Hz
+        self.rate = kwargs.pop('rate', settings.BOT_DISTANCE_RATE)
+        window = kwargs.pop('window', settings.BOT_DISTANCE_WINDOW)
+        # In seconds
+        self.max_age = kwargs.pop('max_age', settings.BOT_DISTANCE_MAX_AGE)
+        self.clock = kwargs.pop('clock', clock.REAL_CLOCK)
+        super(DistanceSampler, self).__init__(name='distance-sampler')
+        self.read_distance = read_distance
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+
+    def sample(self):
+        with SENSOR_READ_LATENCY.labels('distance').time():
+            distance = self.read_distance()
+        with self.lock:
+            self.samples.append(
+                DistanceSample(distance, self.clock.monotonic())
+            )
+        self.ready.set()
+
+    def run(self):
+        period = 1.0 / self.rate
+        with log_exceptions():
+            while True:
+                started_at = self.clock.monotonic()
+                self.sample()
+                self.clock.sleep(
+                    max(period - (self.clock.monotonic() - started_at), 0)
+                )
+
+    def age(self):
+        """Seconds since the latest ping, None before the first one"""
+        with self.lock:
+            if not self.samples:
+                return None
+            latest = self.samples[-1].timestamp
+        return self.clock.monotonic() - latest
+
+    def stale(self):
+        age = self.age()
+        return age is None or age > self.max_age
+
+    def distance(self, timeout=None):
+        """
+        Median distance in cm, None if the pings are stale. Waits up to
+        timeout (max_age by default) for the first ping.
+        """
+        self.ready.wait(self.max_age if timeout is None else timeout)
+        if self.stale():
+            return None
+        with self.lock:
+            distances = [sample.distance for sample in self.samples]
+        return median(distances) if distances else None
+
+    def closing_velocity(self):
+        """In cm/s, positive when getting closer"""
+        with self.lock:
+            samples = list(self.samples)
+        slopes = [
+            (later.distance - earlier.distance) / (
+                later.timestamp - earlier.timestamp
+            )
+            for i, earlier in enumerate(samples)
+            for later in samples[i + 1:]
+            if later.timestamp > earlier.timestamp
+        ]
+        return -median(slopes) if slopes else 0.0
 
 
 class Motors(Driver):
+    # In seconds
+    step_duration = 0.1
 
     def __init__(self, speed=None, *args, **kwargs):
         super(Motors, self).__init__(*args, **kwargs)
         self.speed = kwargs.pop('speed', settings.BOT_DEFAULT_SPEED)
         self.validate_speed(self.speed)
         logger.info('Speed set to {}'.format(self.speed))
+        # Sensor readings taken before this are stale
+        self.last_moved = 0
+
+        self.scheduler = None
+        if kwargs.pop('asynchronous', settings.BOT_ASYNC_MOTORS):
+            self.scheduler = MotorScheduler(
+                stop=self.stop_now, clock=self.clock
+            )
+            self.scheduler.start()
+        # In seconds, how often until() is checked while waiting for a move
+        self.poll_interval = kwargs.pop(
+            'poll_interval', settings.BOT_MOTORS_POLL_INTERVAL
+        )
+        # EdgeSensors to wake up on while waiting, None to poll
+        self.edges = kwargs.pop('edges', None)
+        # Called with (left speed, right speed, timestamp) whenever the
+        # wheel speeds change, e.g. by odometry
+        self.listener = kwargs.pop('listener', None)
 
     @staticmethod
     def validate_speed(speed):
@@ -30,46 +282,126 @@ class Motors(Driver):
                 )
             )
 
-    def forward(self, steps=None):
+    def forward(self, steps=None, until=None, wait=True):
         """Sets both motors to go forward"""
         logger.debug('Going forward')
-        self.driver.forward(self.speed)
-
-        if steps:
-            self.keep_running(steps)
+        return self.move(self.driver.forward, steps, until, wait)
 
-    def reverse(self, steps=None):
+    def reverse(self, steps=None, until=None, wait=True):
         """Sets both motors to reverse"""
         logger.debug('Reversing')
-        self.driver.reverse(self.speed)
+        return self.move(self.driver.reverse, steps, until, wait)
 
-        if steps:
-            self.keep_running(steps)
-
-    def left(self, steps=None):
+    def left(self, steps=None, until=None, wait=True):
         """Sets motors to turn opposite directions for left spin"""
         logger.debug('Spinning left')
-        self.driver.spinLeft(self.speed)
-
-        if steps:
-            self.keep_running(steps)
+        return self.move(self.driver.spinLeft, steps, until, wait)
 
-    def right(self, steps=None):
+    def right(self, steps=None, until=None, wait=True):
         """Sets motors to turn opposite directions for right spin"""
         logger.debug('Spinning right')
-        self.driver.spinRight(self.speed)
+        return self.move(self.driver.spinRight, steps, until, wait)
+
+    def spin(self, speed):
+        """
+        Spins right at a positive speed, left at a negative one and stops at
+        0, until the next command
+        """
+        if not speed:
+            return self.stop()
+        self.validate_speed(abs(speed))
+        if speed > 0:
+            command = self.driver.spinRight
+        else:
+            command = self.driver.spinLeft
+        return self.move(command, speed=abs(speed))
+
+    def move(self, command, steps=None, until=None, wait=True, speed=None):
+        """
+        Runs the motor command at speed (self.speed by default), for the
+        given number of steps if set.
 
-        if steps:
-            self.keep_running(steps)
+        With the scheduler the move runs in the background: the returned
+        Completion is waited for (unless wait is False) and the move is cut
+        short as soon as until() returns True. Without it the call blocks
+        for the whole move and until is ignored.
+        """
+        name = getattr(command, '__name__', 'move')
+        MOTOR_COMMANDS.labels(name).inc()
+
+        speed = speed or self.speed
+
+        def run():
+            command(speed)
+            self.moved(name, speed)
+
+        if self.scheduler is None:
+            run()
+            if steps:
+                self.keep_running(steps)
+            return None
+
+        duration = self.step_duration * steps if steps else None
+        completion = self.scheduler.submit(run, duration=duration)
+        if wait:
+            self.wait(completion, until=until)
+        return completion
+
+    def wait(self, completion, until=None):
+        while not self.wait_step(completion):
+            if until is not None and until():
+                logger.debug('Move interrupted')
+                self.stop()
+                return
+
+    def wait_step(self, completion):
+        """
+        Returns True if the move finished within poll_interval, returns
+        early when a sensor changes
+        """
+        if self.edges is None:
+            # On the clock, so simulated moves take simulated time
+            remaining = self.scheduler and self.scheduler.remaining()
+            self.clock.sleep(
+                self.poll_interval if remaining is None
+                else min(self.poll_interval, remaining)
+            )
+        else:
+            self.edges.wait_for_change(timeout=self.poll_interval)
+        if self.scheduler is not None:
+            self.scheduler.check()
+        return completion.done()
 
     def keep_running(self, steps):
-        logger.debug('Keeping running for {} steps'.format(steps))
-        time.sleep(0.1 * steps)
+        logger.debug('Keeping running for %s steps', steps)
+        self.clock.sleep(self.step_duration * steps)
         self.stop()
 
+    def close(self):
+        """Ends the scheduler thread, if there's one"""
+        if self.scheduler is not None:
+            self.scheduler.close()
+
     def stop(self):
         logger.debug('Stopping')
+        if self.scheduler is None:
+            self.stop_now()
+        else:
+            self.scheduler.submit(self.stop_now)
+
+    def stop_now(self):
+        MOTOR_COMMANDS.labels('stop').inc()
         self.driver.stop()
+        self.moved('stop', 0)
+
+    def moved(self, name, speed):
+        self.last_moved = self.clock.time()
+        directions = WHEEL_DIRECTIONS.get(name)
+        if self.listener is not None and directions is not None:
+            left, right = directions
+            self.listener(
+                left * speed, right * speed, self.clock.monotonic()
+            )
 
 
 class Lights(Driver):
@@ -87,9 +419,10 @@ class Lights(Driver):
     def set_led_rbg(self, led_number, red, blue, green):
         """Spins right specified number of steps"""
         self.validate_led_number(led_number)
-        logger.debug('Setting LED {} to red: {}, green: {}. blue: {}'.format(
-            led_number, red, green, blue
-        ))
+        logger.debug(
+            'Setting LED %s to red: %s, green: %s. blue: %s',
+            led_number, red, green, blue,
+        )
         self.driver.setLED(led_number, red, green, blue)
 
     def set_all_leds_rbg(self, red, blue, green):
@@ -98,7 +431,39 @@ class Lights(Driver):
             self.driver.setLED(led_number, red, green, blue)
 
 
-class ObstacleSensor(Driver):
+class Sensor(Driver):
+
+    def __init__(self, *args, **kwargs):
+        super(Sensor, self).__init__(*args, **kwargs)
+        # In seconds, how long a snapshot can be reused for
+        self.max_age = kwargs.pop('max_age', settings.BOT_SENSOR_MAX_AGE)
+        # EdgeSensors kept up to date by edge callbacks, None to read the
+        # driver
+        self.edges = kwargs.pop('edges', None)
+        self.last_snapshot = None
+
+    def read(self, channel, function):
+        """Returns True if the channel sees something"""
+        if self.edges is not None:
+            return self.edges.detected(channel)
+        return edges.detected(channel, function())
+
+    def is_fresh(self, reading, since=None):
+        """
+        True if the reading is younger than max_age and was taken after since
+        """
+        if reading is None:
+            return False
+        if since is not None and reading.timestamp <= since:
+            return False
+        if self.edges is not None and (
+                reading.timestamp <= self.edges.changed_at):
+            # A sensor changed since
+            return False
+        return self.clock.time() - reading.timestamp <= self.max_age
+
+
+class ObstacleSensor(Sensor):
 
     def __init__(self, *args, **kwargs):
         super(ObstacleSensor, self).__init__(*args, **kwargs)
@@ -107,55 +472,114 @@ class ObstacleSensor(Driver):
         )
         logger.info('Max distance set to {}'.format(self.max_distance))
 
+        self.sampler = None
+        if kwargs.pop('sample_distance', settings.BOT_DISTANCE_SAMPLING):
+            self.sampler = DistanceSampler(
+                self.driver.getDistance, clock=self.clock
+            )
+            self.sampler.start()
+
     def left(self):
         """Returns true if there is an obstacle to the left"""
-        obstacle = self.driver.irLeft()
-        logger.debug('Left obstacle: {}'.format(obstacle))
+        obstacle = self.read('obstacle_left', self.driver.irLeft)
+        logger.debug('Left obstacle: %s', obstacle)
         return obstacle
 
     def right(self):
         """Returns true if there is an obstacle to the right"""
-        obstacle = self.driver.irRight()
-        logger.debug('Right obstacle: {}'.format(obstacle))
+        obstacle = self.read('obstacle_right', self.driver.irRight)
+        logger.debug('Right obstacle: %s', obstacle)
         return obstacle
 
     def front(self):
         """Returns true if there is an obstacle in front"""
-        obstacle = self.driver.irCentre()
-        logger.debug('Front obstacle: {}'.format(obstacle))
+        obstacle = self.read('obstacle_front', self.driver.irCentre)
+        logger.debug('Front obstacle: %s', obstacle)
         return obstacle
 
     def front_close(self):
         front_close = self.distance() <= self.max_distance
-        logger.debug('Front obstacle close: {}'.format(front_close))
+        logger.debug('Front obstacle close: %s', front_close)
         return front_close
 
     def distance(self):
         """
         Returns the distance in cm to the nearest reflecting object
-        in front of the bot
+        in front of the bot, the median of the latest pings when sampling
         """
-        distance = self.driver.getDistance()
-        logger.debug('Distance: {}'.format(distance))
+        distance = None
+        if self.sampler is not None:
+            distance = self.sampler.distance()
+            if distance is None:
+                logger.debug('Distance pings are stale, reading directly')
+                STALE_DISTANCE_READS.inc()
+        if distance is None:
+            with SENSOR_READ_LATENCY.labels('distance').time():
+                distance = self.driver.getDistance()
+        logger.debug('Distance: %s', distance)
         return distance
 
+    def closing_velocity(self):
+        """
+        Returns how fast in cm/s the bot is getting closer to what's in
+        front of it, None unless sampling with recent pings
+        """
+        if self.sampler is None or self.sampler.stale():
+            return None
+        return self.sampler.closing_velocity()
+
     def any(self):
         """Returns true if there is any obstacle"""
         any_obstacle = self.driver.irAll()
-        logger.debug('Any obstacle: {}'.format(any_obstacle))
+        logger.debug('Any obstacle: %s', any_obstacle)
         return any_obstacle
 
+    def snapshot(self, distance=False, since=None):
+        """
+        Reads all IR channels (and the distance if requested) in one go,
+        reuses the last snapshot while it's fresh
+        """
+        last = self.last_snapshot
+        if self.is_fresh(last, since) and not (
+                distance and last.distance is None):
+            return last
+
+        with SENSOR_READ_LATENCY.labels('obstacle').time():
+            self.last_snapshot = ObstacleReading(
+                left=self.read('obstacle_left', self.driver.irLeft),
+                right=self.read('obstacle_right', self.driver.irRight),
+                front=self.read('obstacle_front', self.driver.irCentre),
+                distance=self.distance() if distance else None,
+                timestamp=self.clock.time(),
+            )
+        logger.debug('Obstacles: %s', self.last_snapshot)
+        return self.last_snapshot
+
 
-class LineSensor(Driver):
+class LineSensor(Sensor):
 
     def left(self):
         """Returns True if left line sensor detected dark line"""
-        left = not self.driver.irLeftLine()
-        logger.debug('Left line detected: {}'.format(left))
+        left = self.read('line_left', self.driver.irLeftLine)
+        logger.debug('Left line detected: %s', left)
         return left
 
     def right(self):
         """Returns True if right line sensor detected dark line"""
-        right = not self.driver.irRightLine()
-        logger.debug('Right line detected: {}'.format(right))
+        right = self.read('line_right', self.driver.irRightLine)
+        logger.debug('Right line detected: %s', right)
         return right
+
+    def snapshot(self, since=None):
+        """Reads both line sensors, reuses the last snapshot while fresh"""
+        if self.is_fresh(self.last_snapshot, since):
+            return self.last_snapshot
+
+        with SENSOR_READ_LATENCY.labels('line').time():
+            self.last_snapshot = LineReading(
+                left=self.read('line_left', self.driver.irLeftLine),
+                right=self.read('line_right', self.driver.irRightLine),
+                timestamp=self.clock.time(),
+            )
+        logger.debug('Lines: %s', self.last_snapshot)
+        return self.last_snapshot
@@ -0,0 +1,189 @@
+"""
+Estimates the bot position from bluetooth beacon signal strength
+
+Smoothed RSSI published by the bluetooth service is turned into distances
+with a log-distance path loss model and the 2D position is solved for by
+linear least squares over every beacon heard, together with a confidence
+value derived from how well the distances agree.
+"""
+from __future__ import absolute_import, division
+import logging
+
+from zmqservices import messages, services, pubsub
+from cnavconstants.publishers import LOCAL_BLUETOOTH_ADDRESS
+
+from cnavbot import clock, latency, metrics, settings
+from cnavbot.services import bluetooth
+from cnavbot.utils import log_exceptions, log_startup
+
+
+numpy = settings.NUMPY
+
+logger = logging.getLogger()
+
+SOLVE_LATENCY = metrics.histogram(
+    'cnavbot_position_solve_seconds', 'Time taken to estimate the position'
+)
+CONFIDENCE = metrics.gauge(
+    'cnavbot_position_confidence', 'Confidence of the last position estimate'
+)
+
+
+class PathLossModel(object):
+    """
+    rssi = txpower + offset - 10 * exponent * log10(distance)
+
+    iBeacon txpower is the RSSI measured at 1 metre, offset corrects it for
+    the receiver and exponent depends on the environment.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.exponent = kwargs.pop(
+            'exponent', settings.POSITION_PATH_LOSS_EXPONENT
+        )
+        self.offset = kwargs.pop('offset', settings.POSITION_TXPOWER_OFFSET)
+
+    def distance(self, rssi, txpower):
+        """Returns distance in metres, works on scalars and arrays"""
+        return 10 ** ((txpower + self.offset - rssi) / (10 * self.exponent))
+
+    def calibrate(self, rssi, txpower, distance):
+        """Fits exponent and offset to readings taken at known distances"""
+        loss = numpy.asarray(txpower, float) - numpy.asarray(rssi, float)
+        design = numpy.column_stack((
+            10 * numpy.log10(distance), -numpy.ones(len(loss))
+        ))
+        solution = numpy.linalg.lstsq(design, loss, rcond=None)[0]
+        self.exponent, self.offset = float(solution[0]), float(solution[1])
+        logger.info('Calibrated path loss exponent {}, offset {}'.format(
+            self.exponent, self.offset
+        ))
+
+
+class Trilateration(object):
+    """Solves for the position given distances to beacons at known places"""
+    minimum_beacons = 3
+
+    def __init__(self, *args, **kwargs):
+        positions = kwargs.pop('positions', settings.BEACON_POSITIONS)
+        self.model = kwargs.pop('model', None) or PathLossModel()
+        # In metres
+        self.confidence_scale = kwargs.pop(
+            'confidence_scale', settings.POSITION_CONFIDENCE_SCALE
+        )
+
+        beacons = list(positions)
+        self.index = {beacon: i for i, beacon in enumerate(beacons)}
+        self.positions = numpy.array(
+            [positions[beacon] for beacon in beacons], dtype=float
+        )
+        self.squared_norms = (self.positions ** 2).sum(axis=1)
+
+    def solve(self, indices, distances):
+        """
+        Returns (position, rms residual in metres) for beacons at indices
+
+        Subtracting the circle equation of the last beacon from the others
+        leaves a linear system in x and y.
+        """
+        positions = self.positions[indices]
+        norms = self.squared_norms[indices]
+
+        design = 2 * (positions[:-1] - positions[-1])
+        target = (
+            distances[-1] ** 2 - distances[:-1] ** 2 + norms[:-1] - norms[-1]
+        )
+        position = numpy.linalg.lstsq(design, target, rcond=None)[0]
+
+        ranges = numpy.sqrt(((positions - position) ** 2).sum(axis=1))
+        residual = numpy.sqrt(((ranges - distances) ** 2).mean())
+        return position, residual
+
+    def locate(self, scan):
+        """
+        Returns position with confidence for a bluetooth scan, None when
+        fewer than minimum_beacons known beacons were heard
+        """
+        beacons = [beacon for beacon in scan if beacon in self.index]
+        if len(beacons) < self.minimum_beacons:
+            return None
+
+        with SOLVE_LATENCY.time():
+            distances = self.model.distance(
+                numpy.array([scan[beacon]['rssi'] for beacon in beacons]),
+                numpy.array([scan[beacon]['txpower'] for beacon in beacons]),
+            )
+            position, residual = self.solve(
+                [self.index[beacon] for beacon in beacons], distances
+            )
+
+        confidence = float(numpy.exp(-residual / self.confidence_scale))
+        CONFIDENCE.set(confidence)
+        return {
+            'x': float(position[0]),
+            'y': float(position[1]),
+            'error': float(residual),
+            'confidence': confidence,
+            'beacons': len(beacons),
+        }
+
+
+class Position(services.PublisherResource):
+    topics = {
+        'position': settings.POSITION_TOPIC,
+    }
+
+    def __init__(self, *args, **kwargs):
+        super(Position, self).__init__(*args, **kwargs)
+
+        self.bluetooth = kwargs.pop('bluetooth', None)
+        if self.bluetooth is None:
+            self.bluetooth = bluetooth.Service.get_subscriber()
+        self.trilateration = kwargs.pop('trilateration', Trilateration())
+        self.clock = kwargs.pop('clock', clock.REAL_CLOCK)
+        self.stamper = latency.Stamper(clock=self.clock)
+
+    def run(self):
+        with log_exceptions():
+            metrics.serve(settings.METRICS_POSITION_PORT)
+            log_startup(self.__class__.__name__)
+            logger.info("Estimating position from bluetooth beacons")
+
+            while True:
+                self.clock.sleep(settings.BLUETOOTH_PUBLISH_INTERVAL)
+                self.update()
+
+    def update(self):
+        """Publishes the position for the latest scan if it can be solved"""
+        scan, trace = latency.split(self.bluetooth.receive().data)
+        position = self.trilateration.locate(scan)
+        if position is not None:
+            self.publisher.send(messages.JSON(
+                topic=self.topics['position'],
+                # Copied so the returned position isn't stamped
+                data=self.stamper.stamp(
+                    self.topics['position'],
+                    dict(position),
+                    captured_at=trace and trace['capture'],
+                ),
+            ))
+        return position
+
+
+class Service(services.PublisherService):
+    name = 'position'
+    resource = Position
+    # Runs next to the bluetooth service
+    address = LOCAL_BLUETOOTH_ADDRESS
+    port = settings.POSITION_SERVICE_PORT
+    publisher = pubsub.LastMessagePublisher
+    subscriber = pubsub.LastMessageSubscriber
+
+
+def start():
+    settings.configure_logging()
+    return Service().start()
+
+
+if __name__ == '__main__':
+    start()
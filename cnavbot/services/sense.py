@@ -1,3 +1,6 @@
+from __future__ import absolute_import
+import threading
+
 import zmq
 
 from zmqservices import pubsub, clientserver, messages
@@ -5,12 +8,94 @@ import cnavconstants.topics
 import cnavconstants.publishers
 import cnavconstants.servers
 
-from cnavbot import settings
+from cnavbot import clock, settings
+from cnavbot.utils import log_exceptions
+
+
+def wrap_angle(angle):
+    """Returns the angle in degrees between -180 and 180"""
+    return (angle + 180) % 360 - 180
+
+
+class OrientationCache(threading.Thread):
+    """
+    Receives orientation messages in the background and keeps the latest
+
+    Reads return straight away with the age of the reading, the yaw rate
+    between the last two readings is kept so that yaw can be extrapolated.
+    """
+
+    def __init__(self, subscriber, *args, **kwargs):
+        self.max_extrapolation = kwargs.pop(
+            'max_extrapolation', settings.CNAV_SENSE_MAX_EXTRAPOLATION
+        )
+        self.clock = kwargs.pop('clock', clock.REAL_CLOCK)
+        # latency.Tracer recording when readings arrive, optional
+        self.tracer = kwargs.pop('tracer', None)
+        super(OrientationCache, self).__init__(
+            name='orientation-reader', *args, **kwargs
+        )
+        self.daemon = True
+        self.subscriber = subscriber
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.orientation = None
+        self.received_at = None
+        # In degrees per second
+        self.yaw_rate = 0.0
+
+    def receive(self):
+        orientation = self.subscriber.receive().data
+        received_at = self.clock.monotonic()
+        if self.tracer is not None:
+            self.tracer.receive(cnavconstants.topics.ORIENTATION, orientation)
+
+        with self.lock:
+            if self.orientation is not None and (
+                    received_at > self.received_at):
+                self.yaw_rate = wrap_angle(
+                    orientation['yaw'] - self.orientation['yaw']
+                ) / (received_at - self.received_at)
+            self.orientation = orientation
+            self.received_at = received_at
+        self.ready.set()
+
+    def run(self):
+        with log_exceptions():
+            while True:
+                self.receive()
+
+    def latest(self, timeout=None):
+        """
+        Returns (orientation, age in seconds), waits for the first reading
+        """
+        self.ready.wait(timeout)
+        with self.lock:
+            if self.orientation is None:
+                return None, None
+            return self.orientation, self.clock.monotonic() - self.received_at
+
+    def predicted_yaw(self):
+        """Latest yaw moved on by the yaw rate for up to max_extrapolation"""
+        self.ready.wait()
+        with self.lock:
+            age = min(
+                self.clock.monotonic() - self.received_at,
+                self.max_extrapolation,
+            )
+            return (self.orientation['yaw'] + self.yaw_rate * age) % 360
 
 
 class Client(object):
 
     def __init__(self, *args, **kwargs):
+        self.orientation_cache = None
+        self.cache_orientation = kwargs.pop(
+            'cache_orientation', settings.CNAV_SENSE_ORIENTATION_CACHE
+        )
+        # cnav-sense doesn't stamp its messages, only the receive stage of
+        # orientation readings onwards is traced
+        self.tracer = kwargs.pop('tracer', None)
         if settings.CNAV_SENSE_ENABLED:
             self.setup_sense_services()
 
@@ -30,6 +115,11 @@ class Client(object):
             publishers=(inertial_service, ),
             topics=(cnavconstants.topics.ORIENTATION, ),
         )
+        if self.cache_orientation:
+            # Started on the first read
+            self.orientation_cache = OrientationCache(
+                self.orientation_subscriber, tracer=self.tracer
+            )
 
         environmental_service = self.get_sense_service_address(
             port=cnavconstants.publishers.ENVIRONMENTAL_SENSORS_PORT
@@ -74,14 +164,41 @@ class Client(object):
     def compass(self):
         return self.compass_subscriber.receive().data
 
+    @property
+    def cache(self):
+        """Running orientation cache, None if caching is disabled"""
+        if self.orientation_cache and self.orientation_cache.ident is None:
+            self.orientation_cache.start()
+        return self.orientation_cache
+
     @property
     def orientation(self):
-        return self.orientation_subscriber.receive().data
+        if self.cache:
+            return self.cache.latest()[0]
+        orientation = self.orientation_subscriber.receive().data
+        if self.tracer is not None:
+            self.tracer.receive(cnavconstants.topics.ORIENTATION, orientation)
+        return orientation
 
     @property
     def yaw(self):
         return self.orientation['yaw']
 
+    @property
+    def yaw_with_age(self):
+        """Returns (yaw, age in seconds), age is 0 without the cache"""
+        if self.cache:
+            orientation, age = self.cache.latest()
+            return orientation['yaw'], age
+        return self.yaw, 0.0
+
+    @property
+    def predicted_yaw(self):
+        """Yaw extrapolated to now, the latest reading without the cache"""
+        if self.cache:
+            return self.cache.predicted_yaw()
+        return self.yaw
+
     @property
     def temperature(self):
         return self.temperature_subscriber.receive().data
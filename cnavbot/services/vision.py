@@ -0,0 +1,392 @@
+from __future__ import absolute_import
+import logging
+
+from cnavbot import settings
+
+
+cv2 = settings.CV2
+numpy = settings.NUMPY
+
+logger = logging.getLogger()
+
+THRESHOLDINGS = (
+    settings.TARGET_THRESHOLD_HSV,
+    settings.TARGET_THRESHOLD_TABLE,
+)
+
+
+class ColourTable(object):
+    """
+    Colour class label of every quantised colour, for thresholding frames
+    without converting them to HSV
+
+    The centre colour of every bin is classified once with the HSV
+    conversion and ranges of the hsv thresholding, so the two only disagree
+    on colours close to the edge of a range. A lookup costs the same
+    whatever the number of classes, earlier classes win where they overlap.
+    """
+
+    def __init__(self, colours, bits=settings.TARGET_TABLE_BITS):
+        if not (1 <= bits <= 8):
+            raise Exception(
+                "Invalid table bits '{}', must be between 1 and 8".format(
+                    bits
+                )
+            )
+        self.bits = bits
+        self.shift = 8 - bits
+        self.index_dtype = numpy.uint16 if bits <= 5 else numpy.uint32
+
+        levels = 1 << bits
+        centres = (numpy.arange(levels) << self.shift) + (
+            (1 << self.shift) >> 1
+        )
+        colours_grid = numpy.stack(
+            numpy.meshgrid(centres, centres, centres, indexing='ij'), axis=-1
+        ).astype(numpy.uint8).reshape(-1, 1, 3)
+        # Same conversion as TargetDetector.convert
+        hsv = cv2.cvtColor(colours_grid, cv2.COLOR_RGB2HSV)
+
+        self.table = numpy.zeros(levels ** 3, dtype=numpy.uint8)
+        for label in range(len(colours), 0, -1):
+            low, high = colours[label - 1]
+            self.table[cv2.inRange(
+                hsv,
+                numpy.array(low, dtype=numpy.uint8),
+                numpy.array(high, dtype=numpy.uint8),
+            ).ravel() != 0] = label
+
+    def lookup(self, image, quantised, index, out):
+        """
+        Writes the label of every pixel of the 3 channel image to out, with
+        quantised (like image) and index (index_dtype) as working buffers
+        """
+        numpy.right_shift(image, self.shift, out=quantised)
+        numpy.copyto(index, quantised[:, :, 0])
+        for channel in (1, 2):
+            numpy.left_shift(index, self.bits, out=index)
+            numpy.bitwise_or(index, quantised[:, :, channel], out=index)
+        return numpy.take(self.table, index, out=out, mode='clip')
+
+
+class TargetDetector(object):
+    """
+    Finds the largest blob of the target colours in BGR frames
+
+    Working buffers are allocated once per frame shape and reused, detection
+    can be restricted to a region of interest and run on a downscaled frame.
+    Frames are thresholded into a label image of colour classes, numbered
+    from 1 in the order of colours, with the HSV conversion and a range
+    check per class or with a ColourTable lookup.
+    """
+    blur_size = 5
+
+    def __init__(self, *args, **kwargs):
+        # [(low HSV, high HSV)], the first one is the target colour
+        colours = kwargs.pop('colours', None) or [(
+            kwargs.pop('colour_low', settings.TARGET_COLOUR_LOW),
+            kwargs.pop('colour_high', settings.TARGET_COLOUR_HIGH),
+        )] + kwargs.pop('extra_colours', settings.TARGET_EXTRA_COLOURS)
+        self.colours = [
+            (numpy.array(low, dtype=numpy.uint8),
+             numpy.array(high, dtype=numpy.uint8))
+            for low, high in colours
+        ]
+        self.colour_low, self.colour_high = self.colours[0]
+        # (x, y, width, height) in full frame pixels
+        self.roi = kwargs.pop('roi', settings.TARGET_ROI)
+        self.scale = kwargs.pop('scale', settings.TARGET_SCALE)
+        self.validate_scale(self.scale)
+
+        self.thresholding = kwargs.pop(
+            'thresholding', settings.TARGET_THRESHOLD
+        )
+        if self.thresholding not in THRESHOLDINGS:
+            raise Exception(
+                "Invalid thresholding '{}', must be one of {}".format(
+                    self.thresholding, THRESHOLDINGS
+                )
+            )
+        # Can be shared by detectors with the same colours
+        self.table = kwargs.pop('table', None)
+        if self.table is None and (
+                self.thresholding == settings.TARGET_THRESHOLD_TABLE):
+            self.table = ColourTable(self.colours)
+
+        self.shape = None
+        self.buffers = {}
+
+    @staticmethod
+    def validate_scale(scale):
+        if not (0 < scale <= 1):
+            raise Exception(
+                "Invalid scale value '{}', must be between 0 and 1".format(
+                    scale
+                )
+            )
+
+    def crop(self, image, roi=None):
+        """Returns the region of interest and its offset in the image"""
+        roi = roi or self.roi
+        if not roi:
+            return image, 0
+        x, y, width, height = roi
+        return image[y:y + height, x:x + width], x
+
+    def allocate(self, region):
+        height, width = region.shape[:2]
+        if self.scale != 1:
+            width = max(int(width * self.scale), 1)
+            height = max(int(height * self.scale), 1)
+
+        shape = (height, width)
+        if shape == self.shape:
+            return
+
+        logger.debug('Allocating detector buffers for {}x{}'.format(
+            width, height
+        ))
+        self.shape = shape
+        self.buffers = {
+            'scaled': numpy.empty(shape + (3, ), dtype=numpy.uint8),
+            'blurred': numpy.empty(shape + (3, ), dtype=numpy.uint8),
+            'hsv': numpy.empty(shape + (3, ), dtype=numpy.uint8),
+            'mask': numpy.empty(shape, dtype=numpy.uint8),
+            'classes': numpy.empty(shape, dtype=numpy.uint8),
+            'class_mask': numpy.empty(shape, dtype=numpy.uint8),
+            'labels': numpy.empty(shape, dtype=numpy.int32),
+        }
+        if self.table is not None:
+            self.buffers['quantised'] = numpy.empty(
+                shape + (3, ), dtype=numpy.uint8
+            )
+            self.buffers['index'] = numpy.empty(
+                shape, dtype=self.table.index_dtype
+            )
+
+    def resize(self, region):
+        if self.scale == 1:
+            return region
+        height, width = self.shape
+        return cv2.resize(
+            region,
+            (width, height),
+            self.buffers['scaled'],
+            interpolation=cv2.INTER_AREA,
+        )
+
+    def blur(self, region):
+        return cv2.medianBlur(region, self.blur_size, self.buffers['blurred'])
+
+    def convert(self, region):
+        return cv2.cvtColor(region, cv2.COLOR_RGB2HSV, self.buffers['hsv'])
+
+    def in_range(self, hsv):
+        return cv2.inRange(
+            hsv, self.colour_low, self.colour_high, self.buffers['mask']
+        )
+
+    def in_ranges(self, hsv):
+        """Returns the label image, just the mask with a single class"""
+        if len(self.colours) == 1:
+            return self.in_range(hsv)
+        classes = self.buffers['classes']
+        classes.fill(0)
+        for label in range(len(self.colours), 0, -1):
+            low, high = self.colours[label - 1]
+            mask = cv2.inRange(hsv, low, high, self.buffers['mask'])
+            classes[mask != 0] = label
+        return classes
+
+    def lookup(self, region):
+        return self.table.lookup(
+            region,
+            self.buffers['quantised'],
+            self.buffers['index'],
+            self.buffers['classes'],
+        )
+
+    def threshold(self, region):
+        """
+        Returns the colour class labels of the (scaled) region, 0 where
+        there's none of the colours
+        """
+        self.allocate(region)
+        region = self.blur(self.resize(region))
+        if self.table is not None:
+            return self.lookup(region)
+        return self.in_ranges(self.convert(region))
+
+    def mask(self, labels, colour=None):
+        """Mask of the colour class index in labels, of any if None"""
+        if colour is None or len(self.colours) == 1:
+            return labels
+        mask = self.buffers['class_mask']
+        numpy.equal(labels, colour + 1, out=mask.view(numpy.bool_))
+        return mask
+
+    def bounding_boxes(self, mask):
+        """Returns an array of (x, y, width, height) rows, one per blob"""
+        if hasattr(cv2, 'connectedComponentsWithStats'):
+            stats = cv2.connectedComponentsWithStats(
+                mask, self.buffers['labels'], connectivity=8
+            )[2]
+            # First row is the background
+            return stats[1:, :4]
+
+        # OpenCV 2.4 fallback
+        contours = cv2.findContours(
+            mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
+        )[-2]
+        return numpy.array(
+            [cv2.boundingRect(contour) for contour in contours],
+            dtype=numpy.int32,
+        ).reshape(-1, 4)
+
+    def largest(self, boxes):
+        """Returns (centre x, area) of the largest bounding box"""
+        if not len(boxes):
+            return None
+        areas = boxes[:, 2] * boxes[:, 3]
+        index = areas.argmax()
+        x, _, width, _ = boxes[index]
+        return x + width / 2.0, int(areas[index])
+
+    def target(self, mask, offset_x):
+        """Returns the largest blob of the mask in full frame pixels"""
+        found = self.largest(self.bounding_boxes(mask))
+        if not found:
+            return None
+
+        x, area = found
+        return {
+            'x': offset_x + x / self.scale,
+            'area': int(area / (self.scale ** 2)),
+        }
+
+    def detect(self, image, roi=None, colour=None):
+        """
+        Returns x and area of the target in full frame pixels or None, of
+        the colour class index or of any colour if None
+        """
+        region, offset_x = self.crop(image, roi)
+        return self.target(
+            self.mask(self.threshold(region), colour), offset_x
+        )
+
+    def detect_all(self, image, roi=None):
+        """Returns the target of every colour class, thresholding once"""
+        region, offset_x = self.crop(image, roi)
+        labels = self.threshold(region)
+        return [
+            self.target(self.mask(labels, colour), offset_x)
+            for colour in range(len(self.colours))
+        ]
+
+
+class TargetTracker(object):
+    """
+    Follows the target from frame to frame without detecting on every one
+
+    Target x, its velocity and area are smoothed with an alpha-beta filter.
+    Between full frame detections only a window around the predicted x is
+    searched. Confidence decays with every windowed update and drops when
+    the area found doesn't match, once it's below min_confidence (or the
+    target isn't in the window) the whole frame is searched again.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.detector = kwargs.pop('detector', None) or TargetDetector()
+        # Has its own buffers, sized for the window
+        self.window_detector = TargetDetector(
+            colours=self.detector.colours,
+            roi=None,
+            scale=self.detector.scale,
+            thresholding=self.detector.thresholding,
+            table=self.detector.table,
+        )
+        # In pixels
+        self.window = kwargs.pop('window', settings.TARGET_TRACK_WINDOW)
+        self.alpha = kwargs.pop('alpha', settings.TARGET_TRACK_ALPHA)
+        self.beta = kwargs.pop('beta', settings.TARGET_TRACK_BETA)
+        self.decay = kwargs.pop('decay', settings.TARGET_TRACK_DECAY)
+        self.min_confidence = kwargs.pop(
+            'min_confidence', settings.TARGET_TRACK_MIN_CONFIDENCE
+        )
+        self.full_detections = 0
+        self.window_updates = 0
+        self.reset()
+
+    def reset(self):
+        # x, area, velocity in pixels per second and confidence
+        self.target = None
+        self.updated_at = None
+
+    def predict(self, now):
+        return self.target['x'] + self.target['velocity'] * (
+            now - self.updated_at
+        )
+
+    def window_roi(self, image, x):
+        """Returns a window centred on x, inside the detector's roi"""
+        image_height, image_width = image.shape[:2]
+        left, top, width, height = (
+            self.detector.roi or (0, 0, image_width, image_height)
+        )
+        window = min(self.window, width)
+        start = min(max(int(x - window / 2.0), left), left + width - window)
+        return start, top, window, height
+
+    def correct(self, found, now, confidence):
+        """Updates the filter with the target found at now"""
+        if self.target is None:
+            self.target = dict(found, velocity=0.0)
+        else:
+            elapsed = now - self.updated_at
+            predicted = self.predict(now)
+            residual = found['x'] - predicted
+            if elapsed > 0:
+                self.target['velocity'] += self.beta * residual / elapsed
+            self.target['x'] = predicted + self.alpha * residual
+            self.target['area'] = int(self.target['area'] + self.alpha * (
+                found['area'] - self.target['area']
+            ))
+        self.target['confidence'] = confidence
+        self.updated_at = now
+        return dict(self.target)
+
+    def track(self, image, now):
+        """Searches the window around the prediction, None if lost"""
+        self.window_updates += 1
+        found = self.window_detector.detect(
+            image, roi=self.window_roi(image, self.predict(now))
+        )
+        if found is None:
+            # Moved too far to be the same target, start again
+            self.reset()
+            return None
+
+        area = self.target['area']
+        confidence = self.target['confidence'] * self.decay * (
+            min(found['area'], area) / float(max(found['area'], area, 1))
+        )
+        if confidence < self.min_confidence:
+            return None
+        return self.correct(found, now, confidence)
+
+    def update(self, image, now):
+        """
+        Returns the target (x, area, velocity, confidence) in the frame
+        taken at now, None when there isn't one
+        """
+        if self.target is not None:
+            target = self.track(image, now)
+            if target is not None:
+                return target
+
+        self.full_detections += 1
+        found = self.detector.detect(image)
+        if found is None:
+            self.reset()
+            return None
+        return self.correct(found, now, confidence=1.0)
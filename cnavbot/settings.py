@@ -1,5 +1,9 @@
 import logging.config
 import os
+import pkgutil
+
+from cnavbot import logs
+from cnavbot.utils import LazyModule
 
 
 PROJECT_ROOT = os.path.dirname(os.path.realpath(__file__))
@@ -10,32 +14,22 @@ RUNNING_ON_PI = MACHINE.startswith('arm')
 
 # Drivers #####################################################################
 
-# Driver libs can only be installed on RPi
+# Driver libs can only be installed on RPi, they're imported on first use so
+# that each service only loads what it needs
 if RUNNING_ON_PI:
-    from pi2go import pi2go
-    BOT_DRIVER = pi2go
-
-    import bluetooth
-    BLUETOOTH_DRIVER = bluetooth._bluetooth
-
-    from ibeaconscanner import blescan
-    IBEACON_SCANNER = blescan
-
-    import picamera
-    CAMERA = picamera
-
-    import cv2
-    CV2 = cv2
-
-    import numpy
-    NUMPY = numpy
+    BOT_DRIVER = LazyModule('pi2go.pi2go')
+    BLUETOOTH_DRIVER = LazyModule('bluetooth._bluetooth')
+    IBEACON_SCANNER = LazyModule('ibeaconscanner.blescan')
+    CAMERA = LazyModule('picamera')
 else:
     BOT_DRIVER = None
     BLUETOOTH_DRIVER = None
     IBEACON_SCANNER = None
     CAMERA = None
-    CV2 = None
-    NUMPY = None
+
+# Image processing libs are also used off the RPi, e.g. by benchmarks
+CV2 = LazyModule('cv2') if pkgutil.find_loader('cv2') else None
+NUMPY = LazyModule('numpy') if pkgutil.find_loader('numpy') else None
 
 
 # Bluetooth ###################################################################
@@ -45,8 +39,30 @@ if BLUETOOTH_ENABLED == 'true':
 else:
     BLUETOOTH_ENABLED = False
 
-# In seconds
-BLUETOOTH_SCAN_INTERVAL = int(os.getenv('BLUETOOTH_SCAN_INTERVAL', 1))
+# In seconds, how often beacon estimates are published, falls back to
+# BLUETOOTH_SCAN_INTERVAL, its name before publishing became incremental
+BLUETOOTH_PUBLISH_INTERVAL = float(os.getenv(
+    'BLUETOOTH_PUBLISH_INTERVAL', os.getenv('BLUETOOTH_SCAN_INTERVAL', 0.2)
+))
+# In seconds, estimates are republished this often even if none changed
+BLUETOOTH_REPUBLISH_INTERVAL = float(
+    os.getenv('BLUETOOTH_REPUBLISH_INTERVAL', 1)
+)
+# Advertisements waiting to be published, later ones are dropped
+BLUETOOTH_QUEUE_SIZE = int(os.getenv('BLUETOOTH_QUEUE_SIZE', 1000))
+# In seconds, how often advertisement counts are logged
+BLUETOOTH_REPORT_INTERVAL = int(os.getenv('BLUETOOTH_REPORT_INTERVAL', 60))
+
+# Number of readings per beacon kept for outlier rejection
+BLUETOOTH_RSSI_WINDOW = int(os.getenv('BLUETOOTH_RSSI_WINDOW', 10))
+# Weight of a new reading in the moving average, between 0 and 1
+BLUETOOTH_RSSI_ALPHA = float(os.getenv('BLUETOOTH_RSSI_ALPHA', 0.3))
+# In median absolute deviations from the median of the window
+BLUETOOTH_RSSI_OUTLIER_THRESHOLD = float(
+    os.getenv('BLUETOOTH_RSSI_OUTLIER_THRESHOLD', 3)
+)
+# In seconds, beacons not heard from for this long are no longer published
+BLUETOOTH_BEACON_TIMEOUT = float(os.getenv('BLUETOOTH_BEACON_TIMEOUT', 10))
 
 
 # Beacons #####################################################################
@@ -66,6 +82,39 @@ BEACONS = [
     BEACON_THREE_ID
 ]
 
+# Beacon coordinates in metres, e.g. '2.5,0'
+BEACON_ONE_POSITION = os.getenv('BEACON_ONE_POSITION', '0,0')
+BEACON_TWO_POSITION = os.getenv('BEACON_TWO_POSITION', '5,0')
+BEACON_THREE_POSITION = os.getenv('BEACON_THREE_POSITION', '0,5')
+BEACON_POSITIONS = {
+    beacon: tuple(float(value) for value in position.split(','))
+    for beacon, position in zip(BEACONS, (
+        BEACON_ONE_POSITION,
+        BEACON_TWO_POSITION,
+        BEACON_THREE_POSITION,
+    ))
+}
+
+
+# Position ####################################################################
+POSITION_ENABLED = os.getenv('POSITION_ENABLED', 'false')
+if POSITION_ENABLED == 'true':
+    POSITION_ENABLED = True
+else:
+    POSITION_ENABLED = False
+
+POSITION_SERVICE_PORT = int(os.getenv('POSITION_SERVICE_PORT', 5570))
+POSITION_TOPIC = os.getenv('POSITION_TOPIC', 'position')
+
+# Path loss exponent, 2 in free space, usually between 2 and 4 indoors
+POSITION_PATH_LOSS_EXPONENT = float(
+    os.getenv('POSITION_PATH_LOSS_EXPONENT', 2)
+)
+# In dBm, added to the beacon txpower (its RSSI at 1 metre)
+POSITION_TXPOWER_OFFSET = float(os.getenv('POSITION_TXPOWER_OFFSET', 0))
+# In metres, residual at which the position confidence drops to ~0.37
+POSITION_CONFIDENCE_SCALE = float(os.getenv('POSITION_CONFIDENCE_SCALE', 1))
+
 
 # Camera ###################################################################
 CAMERA_ENABLED = os.getenv('CAMERA_ENABLED', 'false')
@@ -74,12 +123,39 @@ if CAMERA_ENABLED == 'true':
 else:
     CAMERA_ENABLED = False
 
-CAMERA_INTERVAL = int(os.getenv('CAMERA_INTERVAL', 1))
+# 'still' (sleep and capture from the still port) or 'stream' (continuous
+# capture from the video port, publishing the newest frame every interval)
+CAMERA_CAPTURE_MODE_STILL = 'still'
+CAMERA_CAPTURE_MODE_STREAM = 'stream'
+CAMERA_CAPTURE_MODE = os.getenv(
+    'CAMERA_CAPTURE_MODE', CAMERA_CAPTURE_MODE_STILL
+)
+
+# In seconds, CAMERA_FPS takes precedence when set
+CAMERA_INTERVAL = float(os.getenv('CAMERA_INTERVAL', 1))
+CAMERA_FPS = os.getenv('CAMERA_FPS')
+if CAMERA_FPS:
+    CAMERA_INTERVAL = 1.0 / float(CAMERA_FPS)
+
+# Video port frame rate in stream mode, frames captured in between
+# publishing intervals are dropped
+CAMERA_FRAMERATE = int(os.getenv('CAMERA_FRAMERATE', 30))
+# In seconds, how often the achieved frame rate is logged
+CAMERA_FPS_REPORT_INTERVAL = int(os.getenv('CAMERA_FPS_REPORT_INTERVAL', 10))
 CAMERA_RESOLUTION_X = int(os.getenv('CAMERA_RESOLUTION_X', 640))
 CAMERA_RESOLUTION_Y = int(os.getenv('CAMERA_RESOLUTION_Y', 480))
 CAMERA_RESOLUTION = (CAMERA_RESOLUTION_X, CAMERA_RESOLUTION_Y)
 FILE_MESSAGE_STORAGE_PATH = os.getenv('FILE_MESSAGE_STORAGE_PATH', '/tmp/')
 
+# 'file' (JPEG written to FILE_MESSAGE_STORAGE_PATH) or 'shared' (raw BGR
+# frames in shared memory, resolution must be a multiple of 32x16)
+CAMERA_TRANSPORT_FILE = 'file'
+CAMERA_TRANSPORT_SHARED = 'shared'
+CAMERA_TRANSPORT = os.getenv('CAMERA_TRANSPORT', CAMERA_TRANSPORT_FILE)
+FRAME_BUFFER_PATH = os.getenv('FRAME_BUFFER_PATH', '/dev/shm/cnavbot-frames')
+# Bot keeps reading a frame while the camera writes the next ones
+FRAME_BUFFER_SLOTS = int(os.getenv('FRAME_BUFFER_SLOTS', 3))
+
 # Target following ############################################################
 
 BOT_SEARCH_FOR_TARGET = os.getenv('BOT_SEARCH_FOR_TARGET', 'true')
@@ -107,6 +183,53 @@ TARGET_COLOUR_HIGH = (
     TARGET_COLOUR_HIGH_H, TARGET_COLOUR_HIGH_S, TARGET_COLOUR_HIGH_V
 )
 
+# More target colour classes detected along with TARGET_COLOUR_LOW/HIGH, as
+# semicolon separated low H,S,V,high H,S,V ranges e.g. '0,127,64,10,255,255'
+TARGET_EXTRA_COLOURS = [
+    (tuple(values[:3]), tuple(values[3:]))
+    for values in (
+        [int(value) for value in colour.split(',')]
+        for colour in os.getenv('TARGET_EXTRA_COLOURS', '').split(';')
+        if colour
+    )
+]
+
+# How frames are thresholded into colour classes: 'hsv' converts every frame
+# to HSV and checks it against every class, 'table' looks up each pixel in a
+# table of quantised colours built once, whatever the number of classes
+TARGET_THRESHOLD_HSV = 'hsv'
+TARGET_THRESHOLD_TABLE = 'table'
+TARGET_THRESHOLD = os.getenv('TARGET_THRESHOLD', TARGET_THRESHOLD_HSV)
+# Bits per colour channel the table is indexed with, 5 is 32 levels and a
+# 32 KB table
+TARGET_TABLE_BITS = int(os.getenv('TARGET_TABLE_BITS', 5))
+
+# Only look for targets in this part of the image, e.g. '0,120,640,240'
+# (x, y, width, height in pixels), whole image if not set
+TARGET_ROI = os.getenv('TARGET_ROI')
+if TARGET_ROI:
+    TARGET_ROI = tuple(int(value) for value in TARGET_ROI.split(','))
+
+# Detect targets on an image downscaled by this factor (between 0 and 1)
+TARGET_SCALE = float(os.getenv('TARGET_SCALE', 1))
+# Track the target between full frame detections by searching a window of
+# TARGET_TRACK_WINDOW pixels around where it's predicted to be
+TARGET_TRACKING = os.getenv('TARGET_TRACKING', 'false')
+if TARGET_TRACKING == 'true':
+    TARGET_TRACKING = True
+else:
+    TARGET_TRACKING = False
+TARGET_TRACK_WINDOW = int(os.getenv('TARGET_TRACK_WINDOW', 160))
+# Alpha-beta filter gains for the target position and velocity
+TARGET_TRACK_ALPHA = float(os.getenv('TARGET_TRACK_ALPHA', 0.6))
+TARGET_TRACK_BETA = float(os.getenv('TARGET_TRACK_BETA', 0.2))
+# Confidence is multiplied by this on every windowed update, the whole
+# frame is searched again when it drops below TARGET_TRACK_MIN_CONFIDENCE
+TARGET_TRACK_DECAY = float(os.getenv('TARGET_TRACK_DECAY', 0.95))
+TARGET_TRACK_MIN_CONFIDENCE = float(
+    os.getenv('TARGET_TRACK_MIN_CONFIDENCE', 0.5)
+)
+
 # cnav-sense ##################################################################
 CNAV_SENSE_ENABLED = os.getenv('CNAV_SENSE_ENABLED', 'true')
 if CNAV_SENSE_ENABLED == 'true':
@@ -118,6 +241,20 @@ else:
 if CNAV_SENSE_ENABLED:
     CNAV_SENSE_ADDRESS = os.getenv('CNAV_SENSE_ADDRESS')
 
+# Receive orientation in the background so that yaw reads don't block
+CNAV_SENSE_ORIENTATION_CACHE = os.getenv(
+    'CNAV_SENSE_ORIENTATION_CACHE', 'true'
+)
+if CNAV_SENSE_ORIENTATION_CACHE == 'true':
+    CNAV_SENSE_ORIENTATION_CACHE = True
+else:
+    CNAV_SENSE_ORIENTATION_CACHE = False
+
+# In seconds, how far ahead of the latest reading yaw can be extrapolated
+CNAV_SENSE_MAX_EXTRAPOLATION = float(
+    os.getenv('CNAV_SENSE_MAX_EXTRAPOLATION', 0.2)
+)
+
 
 # Bot modes ###################################################################
 BOT_ENABLED = os.getenv('BOT_ENABLED', 'true')
@@ -177,64 +314,246 @@ BOT_DEFAULT_NAME = os.getenv('BOT_DEFAULT_NAME', HOSTNAME)
 BOT_DEFAULT_MAX_DISTANCE = int(os.getenv('BOT_DEFAULT_MAX_DISTANCE', 10))
 BOT_DIRECTION_TOLERANCE = int(os.getenv('BOT_DIRECTION_TOLERANCE', 10))
 
+# Heading controller, spin speed per degree of heading error
+BOT_HEADING_KP = float(os.getenv('BOT_HEADING_KP', 1))
+# Spin speed taken off per degree per second of yaw rate
+BOT_HEADING_KD = float(os.getenv('BOT_HEADING_KD', 0.1))
+# Slowest spin that still moves the bot and fastest one used for turns
+BOT_HEADING_MIN_SPEED = int(os.getenv('BOT_HEADING_MIN_SPEED', 15))
+BOT_HEADING_MAX_SPEED = int(os.getenv('BOT_HEADING_MAX_SPEED', 60))
+# In Hz
+BOT_HEADING_RATE = int(os.getenv('BOT_HEADING_RATE', 20))
+# Consecutive readings within tolerance for a turn to be done
+BOT_HEADING_SETTLE_TICKS = int(os.getenv('BOT_HEADING_SETTLE_TICKS', 2))
+# In seconds, turns are given up after this long
+BOT_HEADING_TIMEOUT = float(os.getenv('BOT_HEADING_TIMEOUT', 10))
+# Run timed moves in the background so sensors are polled while moving
+BOT_ASYNC_MOTORS = os.getenv('BOT_ASYNC_MOTORS', 'false')
+if BOT_ASYNC_MOTORS == 'true':
+    BOT_ASYNC_MOTORS = True
+else:
+    BOT_ASYNC_MOTORS = False
+# In seconds, how often sensors are checked during a background move
+BOT_MOTORS_POLL_INTERVAL = float(os.getenv('BOT_MOTORS_POLL_INTERVAL', 0.02))
+# In Hz, how often each bot mode runs its step, 0 for as often as possible
+BOT_CONTROL_LOOP_RATE = float(os.getenv('BOT_CONTROL_LOOP_RATE', 20))
+# In seconds, how often control loop stats are logged
+BOT_CONTROL_LOOP_REPORT_INTERVAL = int(
+    os.getenv('BOT_CONTROL_LOOP_REPORT_INTERVAL', 60)
+)
+# In seconds, how long an obstacle/line sensor snapshot can be reused for
+# (a motor command always invalidates it)
+BOT_SENSOR_MAX_AGE = float(os.getenv('BOT_SENSOR_MAX_AGE', 0.05))
+# Dead reckoning, in cm/s and degrees/s per unit of wheel speed (-100 to
+# 100), need calibrating for each bot
+BOT_ODOMETRY_CM_PER_SPEED = float(os.getenv('BOT_ODOMETRY_CM_PER_SPEED', 0.5))
+BOT_ODOMETRY_DEGREES_PER_SPEED = float(
+    os.getenv('BOT_ODOMETRY_DEGREES_PER_SPEED', 2.0)
+)
+# Position variance in cm^2 added per cm travelled and heading variance in
+# degrees^2 per degree turned
+BOT_ODOMETRY_DISTANCE_NOISE = float(
+    os.getenv('BOT_ODOMETRY_DISTANCE_NOISE', 0.5)
+)
+BOT_ODOMETRY_TURN_NOISE = float(os.getenv('BOT_ODOMETRY_TURN_NOISE', 0.5))
+# In degrees^2, variance of a compass yaw reading
+BOT_ODOMETRY_YAW_VARIANCE = float(os.getenv('BOT_ODOMETRY_YAW_VARIANCE', 9))
+# Ping the ultrasonic sensor from a background thread so distance reads
+# return straight away
+BOT_DISTANCE_SAMPLING = os.getenv('BOT_DISTANCE_SAMPLING', 'false')
+if BOT_DISTANCE_SAMPLING == 'true':
+    BOT_DISTANCE_SAMPLING = True
+else:
+    BOT_DISTANCE_SAMPLING = False
+# In Hz, echoes of a ping must die down before the next one
+BOT_DISTANCE_RATE = float(os.getenv('BOT_DISTANCE_RATE', 15))
+# Number of pings the median distance and closing velocity are taken over
+BOT_DISTANCE_WINDOW = int(os.getenv('BOT_DISTANCE_WINDOW', 5))
+# In seconds, older pings are stale and the sensor is read directly instead,
+# also how long a read waits for the first ping
+BOT_DISTANCE_MAX_AGE = float(os.getenv('BOT_DISTANCE_MAX_AGE', 0.5))
+# Keep IR obstacle and line sensor state up to date from edge callbacks, so
+# control code waits for a change rather than polling the sensors
+BOT_SENSOR_EVENTS = os.getenv('BOT_SENSOR_EVENTS', 'false')
+if BOT_SENSOR_EVENTS == 'true':
+    BOT_SENSOR_EVENTS = True
+else:
+    BOT_SENSOR_EVENTS = False
+# 'gpio' (RPi.GPIO edge detection interrupts) or 'polling' (a thread reading
+# the driver every BOT_SENSOR_POLL_INTERVAL, where there are no interrupts)
+BOT_SENSOR_BACKEND_GPIO = 'gpio'
+BOT_SENSOR_BACKEND_POLLING = 'polling'
+BOT_SENSOR_BACKEND = os.getenv('BOT_SENSOR_BACKEND', BOT_SENSOR_BACKEND_GPIO)
+# In milliseconds, edges closer together than this are ignored
+BOT_SENSOR_BOUNCE_TIME = int(os.getenv('BOT_SENSOR_BOUNCE_TIME', 5))
+# In seconds
+BOT_SENSOR_POLL_INTERVAL = float(os.getenv('BOT_SENSOR_POLL_INTERVAL', 0.002))
+# Number of sensor changes kept, older ones are dropped
+BOT_SENSOR_EVENT_QUEUE_SIZE = int(
+    os.getenv('BOT_SENSOR_EVENT_QUEUE_SIZE', 256)
+)
+
+
+# Metrics #####################################################################
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false')
+if METRICS_ENABLED == 'true':
+    METRICS_ENABLED = True
+else:
+    METRICS_ENABLED = False
+
+# Each service exposes its metrics for Prometheus on its own port
+METRICS_BOT_PORT = int(os.getenv('METRICS_BOT_PORT', 9101))
+METRICS_CAMERA_PORT = int(os.getenv('METRICS_CAMERA_PORT', 9102))
+METRICS_BLUETOOTH_PORT = int(os.getenv('METRICS_BLUETOOTH_PORT', 9103))
+METRICS_SUPERVISOR_PORT = int(os.getenv('METRICS_SUPERVISOR_PORT', 9104))
+METRICS_POSITION_PORT = int(os.getenv('METRICS_POSITION_PORT', 9105))
+
+
+# Message tracing #############################################################
+# Number and timestamp published messages (JSON ones, e.g. bluetooth scans,
+# positions and shared memory frames) so subscribers can tell their age
+MESSAGE_TRACING = os.getenv('MESSAGE_TRACING', 'false')
+if MESSAGE_TRACING == 'true':
+    MESSAGE_TRACING = True
+else:
+    MESSAGE_TRACING = False
+# In seconds, the bot waits for a newer message than this old, 0 for any age
+MESSAGE_MAX_AGE = float(os.getenv('MESSAGE_MAX_AGE', 0))
+# Latest latencies kept per topic and stage for percentiles
+MESSAGE_LATENCY_WINDOW = int(os.getenv('MESSAGE_LATENCY_WINDOW', 1000))
+# In seconds, how often latency percentiles are logged
+MESSAGE_LATENCY_REPORT_INTERVAL = int(
+    os.getenv('MESSAGE_LATENCY_REPORT_INTERVAL', 60)
+)
+
+
+# Recording ###################################################################
+# Log file the bot records its sensor, frame and motor streams to for replay
+# (python -m cnavbot.recording), not recorded if empty
+RECORDING_PATH = os.getenv('RECORDING_PATH', '')
+# JPEG quality frames are recorded with, 0 to keep them uncompressed (about
+# 900KB a frame at 640x480)
+RECORDING_FRAME_QUALITY = int(os.getenv('RECORDING_FRAME_QUALITY', 80))
+# In seconds, how often the log is written out, at most this much is lost if
+# the bot crashes
+RECORDING_FLUSH_INTERVAL = float(os.getenv('RECORDING_FLUSH_INTERVAL', 1))
+
+
+# Supervisor ##################################################################
+
+# Comma separated CPU cores each service process is pinned to, not pinned
+# if empty. Core 0 is left to the system, vision and control run apart.
+SUPERVISOR_BOT_CPUS = os.getenv('SUPERVISOR_BOT_CPUS', '3')
+SUPERVISOR_CAMERA_CPUS = os.getenv('SUPERVISOR_CAMERA_CPUS', '2')
+SUPERVISOR_BLUETOOTH_CPUS = os.getenv('SUPERVISOR_BLUETOOTH_CPUS', '1')
+SUPERVISOR_POSITION_CPUS = os.getenv('SUPERVISOR_POSITION_CPUS', '1')
+
+# In seconds
+SUPERVISOR_CHECK_INTERVAL = float(os.getenv('SUPERVISOR_CHECK_INTERVAL', 1))
+SUPERVISOR_REPORT_INTERVAL = int(os.getenv('SUPERVISOR_REPORT_INTERVAL', 60))
+# First restart delay, doubled after every consecutive failure
+SUPERVISOR_BACKOFF = float(os.getenv('SUPERVISOR_BACKOFF', 1))
+SUPERVISOR_MAX_BACKOFF = float(os.getenv('SUPERVISOR_MAX_BACKOFF', 60))
+# A service running this long is considered healthy again
+SUPERVISOR_STABLE_AFTER = int(os.getenv('SUPERVISOR_STABLE_AFTER', 60))
+
 
 # Logging #####################################################################
 
 BOT_LOG_PATH = os.environ.get('BOT_LOG_PATH', '/tmp/cnavbot.log')
 SENTRY_DSN = os.environ.get('SENTRY_DSN')
-
-logging.config.dictConfig({
-    'version': 1,
-    'formatters': {
-        'default': {
-            'format': '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        },
-        'sentry': {
-            'format': (
-                '[%(asctime)s][%(levelname)s] %(name)s '
-                '%(filename)s:%(funcName)s:%(lineno)d | %(message)s'
-            ),
-            'datefmt': '%H:%M:%S',
-        }
-    },
-    'handlers': {
-        'rotating_file': {
-            'class': 'zmqservices.utils.MultiprocessingRotatingFileHandler',
-            'filename': BOT_LOG_PATH,
-            'maxBytes': 10 * 1024 * 1024,
-            'backupCount': 5,
-            'formatter': 'default',
-            'level': 'INFO',
+# Records below this level aren't created at all, e.g. 'INFO' keeps sensor
+# and motor debug logging out of the control loops
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'DEBUG')
+# Hot path mode: handlers run on a background thread behind a queue, debug
+# records are rate limited per call site and a trace of the latest records
+# is written to LOG_TRACE_PATH when an error is logged
+LOG_HOT_PATH = os.getenv('LOG_HOT_PATH', 'false')
+if LOG_HOT_PATH == 'true':
+    LOG_HOT_PATH = True
+else:
+    LOG_HOT_PATH = False
+# Debug records per second let through from each line of code, 0 for all
+LOG_DEBUG_RATE = float(os.getenv('LOG_DEBUG_RATE', 5))
+# Records waiting to be written, later ones are dropped
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+# Number of records kept in the trace, 0 to disable it
+LOG_TRACE_SIZE = int(os.getenv('LOG_TRACE_SIZE', 2000))
+LOG_TRACE_PATH = os.getenv('LOG_TRACE_PATH', '/tmp/cnavbot-trace.log')
+
+LOGGING_CONFIGURED = False
+
+
+def configure_logging():
+    """Sets up log handlers, called once by every entry point"""
+    global LOGGING_CONFIGURED
+    if LOGGING_CONFIGURED:
+        return
+    LOGGING_CONFIGURED = True
+
+    logging.config.dictConfig({
+        'version': 1,
+        'formatters': {
+            'default': {
+                'format': (
+                    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+                ),
+            },
+            'sentry': {
+                'format': (
+                    '[%(asctime)s][%(levelname)s] %(name)s '
+                    '%(filename)s:%(funcName)s:%(lineno)d | %(message)s'
+                ),
+                'datefmt': '%H:%M:%S',
+            }
         },
-        'console': {
-            'class': 'logging.StreamHandler',
-            'formatter': 'default',
-            'level': 'DEBUG',
+        'handlers': {
+            'rotating_file': {
+                'class': 'zmqservices.utils.MultiprocessingRotatingFileHandler',
+                'filename': BOT_LOG_PATH,
+                'maxBytes': 10 * 1024 * 1024,
+                'backupCount': 5,
+                'formatter': 'default',
+                'level': 'INFO',
+            },
+            'console': {
+                'class': 'logging.StreamHandler',
+                'formatter': 'default',
+                'level': 'DEBUG',
+            },
+            'sentry': {
+                'class': 'raven.handlers.logging.SentryHandler',
+                'dsn': SENTRY_DSN,
+                'level': 'ERROR',
+                'formatter': 'sentry',
+            },
+            'papertrail': {
+                'class': 'logging.handlers.SysLogHandler',
+                'formatter': 'default',
+                'address': (
+                    os.getenv('PAPERTRAIL_HOST'),
+                    int(os.getenv('PAPERTRAIL_PORT', 0))
+                ),
+                'level': 'INFO',
+            }
         },
-        'sentry': {
-            'class': 'raven.handlers.logging.SentryHandler',
-            'dsn': SENTRY_DSN,
-            'level': 'ERROR',
-            'formatter': 'sentry',
+        'root': {
+            'handlers': [
+                'rotating_file',
+                'console',
+                'sentry',
+                'papertrail',
+            ],
+            'level': LOG_LEVEL,
+            'propagate': True,
         },
-        'papertrail': {
-            'class': 'logging.handlers.SysLogHandler',
-            'formatter': 'default',
-            'address': (
-                os.getenv('PAPERTRAIL_HOST'),
-                int(os.getenv('PAPERTRAIL_PORT', 0))
-            ),
-            'level': 'INFO',
-        }
-    },
-    'root': {
-        'handlers': [
-            'rotating_file',
-            'console',
-            'sentry',
-            'papertrail',
-        ],
-        'level': 'DEBUG',
-        'propagate': True,
-    },
-})
+    })
+
+    if LOG_HOT_PATH:
+        logs.install(
+            logging.getLogger(),
+            debug_rate=LOG_DEBUG_RATE,
+            queue_size=LOG_QUEUE_SIZE,
+            trace_size=LOG_TRACE_SIZE,
+            trace_path=LOG_TRACE_PATH,
+        )
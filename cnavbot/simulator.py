@@ -0,0 +1,413 @@
+"""
+Simulated Pi2Go in a 2D world, for running bot modes without the hardware
+
+Simulator implements the pi2go driver calls the bot makes against a world
+of line tracks and round obstacles, and is also a virtual clock: sleep()
+moves the bot on in simulated time instead of waiting, so bot modes can run for
+hours of simulated time in seconds. Sensor reads take a little simulated time
+too, so a mode stuck polling sensors still ends:
+
+    $ python -m cnavbot.simulator --mode wander --minutes 60
+    $ python -m cnavbot.simulator --mode follow --world track --json
+
+Distances are in cm, angles in degrees clockwise from the y axis.
+"""
+from __future__ import absolute_import, division, print_function
+import argparse
+import json
+import math
+import sys
+import timeit
+
+from cnavbot import clock
+from cnavbot.services import control
+
+
+class World(object):
+    """Walls of a width x height box, line segments and round obstacles"""
+
+    def __init__(self, width=300, height=300, lines=(), obstacles=(),
+                 line_width=2.0, start=None):
+        self.width = width
+        self.height = height
+        # Initial (x, y, heading) of the bot
+        self.start = start or (width / 2, height / 4, 0.0)
+        # ((x1, y1), (x2, y2)) segments
+        self.lines = list(lines)
+        # (x, y, radius) circles
+        self.obstacles = list(obstacles)
+        self.line_width = line_width
+
+    def on_line(self, x, y):
+        half_width = self.line_width / 2
+        for (x1, y1), (x2, y2) in self.lines:
+            if segment_distance(x, y, x1, y1, x2, y2) <= half_width:
+                return True
+        return False
+
+    def collides(self, x, y, radius):
+        inside_x = radius <= x <= self.width - radius
+        inside_y = radius <= y <= self.height - radius
+        if not (inside_x and inside_y):
+            return True
+        for obstacle_x, obstacle_y, obstacle_radius in self.obstacles:
+            if math.hypot(x - obstacle_x, y - obstacle_y) < (
+                    radius + obstacle_radius):
+                return True
+        return False
+
+    def ray(self, x, y, heading, max_range):
+        """Returns the distance to the first wall or obstacle along heading"""
+        dx = math.sin(math.radians(heading))
+        dy = math.cos(math.radians(heading))
+        nearest = max_range
+
+        # Walls
+        for position, direction, limit in ((x, dx, self.width),
+                                           (y, dy, self.height)):
+            if direction > 0:
+                nearest = min(nearest, (limit - position) / direction)
+            elif direction < 0:
+                nearest = min(nearest, -position / direction)
+
+        for obstacle_x, obstacle_y, radius in self.obstacles:
+            # Solves |start + t * direction - centre| = radius for t
+            offset_x, offset_y = x - obstacle_x, y - obstacle_y
+            along = offset_x * dx + offset_y * dy
+            discriminant = along ** 2 - (
+                offset_x ** 2 + offset_y ** 2 - radius ** 2
+            )
+            if discriminant >= 0:
+                hit = -along - math.sqrt(discriminant)
+                if 0 <= hit < nearest:
+                    nearest = hit
+
+        return max(nearest, 0)
+
+
+def segment_distance(x, y, x1, y1, x2, y2):
+    """Distance from the point to the line segment"""
+    dx, dy = x2 - x1, y2 - y1
+    length = dx ** 2 + dy ** 2
+    if not length:
+        return math.hypot(x - x1, y - y1)
+    along = min(max(((x - x1) * dx + (y - y1) * dy) / length, 0), 1)
+    return math.hypot(x - x1 - along * dx, y - y1 - along * dy)
+
+
+def arena():
+    """Walled box with obstacles to wander around"""
+    return World(
+        width=300,
+        height=300,
+        obstacles=[
+            (80, 80, 15), (220, 90, 20), (150, 170, 25), (70, 230, 20),
+            (230, 230, 15),
+        ],
+    )
+
+
+def track():
+    """Rectangular line track with rounded corners"""
+    corners = []
+    for centre_x, centre_y, start in ((240, 240, 0), (240, 60, 90),
+                                      (60, 60, 180), (60, 240, 270)):
+        for step in range(10):
+            angle = math.radians(start + step * 10)
+            corners.append((
+                centre_x + 40 * math.sin(angle),
+                centre_y + 40 * math.cos(angle),
+            ))
+    points = corners + corners[:1]
+    return World(
+        width=300,
+        height=300,
+        lines=list(zip(points[:-1], points[1:])),
+        # Wider than the line sensors are apart, follow mode keeps both
+        # sensors over the line
+        line_width=5.0,
+        # On the right straight, heading along it
+        start=(280, 150, 0.0),
+    )
+
+
+WORLDS = {
+    'arena': arena,
+    'track': track,
+}
+
+
+class SimulationEnded(Exception):
+    """Raised by Simulator.advance once simulated time reaches end_at"""
+
+
+class Simulator(clock.VirtualClock):
+    """
+    pi2go driver and clock for a bot moving around a World
+
+    Wheel speeds (-100 to 100) stay set until the next motor command, the
+    bot moves on whenever simulated time advances.
+    """
+    # In seconds, longest step of the motion integration
+    resolution = 0.02
+    # cm/s per unit of wheel speed
+    cm_per_speed = 0.5
+    # Degrees/s per unit of wheel speed difference
+    degrees_per_speed = 2.0
+    radius = 8.0
+    # Sensor ranges in cm
+    ir_range = 15.0
+    sonar_range = 400.0
+    # In seconds, time a sensor read takes, so that a mode stuck polling
+    # sensors still runs out of simulated time instead of hanging
+    read_time = 0.001
+    # cm/s, the sonar also waits for its echo
+    speed_of_sound = 34300.0
+    # Line sensor positions in cm, ahead of and either side of the centre
+    line_sensor_ahead = 6.0
+    line_sensor_side = 1.0
+
+    def __init__(self, world=None):
+        super(Simulator, self).__init__()
+        self.world = world or arena()
+        self.x, self.y, self.heading = self.world.start
+        # Simulated time to stop at, even in the middle of a bot mode step
+        self.end_at = None
+        self.left_speed = 0
+        self.right_speed = 0
+        self.switch = False
+        self.leds = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.collisions = 0
+        self.travelled = 0.0
+        self.motor_commands = 0
+        self.line_samples = 0
+        self.line_hits = 0
+
+    # Clock
+
+    def advance(self, seconds):
+        """Moves the bot on by seconds of simulated time"""
+        if self.end_at is not None and self.now >= self.end_at:
+            raise SimulationEnded()
+        until = self.now + max(seconds, 0)
+        while self.now < until:
+            step = min(until - self.now, self.resolution)
+            self.move(step)
+            self.now += step
+        self.now = until
+
+    def move(self, seconds):
+        if not (self.left_speed or self.right_speed):
+            return
+        speed = (self.left_speed + self.right_speed) / 2 * self.cm_per_speed
+        turn = (self.left_speed - self.right_speed) / 2 * (
+            self.degrees_per_speed
+        )
+
+        heading = self.heading + turn * seconds
+        middle = math.radians(self.heading + turn * seconds / 2)
+        x = self.x + speed * seconds * math.sin(middle)
+        y = self.y + speed * seconds * math.cos(middle)
+
+        if self.world.collides(x, y, self.radius):
+            # Bumped, wheels spin without moving the bot
+            self.collisions += 1
+        else:
+            self.travelled += math.hypot(x - self.x, y - self.y)
+            self.x, self.y = x, y
+        self.heading = heading % 360
+
+    # pi2go API
+
+    def init(self):
+        pass
+
+    def cleanup(self):
+        self.stop()
+
+    def go(self, left_speed, right_speed):
+        self.motor_commands += 1
+        self.left_speed = left_speed
+        self.right_speed = right_speed
+
+    def forward(self, speed):
+        self.go(speed, speed)
+
+    def reverse(self, speed):
+        self.go(-speed, -speed)
+
+    def spinLeft(self, speed):
+        self.go(-speed, speed)
+
+    def spinRight(self, speed):
+        self.go(speed, -speed)
+
+    def turnForward(self, left_speed, right_speed):
+        self.go(left_speed, right_speed)
+
+    def turnReverse(self, left_speed, right_speed):
+        self.go(-left_speed, -right_speed)
+
+    def stop(self):
+        self.go(0, 0)
+
+    def ir(self, angle):
+        self.advance(self.read_time)
+        distance = self.world.ray(
+            self.x, self.y, self.heading + angle, self.radius + self.ir_range
+        )
+        return distance <= self.radius + self.ir_range - 1e-9
+
+    def irLeft(self):
+        return self.ir(-45)
+
+    def irRight(self):
+        return self.ir(45)
+
+    def irCentre(self):
+        return self.ir(0)
+
+    def irAll(self):
+        return self.irLeft() or self.irRight() or self.irCentre()
+
+    def line_sensor(self, side):
+        """True over a line, like the reflective sensors of the Pi2Go"""
+        self.advance(self.read_time)
+        heading = math.radians(self.heading)
+        ahead, across = self.line_sensor_ahead, side * self.line_sensor_side
+        on_line = self.world.on_line(
+            self.x + ahead * math.sin(heading) + across * math.cos(heading),
+            self.y + ahead * math.cos(heading) - across * math.sin(heading),
+        )
+        self.line_samples += 1
+        self.line_hits += on_line
+        return on_line
+
+    def irLeftLine(self):
+        return self.line_sensor(-1)
+
+    def irRightLine(self):
+        return self.line_sensor(1)
+
+    def getDistance(self):
+        """Returns distance in cm from the front of the bot"""
+        distance = self.world.ray(
+            self.x, self.y, self.heading, self.radius + self.sonar_range
+        ) - self.radius
+        self.advance(self.read_time + 2 * distance / self.speed_of_sound)
+        return distance
+
+    def getSwitch(self):
+        return self.switch
+
+    def setLED(self, led, red, green, blue):
+        self.leds[led] = (red, green, blue)
+
+    def setAllLEDs(self, red, green, blue):
+        for led in range(1, 5):
+            self.setLED(led, red, green, blue)
+
+    @property
+    def stats(self):
+        return {
+            'simulated_seconds': self.now,
+            'travelled_cm': self.travelled,
+            'collisions': self.collisions,
+            'motor_commands': self.motor_commands,
+            'line_ratio': (
+                self.line_hits / self.line_samples
+                if self.line_samples else 0.0
+            ),
+        }
+
+
+class Sense(object):
+    """Stands in for the cnav-sense client, yaw is the simulated heading"""
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.joystick_direction = None
+
+    @property
+    def yaw(self):
+        return self.simulator.heading
+
+    def display_text(self, text):
+        pass
+
+
+# Bot mode steps run by the simulator
+MODES = {
+    'wander': 'wander',
+    'follow': 'follow_line',
+    'follow-avoid': 'follow_line_and_avoid_obstacles',
+}
+
+
+def simulate(mode, minutes, world, rate=20, bot_kwargs=None):
+    """Runs a bot mode step at rate for simulated minutes, returns stats"""
+    # Imported here so that worlds can be used without the service deps
+    from cnavbot.services import bot
+
+    simulator = Simulator(world=world)
+    sim_bot = bot.Bot(
+        driver=simulator,
+        clock=simulator,
+        sense=Sense(simulator),
+        **(bot_kwargs or {})
+    )
+    loop = control.ControlLoop(
+        step=getattr(sim_bot, MODES[mode]),
+        rate=rate,
+        report_interval=float('inf'),
+        clock=simulator,
+    )
+
+    started_at = timeit.default_timer()
+    simulator.end_at = minutes * 60
+    try:
+        loop.run()
+    except SimulationEnded:
+        pass
+    sim_bot.cleanup()
+
+    stats = simulator.stats
+    stats['wall_seconds'] = timeit.default_timer() - started_at
+    stats['speedup'] = stats['simulated_seconds'] / stats['wall_seconds']
+    stats['overruns'] = loop.overruns
+    return stats
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--mode', choices=sorted(MODES), default='wander')
+    parser.add_argument('--world', choices=sorted(WORLDS), default='arena')
+    parser.add_argument('--minutes', type=float, default=10)
+    parser.add_argument(
+        '--json', action='store_true', help='print results as JSON'
+    )
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    options = parse_args(sys.argv[1:] if args is None else args)
+    stats = simulate(
+        options.mode,
+        options.minutes,
+        WORLDS[options.world](),
+        bot_kwargs={'publisher': None},
+    )
+
+    if options.json:
+        print(json.dumps(stats, indent=2, sort_keys=True))
+    else:
+        for name, value in sorted(stats.items()):
+            print('{:<20}{:>12.2f}'.format(name, value))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
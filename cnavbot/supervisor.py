@@ -0,0 +1,213 @@
+"""
+Runs every enabled service in its own process
+
+Each process can be pinned to its own CPU cores, so vision load can't
+starve the control loop, and is restarted with exponential backoff when it
+dies. CPU usage and RSS of each service (including the processes it spawns)
+are logged and exported as metrics.
+"""
+from __future__ import absolute_import, division
+import glob
+import logging
+import multiprocessing
+import os
+import subprocess
+
+from cnavbot import clock, metrics, settings
+from cnavbot.utils import log_exceptions
+
+
+logger = logging.getLogger()
+
+CPU_USAGE = metrics.gauge(
+    'cnavbot_service_cpu_percent', 'Service CPU usage', labels=('service', )
+)
+RSS = metrics.gauge(
+    'cnavbot_service_rss_bytes',
+    'Service resident memory',
+    labels=('service', ),
+)
+RESTARTS = metrics.counter(
+    'cnavbot_service_restarts_total', 'Service restarts', labels=('service', )
+)
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def pin(pid, cpus):
+    """Restricts the process (and processes it starts later) to the cpus"""
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(pid, {int(cpu) for cpu in cpus.split(',')})
+    else:
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(
+                ['taskset', '-p', '-c', cpus, str(pid)], stdout=devnull
+            )
+    logger.info('Pinned process {} to CPUs {}'.format(pid, cpus))
+
+
+def run_service(start, cpus=None):
+    """Process target: starts the service and waits for what it spawned"""
+    with log_exceptions():
+        if cpus:
+            pin(os.getpid(), cpus)
+        start()
+        for child in multiprocessing.active_children():
+            child.join()
+
+
+def read_stat(pid):
+    """Returns (parent pid, cpu ticks) of the process, None if it's gone"""
+    try:
+        with open('/proc/{}/stat'.format(pid)) as stat_file:
+            stat = stat_file.read()
+    except IOError:
+        return None
+    # Process name can contain spaces, fields after it are space separated
+    fields = stat[stat.rindex(')') + 2:].split()
+    return int(fields[1]), int(fields[11]) + int(fields[12])
+
+
+def read_rss(pid):
+    """Returns resident memory of the process in bytes"""
+    try:
+        with open('/proc/{}/status'.format(pid)) as status_file:
+            for line in status_file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    return 0
+
+
+def process_tree(pid):
+    """Returns pids of the process and all its descendants"""
+    parents = {}
+    for stat_path in glob.glob('/proc/[0-9]*/stat'):
+        child = int(stat_path.split('/')[2])
+        stat = read_stat(child)
+        if stat:
+            parents.setdefault(stat[0], []).append(child)
+
+    tree = [pid]
+    for member in tree:
+        tree.extend(parents.get(member, ()))
+    return tree
+
+
+class Supervised(object):
+    """A service process and its restart and resource usage bookkeeping"""
+
+    def __init__(self, name, start, cpus=None):
+        self.name = name
+        self.start = start
+        self.cpus = cpus
+        self.process = None
+        self.failures = 0
+        self.started_at = None
+        self.restart_at = None
+        self.cpu_ticks = 0
+        self.cpu_percent = 0.0
+        self.rss = 0
+
+    def launch(self, now):
+        self.process = multiprocessing.Process(
+            target=run_service, args=(self.start, self.cpus), name=self.name
+        )
+        self.process.start()
+        self.started_at = now
+        self.restart_at = None
+        self.cpu_ticks = 0
+        logger.info('Started {} service (pid {})'.format(
+            self.name, self.process.pid
+        ))
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def backoff(self):
+        return min(
+            settings.SUPERVISOR_BACKOFF * 2 ** (self.failures - 1),
+            settings.SUPERVISOR_MAX_BACKOFF,
+        )
+
+    def died(self, now):
+        """Schedules the restart of a dead service"""
+        if now - self.started_at >= settings.SUPERVISOR_STABLE_AFTER:
+            self.failures = 0
+        self.failures += 1
+        self.restart_at = now + self.backoff()
+        logger.error(
+            '{} service died with exit code {}, restarting in {}s'.format(
+                self.name, self.process.exitcode, self.restart_at - now
+            )
+        )
+
+    def check(self, now):
+        if self.alive:
+            return
+        if self.restart_at is None:
+            self.died(now)
+        elif now >= self.restart_at:
+            RESTARTS.labels(self.name).inc()
+            self.launch(now)
+
+    def measure(self, elapsed):
+        if not self.alive:
+            return
+
+        pids = process_tree(self.process.pid)
+        stats = [read_stat(pid) for pid in pids]
+        cpu_ticks = sum(stat[1] for stat in stats if stat)
+        if elapsed:
+            self.cpu_percent = 100 * (cpu_ticks - self.cpu_ticks) / (
+                CLOCK_TICKS * elapsed
+            )
+        self.cpu_ticks = cpu_ticks
+        self.rss = sum(read_rss(pid) for pid in pids)
+
+        CPU_USAGE.labels(self.name).set(self.cpu_percent)
+        RSS.labels(self.name).set(self.rss)
+
+
+class Supervisor(object):
+
+    def __init__(self, services, *args, **kwargs):
+        self.services = services
+        self.check_interval = kwargs.pop(
+            'check_interval', settings.SUPERVISOR_CHECK_INTERVAL
+        )
+        self.report_interval = kwargs.pop(
+            'report_interval', settings.SUPERVISOR_REPORT_INTERVAL
+        )
+        self.clock = kwargs.pop('clock', clock.REAL_CLOCK)
+
+    def report(self, elapsed):
+        for service in self.services:
+            service.measure(elapsed)
+            logger.info('{} service: {:.1f}% CPU, {:.1f} MB RSS{}'.format(
+                service.name,
+                service.cpu_percent,
+                service.rss / 1024 / 1024,
+                '' if service.alive else ' (not running)',
+            ))
+
+    def run(self):
+        metrics.serve(settings.METRICS_SUPERVISOR_PORT)
+
+        now = reported_at = self.clock.monotonic()
+        for service in self.services:
+            service.launch(now)
+            service.measure(0)
+
+        while True:
+            self.clock.sleep(self.check_interval)
+            now = self.clock.monotonic()
+
+            for service in self.services:
+                service.check(now)
+
+            if now - reported_at >= self.report_interval:
+                self.report(now - reported_at)
+                reported_at = now
@@ -2,8 +2,8 @@ from unittest import TestCase
 
 import mock
 
-from cnavbot import settings
-from cnavbot.services import bot
+from cnavbot import clock, latency, settings
+from cnavbot.services import bot, heading
 
 
 class TestBot(TestCase):
@@ -91,6 +91,22 @@ class TestBot(TestCase):
         )
         self.bot.motors.keep_running.assert_called_once()
 
+    def test_avoid_front_left_right_distant_obstacles(self):
+        self.bot.driver.irCentre.side_effect = [True, False]
+        self.bot.driver.irRight.return_value = True
+        self.bot.driver.irLeft.return_value = True
+        self.bot.obstacle_sensor.driver.getDistance.return_value = (
+            settings.BOT_DEFAULT_MAX_DISTANCE + 1
+        )
+
+        self.bot.avoid_front_obstacle()
+
+        self.bot.driver.reverse.assert_not_called()
+        self.bot.driver.spinRight.assert_called_once_with(
+            self.bot.motors.speed
+        )
+        self.bot.motors.keep_running.assert_called_once()
+
     def test_switch_pressed(self):
         self.bot.driver.getSwitch.return_value = True
         return_value = self.bot.switch_pressed
@@ -111,3 +127,61 @@ class TestBot(TestCase):
         self.bot.distance
 
         self.bot.obstacle_sensor.driver.getDistance.assert_called_once()
+
+    @mock.patch('os.remove')
+    @mock.patch('cnavbot.services.bot.cv2')
+    def test_find_target_in_image_path(self, cv2_mock, remove_mock):
+        self.bot.detector = mock.Mock()
+
+        target = self.bot.find_target_in_image('/tmp/image.jpg')
+
+        cv2_mock.imread.assert_called_once_with('/tmp/image.jpg')
+        self.bot.detector.detect.assert_called_once_with(
+            cv2_mock.imread.return_value
+        )
+        remove_mock.assert_called_once_with('/tmp/image.jpg')
+        assert target == self.bot.detector.detect.return_value
+
+    @mock.patch('os.remove')
+    def test_find_target_in_frame(self, remove_mock):
+        self.bot.detector = mock.Mock()
+        frame = mock.Mock()
+
+        self.bot.find_target_in_image(frame)
+
+        self.bot.detector.detect.assert_called_once_with(frame)
+        remove_mock.assert_not_called()
+
+    @mock.patch('cnavbot.settings.FRAME_BUFFER_PATH', '/tmp/cnavbot-missing')
+    def test_open_frame_buffer_before_camera(self):
+        assert self.bot.open_frame_buffer() is None
+
+    def test_receive_skips_stale_messages(self):
+        self.bot.tracer = latency.Tracer(
+            max_age=1, clock=clock.VirtualClock(start=10)
+        )
+        subscriber = mock.Mock()
+        subscriber.receive.side_effect = [
+            mock.Mock(data={'x': 1, '_trace': {'capture': 5}}),
+            mock.Mock(data={'x': 2, '_trace': {'capture': 9.5}}),
+        ]
+
+        assert self.bot.receive(subscriber, 'position') == {'x': 2}
+        assert self.bot.tracer.stats['position']['stale'] == 1
+
+    def test_turn_to_direction(self):
+        simulation = heading.SimulatedHeading(yaw=350)
+        type(self.bot.sense).yaw = mock.PropertyMock(
+            side_effect=simulation.read_yaw
+        )
+        self.bot.motors.spin = mock.Mock(side_effect=simulation.spin)
+        self.bot.clock = mock.Mock(
+            monotonic=simulation.timer, sleep=simulation.sleep
+        )
+
+        stats = self.bot.turn_to_direction(direction=30, tolerance=5)
+
+        assert stats['converged']
+        assert 25 <= simulation.yaw <= 35
+        # Turned right, across north
+        assert self.bot.motors.spin.call_args_list[0][0][0] > 0
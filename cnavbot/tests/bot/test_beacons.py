@@ -0,0 +1,173 @@
+from __future__ import absolute_import
+from unittest import TestCase
+
+import mock
+
+from cnavbot import clock, latency, settings
+from cnavbot.services import beacons, bluetooth
+
+
+BEACON = 'e2c56db5dffb48d2b060d0f5a71096e1'
+OTHER_BEACON = 'e2c56db5dffb48d2b060d0f5a71096e2'
+
+
+def advertisement(uuid, rssi, txpower=-59):
+    return 'aa:bb:cc:dd:ee:ff,{},1,1,{},{}'.format(uuid, txpower, rssi)
+
+
+class TestBeaconFilter(TestCase):
+
+    def setUp(self):
+        self.filter = beacons.BeaconFilter(
+            beacons=[BEACON, OTHER_BEACON],
+            window=5,
+            alpha=0.5,
+            outlier_threshold=3,
+            timeout=10,
+        )
+
+    def test_moving_average(self):
+        self.filter.update(advertisement(BEACON, -60), now=1)
+        self.filter.update(advertisement(BEACON, -70), now=2)
+
+        assert self.filter.estimates(now=2) == {
+            BEACON: {'rssi': -65.0, 'txpower': -59},
+        }
+
+    def test_ignores_unknown_beacons(self):
+        assert not self.filter.update(advertisement('unknown', -60), now=1)
+
+        assert self.filter.estimates(now=1) == {}
+
+    def test_rejects_outliers(self):
+        for rssi in (-60, -61, -60, -61):
+            self.filter.update(advertisement(BEACON, rssi), now=1)
+        estimate = self.filter.estimates(now=1)[BEACON]['rssi']
+
+        assert not self.filter.update(advertisement(BEACON, -90), now=2)
+        assert self.filter.estimates(now=2)[BEACON]['rssi'] == estimate
+        assert self.filter.rejected == 1
+
+    def test_follows_persistent_change(self):
+        for rssi in (-60, -60, -60, -80, -80, -80, -80, -80):
+            self.filter.update(advertisement(BEACON, rssi), now=1)
+
+        assert self.filter.estimates(now=1)[BEACON]['rssi'] < -70
+
+    def test_pop_changed(self):
+        self.filter.update(advertisement(BEACON, -60), now=1)
+
+        assert self.filter.pop_changed() == {BEACON}
+        assert self.filter.pop_changed() == set()
+
+    def test_drops_stale_beacons(self):
+        self.filter.update(advertisement(BEACON, -60), now=1)
+        self.filter.update(advertisement(OTHER_BEACON, -60), now=5)
+
+        assert list(self.filter.estimates(now=12)) == [OTHER_BEACON]
+
+
+class TestAdvertisementReader(TestCase):
+
+    def setUp(self):
+        self.scanner = mock.Mock()
+        self.reader = bluetooth.AdvertisementReader(
+            mock.Mock(), self.scanner, queue_size=2
+        )
+
+    def test_read(self):
+        self.scanner.parse_events.return_value = [advertisement(BEACON, -60)]
+
+        self.reader.read()
+
+        self.scanner.parse_events.assert_called_once_with(
+            self.reader.socket, loop_count=1
+        )
+        assert list(self.reader.drain()) == [advertisement(BEACON, -60)]
+        assert self.reader.processed == 1
+
+    def test_drops_when_full(self):
+        self.scanner.parse_events.return_value = [
+            advertisement(BEACON, rssi) for rssi in (-60, -61, -62)
+        ]
+
+        self.reader.read()
+
+        assert self.reader.received == 3
+        assert self.reader.dropped == 1
+        assert len(list(self.reader.drain())) == 2
+
+
+class TestBluetooth(TestCase):
+
+    def test_scan(self):
+        scanner = mock.Mock()
+        scanner.parse_events.return_value = [
+            advertisement(BEACON, -60),
+            advertisement(BEACON, -70),
+            advertisement('unknown', -50),
+        ]
+        resource = bluetooth.Bluetooth(
+            publisher=mock.Mock(port=1),
+            driver=mock.Mock(),
+            scanner=scanner,
+            beacons=beacons.BeaconFilter(beacons=[BEACON], alpha=0.5),
+        )
+        resource.reader = bluetooth.AdvertisementReader(mock.Mock(), scanner)
+        resource.reader.read()
+
+        assert resource.scan()[BEACON]['rssi'] == -65.0
+        assert resource.scan()[BEACON]['rssi'] == -65.0
+        assert resource.reader.processed == 3
+
+    def test_publishes_expired_beacons(self):
+        virtual_clock = clock.VirtualClock(start=100)
+        resource = bluetooth.Bluetooth(
+            publisher=mock.Mock(port=1),
+            driver=mock.Mock(),
+            scanner=mock.Mock(),
+            clock=virtual_clock,
+            beacons=beacons.BeaconFilter(
+                beacons=[BEACON], timeout=0.5, clock=virtual_clock
+            ),
+        )
+        resource.beacons.update(advertisement(BEACON, -60))
+
+        assert resource.publish(resource.beacons.estimates())
+        assert not resource.publish(resource.beacons.estimates())
+        virtual_clock.advance(0.6)
+
+        assert resource.publish(resource.beacons.estimates())
+        assert resource.publisher.send.call_args[0][0].data == {}
+
+    def test_republishes_periodically(self):
+        virtual_clock = clock.VirtualClock()
+        resource = bluetooth.Bluetooth(
+            publisher=mock.Mock(port=1),
+            driver=mock.Mock(),
+            scanner=mock.Mock(),
+            clock=virtual_clock,
+        )
+
+        assert resource.publish({})
+        assert not resource.publish({})
+        virtual_clock.advance(settings.BLUETOOTH_REPUBLISH_INTERVAL)
+
+        assert resource.publish({})
+
+    def test_traced_estimates_published_once(self):
+        virtual_clock = clock.VirtualClock()
+        resource = bluetooth.Bluetooth(
+            publisher=mock.Mock(port=1),
+            driver=mock.Mock(),
+            scanner=mock.Mock(),
+            clock=virtual_clock,
+        )
+        resource.stamper = latency.Stamper(enabled=True, clock=virtual_clock)
+        estimates = {BEACON: {'rssi': -60}}
+
+        assert resource.publish(estimates)
+        assert not resource.publish(estimates)
+        sent = resource.publisher.send.call_args[0][0].data
+        assert latency.TRACE_KEY in sent
+        assert resource.published == {BEACON}
@@ -0,0 +1,42 @@
+from __future__ import absolute_import
+from unittest import TestCase
+
+import mock
+
+from cnavbot import clock, settings
+from cnavbot.services import camera
+
+
+class TestCamera(TestCase):
+
+    def setUp(self):
+        self.camera = camera.Camera(
+            publisher=mock.Mock(port=1),
+            camera=mock.Mock(),
+            interval=0.5,
+            capture_mode=settings.CAMERA_CAPTURE_MODE_STREAM,
+        )
+        self.camera.capture_to_stream = True
+        self.picamera = mock.Mock()
+        self.picamera.capture_continuous.return_value = range(4)
+
+    @mock.patch.object(clock.REAL_CLOCK, 'monotonic')
+    def test_stream_drops_frames_between_intervals(self, time_mock):
+        time_mock.side_effect = [1.0, 1.2, 1.6, 1.7]
+
+        self.camera.stream(self.picamera)
+
+        assert self.camera.publisher.send.call_count == 2
+        self.picamera.capture_continuous.assert_called_once_with(
+            mock.ANY, 'jpeg', use_video_port=True
+        )
+
+    def test_frame_rate(self):
+        frame_rate = camera.FrameRate(report_interval=1)
+        frame_rate.reset(0)
+
+        for now in (0.5, 1.0):
+            frame_rate.tick(now, published=now == 1.0)
+
+        assert frame_rate.captured_fps == 2.0
+        assert frame_rate.published_fps == 1.0
@@ -0,0 +1,75 @@
+from __future__ import absolute_import
+from unittest import TestCase
+
+import mock
+
+from cnavbot import clock
+
+
+class TestVirtualClock(TestCase):
+
+    def setUp(self):
+        self.clock = clock.VirtualClock(start=10)
+
+    def test_sleep_advances_time(self):
+        self.clock.sleep(2.5)
+
+        assert self.clock.time() == 12.5
+        assert self.clock.monotonic() == 12.5
+
+    def test_never_goes_backwards(self):
+        self.clock.advance(-1)
+
+        assert self.clock.time() == 10
+
+
+class TestDeadline(TestCase):
+
+    def setUp(self):
+        self.clock = clock.VirtualClock()
+
+    def test_expires(self):
+        deadline = self.clock.deadline(1)
+        assert deadline.remaining() == 1
+        assert not deadline.expired()
+
+        self.clock.advance(1)
+
+        assert deadline.remaining() == 0
+        assert deadline.expired()
+
+    def test_sleep_stops_at_deadline(self):
+        deadline = self.clock.deadline(1)
+
+        deadline.sleep(0.4)
+        deadline.sleep(5)
+
+        assert self.clock.time() == 1
+
+    def test_without_limit(self):
+        deadline = self.clock.deadline()
+        self.clock.advance(1000)
+
+        assert deadline.remaining() is None
+        assert not deadline.expired()
+
+
+class TestRealClock(TestCase):
+
+    @mock.patch('time.sleep')
+    def test_sleep(self, sleep_mock):
+        clock.REAL_CLOCK.sleep(0.5)
+
+        sleep_mock.assert_called_once_with(0.5)
+
+    @mock.patch('time.time', return_value=100.0)
+    def test_time(self, time_mock):
+        assert clock.REAL_CLOCK.time() == 100.0
+
+    @mock.patch('time.time', return_value=100.0)
+    def test_monotonic_ignores_wall_clock(self, time_mock):
+        first = clock.REAL_CLOCK.monotonic()
+        second = clock.REAL_CLOCK.monotonic()
+
+        assert first != 100.0
+        assert 0 <= second - first < 1
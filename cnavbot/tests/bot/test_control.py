@@ -0,0 +1,71 @@
+from __future__ import absolute_import
+from unittest import TestCase
+
+import mock
+
+from cnavbot.services import control
+
+
+class TestControlLoop(TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.step = mock.Mock(__name__='step')
+        self.sleep = mock.Mock(side_effect=self.advance)
+        self.loop = control.ControlLoop(
+            step=self.step,
+            rate=10,
+            report_interval=60,
+            timer=lambda: self.now,
+            sleep=self.sleep,
+        )
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    def test_runs_at_rate(self):
+        self.loop.run(ticks=5)
+
+        assert self.step.call_count == 5
+        assert self.now == 0.5
+        assert self.loop.stats['overruns'] == 0
+
+    def test_overrun(self):
+        self.step.side_effect = lambda: self.advance(0.25)
+
+        self.loop.run(ticks=2)
+
+        stats = self.loop.stats
+        assert stats['ticks'] == 2
+        assert stats['overruns'] == 2
+        assert stats['max_latency'] == 0.25
+        self.sleep.assert_not_called()
+
+    def test_jitter(self):
+        # Sleeping longer than asked for delays the next tick
+        self.sleep.side_effect = lambda seconds: self.advance(seconds + 0.01)
+
+        self.loop.run(ticks=3)
+
+        assert round(self.loop.stats['max_jitter'], 6) == 0.01
+
+    def test_unthrottled(self):
+        loop = control.ControlLoop(
+            step=self.step, rate=0, timer=lambda: self.now, sleep=self.sleep
+        )
+
+        loop.run(ticks=3)
+
+        assert self.step.call_count == 3
+        self.sleep.assert_not_called()
+
+    def test_wakes_up_early(self):
+        wait = mock.Mock(return_value=True)
+        self.loop.wait = wait
+
+        self.loop.run(ticks=3)
+
+        assert self.step.call_count == 3
+        assert self.now == 0
+        wait.assert_called_with(0.1)
+        self.sleep.assert_not_called()
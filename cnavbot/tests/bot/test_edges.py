@@ -0,0 +1,154 @@
+from __future__ import absolute_import
+import threading
+from unittest import TestCase
+
+import mock
+import pytest
+
+from cnavbot import clock
+from cnavbot.services import edges, pi2go
+
+
+class TestEdgeSensors(TestCase):
+
+    def setUp(self):
+        self.backend = edges.SimulatedBackend(obstacle_left=True)
+        self.clock = clock.VirtualClock(start=1)
+        self.edges = edges.EdgeSensors(
+            self.backend, clock=self.clock, queue_size=2
+        )
+        self.edges.start()
+
+    def test_initial_state(self):
+        assert self.edges.detected('obstacle_left')
+        assert not self.edges.detected('line_right')
+        assert self.edges.changed_at == 1
+
+    def test_edge(self):
+        self.clock.advance(1)
+        self.backend.set('line_right', True)
+
+        assert self.edges.detected('line_right')
+        assert self.edges.changed_at == 2
+        assert self.edges.events_since(1) == [
+            edges.Edge('line_right', True, 2),
+        ]
+
+    def test_ignores_repeats(self):
+        self.backend.set('obstacle_left', True)
+
+        assert self.edges.count == 0
+
+    def test_queue_is_bounded(self):
+        for detected in (False, True, False):
+            self.backend.set('obstacle_left', detected)
+
+        assert self.edges.count == 3
+        assert len(self.edges.events_since(0)) == 2
+
+    def test_wait_for_change_times_out(self):
+        assert self.edges.wait_for_change(timeout=0) is None
+
+    def test_wait_for_change(self):
+        timer = threading.Timer(
+            0.01, self.backend.set, args=('obstacle_front', True)
+        )
+        timer.start()
+
+        edge = self.edges.wait_for_change(timeout=5)
+
+        assert edge.channel == 'obstacle_front'
+        assert edge.detected
+
+    def test_wait_for_change_on_channels(self):
+        def change():
+            self.backend.set('line_left', True)
+            self.backend.set('obstacle_front', True)
+        threading.Timer(0.01, change).start()
+
+        edge = self.edges.wait_for_change(
+            timeout=5, channels=('obstacle_front', )
+        )
+
+        assert edge.channel == 'obstacle_front'
+
+
+class TestBackends(TestCase):
+
+    def test_polling(self):
+        driver = mock.Mock()
+        driver.irLeftLine.return_value = False
+        backend = edges.PollingBackend(driver)
+        backend.callback = callback = mock.Mock()
+
+        backend.poll()
+        backend.poll()
+
+        # Line sensors read False over a line
+        callback.assert_any_call('line_left', True)
+        assert callback.call_count == len(edges.CHANNELS)
+
+    def test_gpio(self):
+        driver = mock.Mock(irFL=7)
+        driver.GPIO.input.return_value = 0
+        backend = edges.GPIOBackend(driver, bounce_time=5)
+        callback = mock.Mock()
+
+        backend.start(callback)
+        registered = {
+            call[0][0]: call[1]['callback']
+            for call in driver.GPIO.add_event_detect.call_args_list
+        }
+        registered[7](7)
+
+        callback.assert_called_once_with('obstacle_left', True)
+
+    def test_invalid_backend(self):
+        with pytest.raises(Exception) as excinfo:
+            edges.create_backend(mock.Mock(), name='magic')
+        assert excinfo.value.message == (
+            "Invalid sensor backend 'magic', must be one of "
+            "['gpio', 'polling']"
+        )
+
+
+class TestSensorsWithEdges(TestCase):
+
+    def setUp(self):
+        self.backend = edges.SimulatedBackend()
+        self.clock = clock.VirtualClock()
+        self.edges = edges.EdgeSensors(self.backend, clock=self.clock)
+        self.edges.start()
+        self.driver = mock.Mock()
+
+    def test_obstacle_snapshot(self):
+        sensor = pi2go.ObstacleSensor(
+            driver=self.driver, clock=self.clock, edges=self.edges
+        )
+        self.clock.advance(0.01)
+        assert not sensor.snapshot().front
+
+        self.backend.set('obstacle_front', True)
+
+        assert sensor.snapshot().front
+        self.driver.irCentre.assert_not_called()
+
+    def test_line(self):
+        sensor = pi2go.LineSensor(driver=self.driver, edges=self.edges)
+
+        self.backend.set('line_left', True)
+
+        assert sensor.left()
+        assert not sensor.right()
+        self.driver.irLeftLine.assert_not_called()
+
+    def test_motors_wake_on_change(self):
+        motors = pi2go.Motors(
+            driver=self.driver, edges=self.edges, poll_interval=5
+        )
+        completion = pi2go.Completion()
+        threading.Timer(
+            0.01, self.backend.set, args=('obstacle_left', True)
+        ).start()
+
+        assert not motors.wait_step(completion)
@@ -0,0 +1,64 @@
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import mock
+import numpy
+
+from cnavbot.services import frames
+
+
+class TestFrameBuffer(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'frames')
+        self.camera_buffer = self.frame_buffer(create=True)
+        self.output = frames.FrameOutput(self.camera_buffer)
+        self.bot_buffer = self.frame_buffer()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def frame_buffer(self, create=False):
+        return frames.FrameBuffer(
+            create=create, path=self.path, slots=2, resolution=(32, 16)
+        )
+
+    def capture(self, value):
+        self.output.write(numpy.full(32 * 16 * 3, value, numpy.uint8))
+        return self.output.commit()
+
+    def test_read_copies_frame(self):
+        data = self.capture(10)
+
+        frame = self.bot_buffer.read(data)
+        self.capture(20)
+        self.capture(30)
+
+        assert frame.shape == (16, 32, 3)
+        assert (frame == 10).all()
+
+    def test_overwritten_before_read(self):
+        data = self.capture(10)
+        self.capture(20)
+        self.capture(30)
+
+        assert self.bot_buffer.read(data) is None
+
+    def test_overwritten_while_read(self):
+        data = self.capture(10)
+
+        with mock.patch.object(
+                self.bot_buffer, 'is_current', side_effect=[True, False]):
+            assert self.bot_buffer.read(data) is None
+
+    def test_recreated_in_place(self):
+        data = self.capture(10)
+
+        self.frame_buffer(create=True)
+
+        assert os.path.getsize(self.path) == 2 * 8 + 2 * 32 * 16 * 3
+        assert (self.bot_buffer.read(data) == 10).all()
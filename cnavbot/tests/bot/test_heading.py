@@ -0,0 +1,79 @@
+from __future__ import absolute_import
+from unittest import TestCase
+
+from cnavbot.services import heading
+
+
+class TestHeadingController(TestCase):
+
+    def turn(self, start, target, tolerance=5, lag=0.1, **kwargs):
+        self.simulation = heading.SimulatedHeading(yaw=start, lag=lag)
+        self.controller = heading.HeadingController(
+            tolerance=tolerance,
+            timer=self.simulation.timer,
+            sleep=self.simulation.sleep,
+            **kwargs
+        )
+        return self.controller.turn(
+            target,
+            read_yaw=self.simulation.read_yaw,
+            spin=self.simulation.spin,
+            stop=self.simulation.stop,
+        )
+
+    def test_speed(self):
+        controller = heading.HeadingController(
+            kp=1, kd=0, min_speed=15, max_speed=60, tolerance=5
+        )
+
+        assert controller.speed(error=3, yaw_rate=0) == 0
+        assert controller.speed(error=10, yaw_rate=0) == 15
+        assert controller.speed(error=-30, yaw_rate=0) == -30
+        assert controller.speed(error=120, yaw_rate=0) == 60
+
+    def test_speed_damped_by_yaw_rate(self):
+        controller = heading.HeadingController(
+            kp=1, kd=0.5, min_speed=15, max_speed=60, tolerance=5
+        )
+
+        assert controller.speed(error=40, yaw_rate=40) == 20
+
+    def test_converges(self):
+        stats = self.turn(start=0, target=90)
+
+        assert stats['converged']
+        assert abs(heading.wrap_angle(90 - self.simulation.yaw)) <= 5
+        assert stats['overshoot'] < 5
+        assert stats['duration'] < 2
+
+    def test_turns_shorter_way_across_north(self):
+        stats = self.turn(start=350, target=20)
+
+        assert stats['converged']
+        assert stats['duration'] < 1
+        assert abs(heading.wrap_angle(20 - self.simulation.yaw)) <= 5
+
+    def test_overshoot_without_damping(self):
+        damped = self.turn(
+            start=0, target=180, kp=2, kd=0.1, max_speed=100, lag=0.2
+        )
+        undamped = self.turn(
+            start=0, target=180, kp=2, kd=0, max_speed=100, lag=0.2
+        )
+
+        assert damped['overshoot'] == 0
+        assert undamped['overshoot'] > 5
+        assert damped['duration'] < undamped['duration']
+
+    def test_times_out(self):
+        stats = self.turn(start=0, target=90, max_speed=5, min_speed=5)
+
+        assert not stats['converged']
+        assert stats['duration'] >= self.controller.timeout
+        assert self.simulation.speed == 0
+
+    def test_stops_when_done(self):
+        self.turn(start=0, target=45)
+
+        assert self.simulation.speed == 0
+        assert self.controller.last_stats['iterations'] > 0
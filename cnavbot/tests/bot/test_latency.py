@@ -0,0 +1,117 @@
+from __future__ import absolute_import
+from unittest import TestCase
+
+import pytest
+
+from cnavbot import clock, latency
+
+
+class TestStamper(TestCase):
+
+    def setUp(self):
+        self.clock = clock.VirtualClock(start=100)
+        self.stamper = latency.Stamper(enabled=True, clock=self.clock)
+
+    def test_stamp(self):
+        data = self.stamper.stamp('scan', {'x': 1}, captured_at=99.5)
+
+        assert data['_trace'] == {
+            'sequence': 1, 'capture': 99.5, 'publish': 100
+        }
+        assert self.stamper.stamp('scan', {})['_trace']['sequence'] == 2
+        assert self.stamper.stamp('other', {})['_trace']['sequence'] == 1
+
+    def test_disabled(self):
+        self.stamper.enabled = False
+
+        assert self.stamper.stamp('scan', {'x': 1}) == {'x': 1}
+
+    def test_split(self):
+        data = self.stamper.stamp('scan', {'x': 1})
+
+        payload, stamp = latency.split(data)
+
+        assert payload == {'x': 1}
+        assert stamp['sequence'] == 1
+        assert '_trace' in data
+        assert latency.split('frame.jpg') == ('frame.jpg', None)
+
+
+class TestTracer(TestCase):
+
+    def setUp(self):
+        self.clock = clock.VirtualClock(start=100)
+        self.stamper = latency.Stamper(enabled=True, clock=self.clock)
+        self.tracer = latency.Tracer(
+            max_age=0.5, window=10, report_interval=60, clock=self.clock
+        )
+
+    def publish(self, captured_at=None):
+        return self.stamper.stamp('scan', {'x': 1}, captured_at=captured_at)
+
+    def test_stages(self):
+        data = self.publish(captured_at=99.9)
+        self.clock.advance(0.1)
+
+        payload, trace = self.tracer.receive('scan', data)
+        self.clock.advance(0.2)
+        self.tracer.mark('scan', 'processed')
+        self.clock.advance(0.1)
+        self.tracer.mark('scan', 'actuated')
+        self.tracer.mark('scan', 'actuated')
+
+        assert payload == {'x': 1}
+        assert trace.sequence == 1
+        stages = self.tracer.stats['scan']['stages']
+        assert stages['publish'][50] == pytest.approx(0.1)
+        assert stages['receive'][50] == pytest.approx(0.2)
+        assert stages['processed'][50] == pytest.approx(0.4)
+        assert stages['actuated'][99] == pytest.approx(0.5)
+
+    def test_unstamped_messages_start_at_receive(self):
+        self.tracer.receive('orientation', {'yaw': 10})
+        self.clock.advance(0.05)
+        self.tracer.mark('orientation', 'processed')
+
+        stages = self.tracer.stats['orientation']['stages']
+        assert sorted(stages) == ['processed', 'receive']
+        assert stages['processed'][50] == pytest.approx(0.05)
+
+    def test_counts_gaps_and_repeats(self):
+        first = self.publish()
+        self.tracer.receive('scan', first)
+        self.tracer.receive('scan', first)
+        self.publish()
+        self.publish()
+        self.tracer.receive('scan', self.publish())
+
+        stats = self.tracer.stats['scan']
+        assert stats['repeats'] == 1
+        assert stats['gaps'] == 2
+
+    def test_fresh(self):
+        _, trace = self.tracer.receive('scan', self.publish())
+        assert self.tracer.fresh(trace)
+
+        self.clock.advance(1)
+
+        assert not self.tracer.fresh(trace)
+        assert self.tracer.stats['scan']['stale'] == 1
+
+    def test_no_max_age(self):
+        self.tracer.max_age = 0
+        _, trace = self.tracer.receive('scan', self.publish())
+        self.clock.advance(10)
+
+        assert self.tracer.fresh(trace)
+
+    def test_percentiles_of_latest_window(self):
+        for seconds in range(20):
+            data = self.publish(captured_at=self.clock.time() - seconds)
+            self.tracer.receive('scan', data)
+
+        percentiles = self.tracer.percentiles('scan', 'receive')
+
+        assert percentiles[50] == 14
+        assert percentiles[99] == 19
+        assert self.tracer.percentiles('scan', 'actuated') == {}
@@ -0,0 +1,119 @@
+from __future__ import absolute_import
+from Queue import Queue
+from StringIO import StringIO
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import mock
+
+from cnavbot import clock, logs
+
+
+def record(message, args=(), level=logging.DEBUG, line=1):
+    return logging.LogRecord(
+        'root', level, 'pi2go.py', line, message, args, None
+    )
+
+
+class TestRateLimitFilter(TestCase):
+
+    def setUp(self):
+        self.clock = clock.VirtualClock()
+        self.filter = logs.RateLimitFilter(rate=10, clock=self.clock)
+
+    def test_limits_each_call_site(self):
+        assert self.filter.filter(record('Left'))
+        assert not self.filter.filter(record('Left'))
+        assert self.filter.filter(record('Right', line=2))
+
+    def test_reports_suppressed(self):
+        self.filter.filter(record('Left: %s', (True, )))
+        self.filter.filter(record('Left: %s', (False, )))
+        self.filter.filter(record('Left: %s', (True, )))
+        self.clock.advance(0.1)
+
+        allowed = record('Left: %s', (False, ))
+        assert self.filter.filter(allowed)
+        assert allowed.getMessage() == 'Left: False (2 similar suppressed)'
+
+    def test_lets_info_through(self):
+        for _ in range(3):
+            assert self.filter.filter(record('Ready', level=logging.INFO))
+
+
+class TestQueue(TestCase):
+
+    def test_handlers_run_on_listener(self):
+        queue = Queue()
+        handler = mock.Mock(level=logging.INFO)
+        listener = logs.QueueListener(queue, [handler])
+        queue_handler = logs.QueueHandler(queue)
+
+        queue_handler.handle(record('Debug'))
+        queue_handler.handle(record('Info', level=logging.INFO))
+        listener.start()
+        listener.stop()
+
+        handler.handle.assert_called_once()
+        assert handler.handle.call_args[0][0].getMessage() == 'Info'
+
+    def test_drops_when_full(self):
+        queue_handler = logs.QueueHandler(Queue(maxsize=1))
+
+        queue_handler.handle(record('First'))
+        queue_handler.handle(record('Second'))
+
+        assert queue_handler.dropped == 1
+
+    def test_forked_child_logs(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'child.log')
+        logger = logging.getLogger('cnavbot.tests.fork')
+        logger.propagate = False
+        logger.addHandler(logging.FileHandler(path))
+        listener = logs.install(logger)
+        self.addCleanup(logger.removeHandler, logger.handlers[0])
+        self.addCleanup(listener.stop)
+
+        child = multiprocessing.Process(
+            target=logger.warning, args=('From child %s', 1)
+        )
+        child.start()
+        child.join()
+
+        with open(path) as log_file:
+            assert log_file.read() == 'From child 1\n'
+
+
+class TestTraceHandler(TestCase):
+
+    def test_dump(self):
+        trace = logs.TraceHandler(size=2, path=None)
+        for distance in (30, 20, 10):
+            trace.handle(record('Distance: %s', (distance, )))
+        stream = StringIO()
+
+        trace.dump(stream)
+
+        lines = stream.getvalue().splitlines()
+        assert len(lines) == 3
+        assert lines[1].endswith('DEBUG Distance: 20')
+        assert lines[2].endswith('DEBUG Distance: 10')
+        assert not trace.records
+
+    def test_dumped_on_error(self):
+        trace = logs.TraceHandler(size=10, path='/tmp/trace.log')
+        trace.dump = mock.Mock()
+        trace.handle(record('Distance: %s', (30, )))
+        trace.dump.assert_not_called()
+
+        with mock.patch('cnavbot.logs.open', create=True) as open_mock:
+            trace.handle(record('Failed', level=logging.ERROR))
+
+        open_mock.assert_called_once_with('/tmp/trace.log', 'a')
+        trace.dump.assert_called_once()
@@ -0,0 +1,56 @@
+from __future__ import absolute_import
+from unittest import TestCase
+
+import mock
+
+from cnavbot import metrics
+
+
+class TestMetrics(TestCase):
+
+    def test_counter(self):
+        counter = metrics.Counter(
+            'commands_total', 'Commands', labels=('command', )
+        )
+
+        counter.labels('forward').inc()
+        counter.labels('forward').inc(2)
+
+        assert counter.exposition() == '\n'.join((
+            '# HELP commands_total Commands',
+            '# TYPE commands_total counter',
+            'commands_total{command="forward"} 3.0',
+        ))
+
+    def test_histogram(self):
+        histogram = metrics.Histogram(
+            'latency_seconds', 'Latency', buckets=(0.1, 1)
+        )
+
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        assert list(histogram.samples()) == [
+            ('_bucket', '{le="0.1"}', 1),
+            ('_bucket', '{le="1"}', 2),
+            ('_bucket', '{le="+Inf"}', 3),
+            ('_sum', '', 5.55),
+            ('_count', '', 3),
+        ]
+
+    @mock.patch('cnavbot.settings.METRICS_ENABLED', False)
+    def test_disabled(self):
+        counter = metrics.counter('disabled_total', 'Disabled')
+
+        assert counter is metrics.NULL_METRIC
+        with counter.labels('any').time():
+            counter.inc()
+
+    @mock.patch('cnavbot.metrics.registry', [])
+    @mock.patch('cnavbot.settings.METRICS_ENABLED', True)
+    def test_enabled(self):
+        gauge = metrics.gauge('fps', 'Frames per second')
+        gauge.set(10)
+
+        assert metrics.exposition().endswith('fps 10.0\n')
@@ -0,0 +1,90 @@
+from __future__ import absolute_import
+from unittest import TestCase
+
+import pytest
+
+from cnavbot import clock
+from cnavbot.services import odometry, pi2go
+from cnavbot.simulator import Simulator, World
+
+
+class TestOdometry(TestCase):
+
+    def setUp(self):
+        self.clock = clock.VirtualClock()
+        self.odometry = odometry.Odometry(
+            cm_per_speed=0.5,
+            degrees_per_speed=2.0,
+            distance_noise=0.5,
+            turn_noise=0.5,
+            yaw_variance=9,
+            clock=self.clock,
+        )
+        self.odometry.reset(theta=0)
+
+    def test_forward(self):
+        self.odometry.command(50, 50)
+        self.clock.advance(2)
+
+        pose = self.odometry.pose()
+        assert pose.x == pytest.approx(0)
+        assert pose.y == pytest.approx(50)
+        assert pose.theta == 0
+        # All of the uncertainty is along the direction of travel
+        assert pose.covariance[1][1] == pytest.approx(25)
+        assert pose.covariance[0][0] == pytest.approx(0)
+
+    def test_spin(self):
+        self.odometry.command(-50, 50)
+        self.clock.advance(1)
+        self.odometry.command(0, 0)
+        self.clock.advance(1)
+
+        pose = self.odometry.pose()
+        assert (pose.x, pose.y) == (0, 0)
+        assert pose.theta == 260
+        assert pose.covariance[2][2] == pytest.approx(50)
+
+    def test_yaw_sets_unknown_heading(self):
+        self.odometry.reset()
+
+        self.odometry.yaw(90)
+
+        assert self.odometry.pose().theta == pytest.approx(90, abs=0.1)
+
+    def test_yaw_correction_moves_position(self):
+        self.odometry.command(50, -50)
+        self.clock.advance(0.1)
+        self.odometry.command(50, 50)
+        self.clock.advance(2)
+        self.odometry.command(0, 0)
+        uncertain = self.odometry.pose()
+        assert uncertain.theta == pytest.approx(10)
+
+        self.odometry.yaw(20)
+
+        pose = self.odometry.pose()
+        assert 10 < pose.theta < 20
+        # Heading turned right, so did the position
+        assert pose.x > uncertain.x
+        assert pose.covariance[2][2] < uncertain.covariance[2][2]
+
+
+class TestOdometryWithMotors(TestCase):
+
+    def test_follows_simulated_bot(self):
+        simulator = Simulator(world=World(width=1000, height=1000))
+        tracker = odometry.Odometry(clock=simulator)
+        tracker.reset(x=simulator.x, y=simulator.y, theta=simulator.heading)
+        motors = pi2go.Motors(
+            driver=simulator, clock=simulator, listener=tracker.command
+        )
+
+        motors.forward(steps=10)
+        motors.right(steps=5)
+        motors.forward(steps=10)
+
+        pose = tracker.pose()
+        assert pose.x == pytest.approx(simulator.x)
+        assert pose.y == pytest.approx(simulator.y)
+        assert pose.theta == pytest.approx(simulator.heading)
@@ -3,7 +3,7 @@ from unittest import TestCase
 import mock
 import pytest
 
-from cnavbot import settings
+from cnavbot import clock, settings
 from cnavbot.services import pi2go
 
 
@@ -87,6 +87,19 @@ class TestMotors(TestCase):
         )
         self.motors.keep_running.assert_called_with(self.steps)
 
+    def test_spin_at_speed(self):
+        self.motors.spin(25)
+        self.motors.spin(-30)
+
+        self.motors.driver.spinRight.assert_called_once_with(25)
+        self.motors.driver.spinLeft.assert_called_once_with(30)
+        self.motors.keep_running.assert_not_called()
+
+    def test_spin_at_zero_speed_stops(self):
+        self.motors.spin(0)
+
+        self.motors.driver.stop.assert_called_once()
+
     def test_stop(self):
         self.motors.stop()
 
@@ -146,6 +159,118 @@ class TestObstacleSensor(TestCase):
 
         self.obstacle_sensor.driver.irAll()
 
+    def test_snapshot(self):
+        obstacle_sensor = pi2go.ObstacleSensor(driver=mock.Mock())
+
+        reading = obstacle_sensor.snapshot()
+
+        assert reading.left == obstacle_sensor.driver.irLeft.return_value
+        assert reading.right == obstacle_sensor.driver.irRight.return_value
+        assert reading.front == obstacle_sensor.driver.irCentre.return_value
+        assert reading.distance is None
+        obstacle_sensor.driver.getDistance.assert_not_called()
+
+    def test_snapshot_reused_while_fresh(self):
+        obstacle_sensor = pi2go.ObstacleSensor(driver=mock.Mock())
+
+        first = obstacle_sensor.snapshot()
+        second = obstacle_sensor.snapshot()
+
+        assert first is second
+        obstacle_sensor.driver.irLeft.assert_called_once()
+
+    def test_snapshot_reread_after_since(self):
+        obstacle_sensor = pi2go.ObstacleSensor(driver=mock.Mock())
+
+        first = obstacle_sensor.snapshot()
+        obstacle_sensor.snapshot(since=first.timestamp)
+
+        assert obstacle_sensor.driver.irLeft.call_count == 2
+
+    def test_snapshot_reread_for_distance(self):
+        obstacle_sensor = pi2go.ObstacleSensor(driver=mock.Mock())
+
+        obstacle_sensor.snapshot()
+        reading = obstacle_sensor.snapshot(distance=True)
+
+        assert reading.distance == (
+            obstacle_sensor.driver.getDistance.return_value
+        )
+        assert obstacle_sensor.driver.irLeft.call_count == 2
+
+    def test_snapshot_expires(self):
+        obstacle_sensor = pi2go.ObstacleSensor(
+            driver=mock.Mock(), max_age=0.05, clock=clock.VirtualClock()
+        )
+
+        obstacle_sensor.snapshot()
+        obstacle_sensor.clock.advance(0.1)
+        obstacle_sensor.snapshot()
+
+        assert obstacle_sensor.driver.irLeft.call_count == 2
+
+
+class TestDistanceSampler(TestCase):
+
+    def setUp(self):
+        self.clock = clock.VirtualClock()
+        self.distances = iter([30, 28, 400, 24, 22])
+        self.sampler = pi2go.DistanceSampler(
+            lambda: next(self.distances), window=5, clock=self.clock
+        )
+
+    def sample(self, count):
+        for _ in range(count):
+            self.sampler.sample()
+            self.clock.advance(0.1)
+
+    def test_median_ignores_missed_echo(self):
+        self.sample(5)
+
+        assert self.sampler.distance() == 28
+
+    def test_closing_velocity(self):
+        self.sample(5)
+
+        assert self.sampler.closing_velocity() == 20
+
+    def test_closing_velocity_needs_two_pings(self):
+        self.sample(1)
+
+        assert self.sampler.closing_velocity() == 0
+
+    def test_obstacle_sensor_reads_sampler(self):
+        obstacle_sensor = pi2go.ObstacleSensor(driver=mock.Mock())
+        obstacle_sensor.sampler = self.sampler
+        self.sample(2)
+
+        assert obstacle_sensor.distance() == 29
+        assert obstacle_sensor.closing_velocity() == 20
+        obstacle_sensor.driver.getDistance.assert_not_called()
+
+    def test_stale_pings(self):
+        self.sample(5)
+        assert abs(self.sampler.age() - 0.1) < 1e-9
+
+        self.clock.advance(settings.BOT_DISTANCE_MAX_AGE)
+
+        assert self.sampler.stale()
+        assert self.sampler.distance() is None
+
+    def test_without_pings(self):
+        assert self.sampler.age() is None
+        assert self.sampler.distance(timeout=0) is None
+
+    def test_obstacle_sensor_reads_directly_when_stale(self):
+        obstacle_sensor = pi2go.ObstacleSensor(driver=mock.Mock())
+        obstacle_sensor.driver.getDistance.return_value = 50
+        obstacle_sensor.sampler = self.sampler
+        self.sample(2)
+        self.clock.advance(settings.BOT_DISTANCE_MAX_AGE)
+
+        assert obstacle_sensor.distance() == 50
+        assert obstacle_sensor.closing_velocity() is None
+
 
 class TestLineSensor(TestCase):
     line_sensor = pi2go.LineSensor(driver=mock.Mock())
@@ -159,3 +284,72 @@ class TestLineSensor(TestCase):
         self.line_sensor.right()
 
         self.line_sensor.driver.irRightLine.assert_called_once()
+
+    def test_snapshot(self):
+        line_sensor = pi2go.LineSensor(driver=mock.Mock())
+        line_sensor.driver.irLeftLine.return_value = False
+        line_sensor.driver.irRightLine.return_value = True
+
+        reading = line_sensor.snapshot()
+
+        assert reading.left is True
+        assert reading.right is False
+        assert line_sensor.snapshot() is reading
+
+
+class TestMotorScheduler(TestCase):
+
+    def setUp(self):
+        self.motors = pi2go.Motors(
+            driver=mock.Mock(), asynchronous=True, poll_interval=0.001
+        )
+
+    def test_move_stops_after_steps(self):
+        completion = self.motors.forward(steps=0.1, wait=False)
+
+        assert completion.wait(timeout=0.5)
+        assert not completion.preempted
+        self.motors.driver.forward.assert_called_once_with(
+            settings.BOT_DEFAULT_SPEED
+        )
+        self.motors.driver.stop.assert_called_once()
+
+    def test_new_command_preempts(self):
+        first = self.motors.forward(steps=100, wait=False)
+        second = self.motors.left(steps=0.1, wait=False)
+
+        assert first.done()
+        assert first.preempted
+        assert second.wait(timeout=0.5)
+        self.motors.driver.stop.assert_called_once()
+
+    def test_move_interrupted(self):
+        until = mock.Mock(side_effect=[False, True])
+
+        completion = self.motors.right(steps=100, until=until)
+
+        assert completion.preempted
+        assert until.call_count == 2
+        self.motors.driver.stop.assert_called_once()
+
+    def test_deadline_on_clock(self):
+        virtual_clock = clock.VirtualClock(start=10)
+        motors = pi2go.Motors(
+            driver=mock.Mock(), clock=virtual_clock, asynchronous=True
+        )
+
+        completion = motors.forward(steps=10)
+
+        assert completion.done()
+        assert not completion.preempted
+        assert virtual_clock.monotonic() == 11
+        motors.driver.stop.assert_called_once()
+
+    def test_close(self):
+        completion = self.motors.forward(steps=100, wait=False)
+
+        self.motors.close()
+        self.motors.scheduler.join(timeout=0.5)
+
+        assert not self.motors.scheduler.is_alive()
+        assert completion.preempted
@@ -0,0 +1,121 @@
+from __future__ import absolute_import
+from unittest import TestCase
+
+import mock
+import numpy
+
+from cnavbot.services import position
+
+
+POSITIONS = {
+    'one': (0.0, 0.0),
+    'two': (4.0, 0.0),
+    'three': (0.0, 4.0),
+    'four': (4.0, 4.0),
+}
+
+
+class TestPathLossModel(TestCase):
+
+    def setUp(self):
+        self.model = position.PathLossModel(exponent=2, offset=0)
+
+    def test_distance(self):
+        assert self.model.distance(rssi=-59, txpower=-59) == 1
+        assert self.model.distance(rssi=-79, txpower=-59) == 10
+
+    def test_calibrate(self):
+        distances = numpy.array([1, 2, 4, 8])
+        rssi = -60 + 3 - 10 * 2.5 * numpy.log10(distances)
+
+        self.model.calibrate(rssi, [-60] * 4, distances)
+
+        assert abs(self.model.exponent - 2.5) < 1e-9
+        assert abs(self.model.offset - 3) < 1e-9
+
+
+class TestTrilateration(TestCase):
+
+    def setUp(self):
+        self.model = position.PathLossModel(exponent=2, offset=0)
+        self.trilateration = position.Trilateration(
+            positions=POSITIONS, model=self.model, confidence_scale=1
+        )
+
+    def scan(self, x, y, noise=None):
+        """RSSI each beacon would report at (x, y)"""
+        scan = {}
+        for beacon, (beacon_x, beacon_y) in POSITIONS.items():
+            distance = numpy.hypot(x - beacon_x, y - beacon_y)
+            rssi = -59 - 20 * numpy.log10(distance)
+            if noise:
+                rssi += noise.get(beacon, 0)
+            scan[beacon] = {'rssi': rssi, 'txpower': -59}
+        return scan
+
+    def test_locate(self):
+        estimate = self.trilateration.locate(self.scan(1, 3))
+
+        assert abs(estimate['x'] - 1) < 1e-6
+        assert abs(estimate['y'] - 3) < 1e-6
+        assert estimate['confidence'] > 0.99
+        assert estimate['beacons'] == 4
+
+    def test_confidence_drops_with_inconsistent_distances(self):
+        estimate = self.trilateration.locate(
+            self.scan(1, 3, noise={'one': 6, 'four': -6})
+        )
+
+        assert estimate['confidence'] < 0.9
+
+    def test_needs_three_beacons(self):
+        scan = self.scan(1, 3)
+        del scan['one']
+        del scan['two']
+
+        assert self.trilateration.locate(scan) is None
+
+    def test_ignores_unknown_beacons(self):
+        scan = self.scan(1, 3)
+        scan['unknown'] = {'rssi': -40, 'txpower': -59}
+
+        assert self.trilateration.locate(scan)['beacons'] == 4
+
+
+class TestPosition(TestCase):
+
+    def test_update(self):
+        subscriber = mock.Mock()
+        subscriber.receive.return_value.data = {
+            beacon: {'rssi': -65, 'txpower': -59} for beacon in POSITIONS
+        }
+        resource = position.Position(
+            publisher=mock.Mock(),
+            bluetooth=subscriber,
+            trilateration=position.Trilateration(positions=POSITIONS),
+        )
+
+        estimate = resource.update()
+
+        assert abs(estimate['x'] - 2) < 1e-6
+        assert abs(estimate['y'] - 2) < 1e-6
+        resource.publisher.send.assert_called_once()
+
+    def test_update_keeps_capture_time_of_the_scan(self):
+        scan = {beacon: {'rssi': -65, 'txpower': -59} for beacon in POSITIONS}
+        scan['_trace'] = {'sequence': 3, 'capture': 5.0, 'publish': 5.5}
+        subscriber = mock.Mock()
+        subscriber.receive.return_value.data = scan
+        resource = position.Position(
+            publisher=mock.Mock(),
+            bluetooth=subscriber,
+            trilateration=position.Trilateration(positions=POSITIONS),
+        )
+        resource.stamper.enabled = True
+
+        estimate = resource.update()
+
+        assert '_trace' not in estimate
+        sent = resource.publisher.send.call_args[0][0].data
+        assert sent['_trace']['capture'] == 5.0
+        assert sent['_trace']['sequence'] == 1
@@ -0,0 +1,229 @@
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import mock
+import numpy
+
+from cnavbot import clock, recording, simulator
+
+
+class RecordingTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'run.rec')
+        self.clock = clock.VirtualClock(start=100)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def recorder(self, **kwargs):
+        return recording.Recorder(self.path, clock=self.clock, **kwargs)
+
+
+class TestRecorder(RecordingTestCase):
+
+    def test_round_trip(self):
+        frame = numpy.arange(2 * 3 * 3, dtype=numpy.uint8).reshape(2, 3, 3)
+        with self.recorder(frame_quality=0) as recorder:
+            recorder.record('sense.yaw', 10.5)
+            self.clock.advance(1)
+            recorder.record('frame', frame)
+            recorder.record('bluetooth', {'beacon': {'rssi': -60}})
+
+        with recording.Recording(self.path) as recorded:
+            assert recorded.start == 100
+            assert recorded.end == 101
+            assert recorded.count('sense.yaw') == 1
+            assert list(recorded.records('sense.yaw')) == [(100, 10.5)]
+            timestamp, read_frame = recorded.read('frame', 0)
+            assert timestamp == 101
+            assert (read_frame == frame).all()
+            assert recorded.latest('bluetooth', 200) == {
+                'beacon': {'rssi': -60}
+            }
+
+    def test_jpeg_frames(self):
+        frame = numpy.full((16, 16, 3), 128, dtype=numpy.uint8)
+        with self.recorder() as recorder:
+            recorder.record('frame', frame)
+
+        with recording.Recording(self.path) as recorded:
+            read_frame = recorded.read('frame', 0)[1]
+            assert read_frame.shape == frame.shape
+            assert abs(int(read_frame[8, 8, 0]) - 128) <= 2
+
+    def test_appends_to_existing_log(self):
+        with self.recorder() as recorder:
+            recorder.record('sense.yaw', 1)
+        self.clock.advance(1)
+        with self.recorder() as recorder:
+            recorder.record('driver.irLeft', True)
+            recorder.record('sense.yaw', 2)
+
+        with recording.Recording(self.path) as recorded:
+            assert list(recorded.records('sense.yaw')) == [(100, 1), (101, 2)]
+            assert recorded.count('driver.irLeft') == 1
+
+    def test_ignores_partly_written_record(self):
+        with self.recorder() as recorder:
+            recorder.record('sense.yaw', 1)
+            recorder.record('sense.yaw', 2)
+        with open(self.path, 'r+b') as data:
+            data.truncate(os.path.getsize(self.path) - 1)
+
+        with recording.Recording(self.path) as recorded:
+            assert list(recorded.records('sense.yaw')) == [(100, 1)]
+
+    def test_appends_after_truncated_index(self):
+        with self.recorder() as recorder:
+            recorder.record('sense.yaw', 1)
+            recorder.record('sense.yaw', 2)
+        # Crashed part way through the last index entry
+        index = recording.index_path(self.path)
+        with open(index, 'r+b') as data:
+            data.truncate(os.path.getsize(index) - 10)
+
+        self.clock.advance(1)
+        with self.recorder() as recorder:
+            recorder.record('sense.yaw', 3)
+            recorder.record('driver.irLeft', True)
+
+        assert os.path.getsize(index) % recording.INDEX_ENTRY.size == 0
+        with recording.Recording(self.path) as recorded:
+            assert list(recorded.records('sense.yaw')) == [(100, 1), (101, 3)]
+            assert list(recorded.records('driver.irLeft')) == [(101, True)]
+
+    def test_appends_after_unindexed_data(self):
+        with self.recorder() as recorder:
+            recorder.record('sense.yaw', 1)
+        # Crashed after writing a payload but before its index entry
+        with open(self.path, 'ab') as data:
+            data.write(b'12')
+
+        with self.recorder() as recorder:
+            recorder.record('sense.yaw', 2)
+
+        with recording.Recording(self.path) as recorded:
+            assert list(recorded.records('sense.yaw')) == [(100, 1), (100, 2)]
+
+    def test_invalid_log(self):
+        with open(self.path, 'wb') as data:
+            data.write(b'not a recording')
+
+        with self.assertRaises(Exception):
+            recording.Recording(self.path)
+
+
+class TestRecordingDriver(RecordingTestCase):
+
+    def test_records_calls(self):
+        driver = mock.Mock()
+        driver.irLeft.return_value = True
+        driver.irFL = 11
+        with self.recorder() as recorder:
+            recording_driver = recording.RecordingDriver(driver, recorder)
+
+            assert recording_driver.irLeft() is True
+            recording_driver.forward(50)
+            assert recording_driver.forward.__name__ == 'forward'
+            assert recording_driver.irFL == 11
+
+        with recording.Recording(self.path) as recorded:
+            assert recorded.latest('driver.irLeft', 100) is True
+            assert recorded.latest('driver.forward', 100) == [50]
+
+    def test_records_sensor_changes(self):
+        driver = mock.Mock()
+        driver.irLeft.side_effect = [False, False, True, True, False]
+        with self.recorder() as recorder:
+            recording_driver = recording.RecordingDriver(driver, recorder)
+            for _ in range(5):
+                recording_driver.irLeft()
+                recording_driver.stop()
+                self.clock.advance(1)
+
+        with recording.Recording(self.path) as recorded:
+            assert list(recorded.records('driver.irLeft')) == [
+                (100, False), (102, True), (104, False)
+            ]
+            assert recorded.latest('driver.irLeft', 103) is True
+            assert recorded.count('driver.stop') == 5
+
+
+class TestReplay(RecordingTestCase):
+
+    def setUp(self):
+        super(TestReplay, self).setUp()
+        with self.recorder(frame_quality=0) as recorder:
+            for yaw in (10, 20, 30):
+                recorder.record('sense.yaw', yaw)
+                recorder.record('driver.irCentre', yaw == 20)
+                recorder.record('frame', numpy.full((2, 2, 3), yaw, 'uint8'))
+                self.clock.advance(1)
+        self.recorded = recording.Recording(self.path)
+        self.replay = recording.Replay(self.recorded)
+
+    def tearDown(self):
+        self.recorded.close()
+        super(TestReplay, self).tearDown()
+
+    def test_latest_reading_at_replay_time(self):
+        sense = recording.ReplaySense(self.replay)
+        driver = recording.ReplayDriver(self.replay)
+
+        assert sense.yaw == 10
+        assert driver.irCentre() is False
+        self.replay.clock.sleep(1.5)
+        assert sense.yaw == 20
+        assert driver.irCentre() is True
+
+    def test_keeps_motor_commands(self):
+        driver = recording.ReplayDriver(self.replay)
+
+        driver.spinLeft(40)
+
+        assert driver.commands == [(100, 'spinLeft', (40, ))]
+        assert driver.spinLeft.__name__ == 'spinLeft'
+
+    def test_ends(self):
+        self.replay.clock.sleep(2.5)
+
+        with self.assertRaises(recording.ReplayEnded):
+            self.replay.now()
+
+    def test_camera(self):
+        self.replay.clock.sleep(1)
+
+        frame = recording.ReplayCamera(self.replay, shared=False).receive()
+        assert (frame.data == 20).all()
+
+        camera = recording.ReplayCamera(self.replay, shared=True)
+        data = camera.receive().data
+        assert data['slot'] == 1
+        assert (camera.read(data) == 20).all()
+
+
+class TestRecordAndReplay(RecordingTestCase):
+
+    def test_wander(self):
+        # Recorded by the bot on the simulator clock, closed on cleanup
+        with mock.patch('cnavbot.settings.RECORDING_PATH', self.path):
+            simulator.simulate(
+                'wander',
+                minutes=0.5,
+                world=simulator.arena(),
+                bot_kwargs={'publisher': mock.Mock(port=1)},
+            )
+
+        stats = recording.replay(
+            self.path, 'wander', bot_kwargs={'publisher': mock.Mock(port=1)}
+        )
+
+        assert stats['replayed_seconds'] > 25
+        assert stats['ticks'] > 0
+        assert stats['recorded_motor_commands'] > 0
+        assert stats['motor_commands'] > 0
@@ -0,0 +1,59 @@
+from __future__ import absolute_import
+from unittest import TestCase
+
+import mock
+
+from cnavbot import clock
+from cnavbot.services import sense
+
+
+class TestWrapAngle(TestCase):
+
+    def test_wrap_angle(self):
+        assert sense.wrap_angle(350) == -10
+        assert sense.wrap_angle(-190) == 170
+        assert sense.wrap_angle(45) == 45
+
+
+class TestOrientationCache(TestCase):
+
+    def setUp(self):
+        self.subscriber = mock.Mock()
+        self.clock = clock.VirtualClock()
+        self.cache = sense.OrientationCache(
+            self.subscriber, max_extrapolation=0.5, clock=self.clock
+        )
+
+    def receive(self, yaw, at):
+        self.subscriber.receive.return_value.data = {'yaw': yaw}
+        self.clock.now = at
+        self.cache.receive()
+
+    def test_latest(self):
+        self.receive(yaw=90, at=10)
+        self.clock.now = 10.25
+
+        assert self.cache.latest() == ({'yaw': 90}, 0.25)
+
+    def test_latest_before_first_reading(self):
+        assert self.cache.latest(timeout=0) == (None, None)
+
+    def test_yaw_rate_across_north(self):
+        self.receive(yaw=355, at=10)
+        self.receive(yaw=5, at=10.5)
+
+        assert self.cache.yaw_rate == 20
+
+    def test_predicted_yaw(self):
+        self.receive(yaw=350, at=10)
+        self.receive(yaw=0, at=11)
+        self.clock.now = 11.25
+
+        assert self.cache.predicted_yaw() == 2.5
+
+    def test_predicted_yaw_is_capped(self):
+        self.receive(yaw=0, at=10)
+        self.receive(yaw=10, at=11)
+        self.clock.now = 20
+
+        assert self.cache.predicted_yaw() == 15
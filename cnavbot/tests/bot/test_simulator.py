@@ -0,0 +1,164 @@
+from __future__ import absolute_import
+from unittest import TestCase
+
+import mock
+
+from cnavbot import simulator
+from cnavbot.services import pi2go
+
+
+class TestWorld(TestCase):
+
+    def setUp(self):
+        self.world = simulator.World(
+            width=100,
+            height=100,
+            lines=[((10, 50), (90, 50))],
+            obstacles=[(50, 80, 10)],
+        )
+
+    def test_ray_to_wall(self):
+        assert self.world.ray(20, 20, 90, max_range=500) == 80
+        assert self.world.ray(20, 20, 180, max_range=500) == 20
+
+    def test_ray_to_obstacle(self):
+        assert abs(self.world.ray(50, 20, 0, max_range=500) - 50) < 1e-9
+
+    def test_ray_max_range(self):
+        assert self.world.ray(20, 20, 90, max_range=30) == 30
+
+    def test_collides(self):
+        assert self.world.collides(50, 65, radius=8)
+        assert self.world.collides(5, 20, radius=8)
+        assert not self.world.collides(20, 20, radius=8)
+
+    def test_on_line(self):
+        assert self.world.on_line(30, 50.5)
+        assert not self.world.on_line(30, 55)
+
+
+class TestSimulator(TestCase):
+
+    def setUp(self):
+        self.simulator = simulator.Simulator(world=simulator.World(
+            width=300, height=300, start=(150, 50, 0),
+        ))
+
+    def test_sleep_advances_time_and_moves(self):
+        self.simulator.forward(40)
+
+        self.simulator.sleep(1)
+
+        assert self.simulator.time() == 1
+        assert abs(self.simulator.y - 70) < 1e-9
+        assert abs(self.simulator.travelled - 20) < 1e-9
+
+    def test_spin(self):
+        self.simulator.spinRight(45)
+
+        self.simulator.sleep(1)
+
+        assert abs(self.simulator.heading - 90) < 1e-9
+        assert (self.simulator.x, self.simulator.y) == (150, 50)
+
+    def test_bumps_into_walls(self):
+        self.simulator.reverse(100)
+
+        self.simulator.sleep(2)
+
+        assert self.simulator.collisions
+        assert self.simulator.y >= self.simulator.radius
+
+    def test_obstacle_sensors(self):
+        assert not self.simulator.irCentre()
+        self.simulator.world.obstacles.append((150, 70, 5))
+
+        assert self.simulator.irCentre()
+        assert not self.simulator.irLeft()
+        assert abs(self.simulator.getDistance() - 7) < 1e-9
+
+    def test_line_sensors(self):
+        self.simulator.world.lines.append(((148.5, 0), (148.5, 300)))
+
+        assert self.simulator.irLeftLine() is True
+        assert self.simulator.irRightLine() is False
+
+    def test_sleep_past_end(self):
+        self.simulator.end_at = 1
+        self.simulator.sleep(1)
+
+        with self.assertRaises(simulator.SimulationEnded):
+            self.simulator.sleep(1)
+
+    def test_sensor_reads_take_time(self):
+        self.simulator.end_at = 1
+
+        # A mode that only polls sensors still reaches the end
+        with self.assertRaises(simulator.SimulationEnded):
+            while True:
+                self.simulator.irCentre()
+
+    def test_drives_motors(self):
+        motors = pi2go.Motors(driver=self.simulator, clock=self.simulator)
+
+        motors.forward(steps=10)
+
+        assert self.simulator.time() == 1
+        assert (self.simulator.left_speed, self.simulator.right_speed) == (
+            0, 0
+        )
+        assert self.simulator.y > 50
+
+
+class TestSimulate(TestCase):
+
+    def test_wander(self):
+        stats = simulator.simulate(
+            'wander',
+            minutes=1,
+            world=simulator.arena(),
+            bot_kwargs={'publisher': mock.Mock(port=1)},
+        )
+
+        assert stats['simulated_seconds'] >= 60
+        assert stats['travelled_cm'] > 0
+        assert stats['speedup'] > 1
+
+    def test_wander_track(self):
+        # Boxed in by the walls but further than the sonar backs off from
+        stats = simulator.simulate(
+            'wander',
+            minutes=1,
+            world=simulator.track(),
+            bot_kwargs={'publisher': mock.Mock(port=1)},
+        )
+
+        assert stats['simulated_seconds'] >= 60
+        assert stats['travelled_cm'] > 500
+        assert stats['collisions'] == 0
+
+    def test_follow(self):
+        stats = simulator.simulate(
+            'follow',
+            minutes=1,
+            world=simulator.track(),
+            bot_kwargs={'publisher': mock.Mock(port=1)},
+        )
+
+        # Around most of the track without leaving the line
+        assert stats['travelled_cm'] > 800
+        assert stats['line_ratio'] > 0.9
+        assert stats['collisions'] == 0
+
+    @mock.patch('cnavbot.settings.BOT_ASYNC_MOTORS', True)
+    def test_wander_with_async_motors(self):
+        stats = simulator.simulate(
+            'wander',
+            minutes=1,
+            world=simulator.arena(),
+            bot_kwargs={'publisher': mock.Mock(port=1)},
+        )
+
+        assert stats['simulated_seconds'] >= 60
+        assert stats['travelled_cm'] > 0
+        assert stats['speedup'] > 1
@@ -0,0 +1,69 @@
+from __future__ import absolute_import
+from unittest import TestCase
+
+import mock
+
+from cnavbot import settings, supervisor
+
+
+@mock.patch('multiprocessing.Process')
+class TestSupervised(TestCase):
+
+    def setUp(self):
+        self.start = mock.Mock()
+        self.service = supervisor.Supervised(
+            name='camera', start=self.start, cpus='2'
+        )
+
+    def test_launch(self, process_mock):
+        self.service.launch(now=0)
+
+        process_mock.assert_called_once_with(
+            target=supervisor.run_service,
+            args=(self.start, '2'),
+            name='camera',
+        )
+        process_mock.return_value.start.assert_called_once()
+
+    def test_restart_with_backoff(self, process_mock):
+        process_mock.return_value.is_alive.return_value = False
+        self.service.launch(now=0)
+
+        self.service.check(now=1)
+        assert self.service.restart_at == 1 + settings.SUPERVISOR_BACKOFF
+
+        self.service.check(now=1 + settings.SUPERVISOR_BACKOFF)
+        assert process_mock.call_count == 2
+
+        self.service.check(now=3)
+        assert self.service.failures == 2
+        assert self.service.backoff() == 2 * settings.SUPERVISOR_BACKOFF
+
+    def test_backoff_reset_when_stable(self, process_mock):
+        process_mock.return_value.is_alive.return_value = False
+        self.service.launch(now=0)
+        self.service.failures = 5
+
+        self.service.check(now=settings.SUPERVISOR_STABLE_AFTER)
+
+        assert self.service.failures == 1
+
+    def test_max_backoff(self, process_mock):
+        self.service.failures = 100
+
+        assert self.service.backoff() == settings.SUPERVISOR_MAX_BACKOFF
+
+
+class TestProcessStats(TestCase):
+
+    def test_read_stat(self):
+        stat = (
+            '123 (python cnavbot) S 1 123 123 0 -1 4194560 1 0 0 0 '
+            '25 17 0 0 20 0 1 0 100 1000 100'
+        )
+        with mock.patch('__builtin__.open', mock.mock_open(read_data=stat)):
+            assert supervisor.read_stat(123) == (1, 42)
+
+    def test_read_stat_gone(self):
+        with mock.patch('__builtin__.open', side_effect=IOError):
+            assert supervisor.read_stat(123) is None
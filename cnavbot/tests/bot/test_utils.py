@@ -0,0 +1,30 @@
+from __future__ import absolute_import
+from unittest import TestCase
+
+import mock
+
+from cnavbot import utils
+
+
+class TestLazyModule(TestCase):
+
+    @mock.patch('cnavbot.utils.IMPORT_TIMES', {})
+    @mock.patch('importlib.import_module')
+    def test_imports_on_first_use(self, import_mock):
+        module = utils.LazyModule('driver')
+
+        import_mock.assert_not_called()
+
+        assert module.init is import_mock.return_value.init
+        module.cleanup()
+
+        import_mock.assert_called_once_with('driver')
+        assert 'driver' in utils.IMPORT_TIMES
+
+    @mock.patch('importlib.import_module')
+    def test_set_attribute(self, import_mock):
+        module = utils.LazyModule('driver')
+
+        module.speed = 10
+
+        assert import_mock.return_value.speed == 10
@@ -0,0 +1,139 @@
+from __future__ import absolute_import
+from unittest import TestCase
+
+import cv2
+import numpy
+
+from cnavbot.benchmarks.vision import benchmark_colours, target_colour
+from cnavbot.services import vision
+
+
+def frame(x=None, size=20, width=640, height=480):
+    """Black frame with a target coloured square centred on x"""
+    image = numpy.zeros((height, width, 3), dtype=numpy.uint8)
+    if x is not None:
+        left = x - size // 2
+        image[200:200 + size, left:left + size] = target_colour()
+    return image
+
+
+class TestTargetDetector(TestCase):
+
+    def test_detect(self):
+        target = vision.TargetDetector(roi=None, scale=1).detect(frame(300))
+
+        assert target == {'x': 300, 'area': 400}
+
+    def test_detect_in_roi(self):
+        detector = vision.TargetDetector(roi=None, scale=1)
+
+        assert detector.detect(frame(300), roi=(0, 0, 200, 480)) is None
+
+
+class TestTargetTracker(TestCase):
+
+    def setUp(self):
+        self.tracker = vision.TargetTracker(
+            detector=vision.TargetDetector(roi=None, scale=1),
+            window=100,
+            alpha=0.5,
+            beta=0.2,
+            decay=0.9,
+            min_confidence=0.5,
+        )
+
+    def test_tracks_in_window(self):
+        for step in range(5):
+            target = self.tracker.update(frame(300 + 10 * step), now=step)
+
+        assert self.tracker.full_detections == 1
+        assert self.tracker.window_updates == 4
+        assert 320 < target['x'] <= 340
+        assert target['velocity'] > 0
+        assert target['confidence'] < 1
+
+    def test_redetects_when_lost(self):
+        self.tracker.update(frame(300), now=0)
+
+        target = self.tracker.update(frame(600), now=1)
+
+        assert target['x'] == 600
+        assert target['confidence'] == 1
+        assert self.tracker.full_detections == 2
+
+    def test_redetects_when_confidence_drops(self):
+        for step in range(8):
+            self.tracker.update(frame(300), now=step)
+
+        # 0.9 ** 7 is below 0.5
+        assert self.tracker.full_detections == 2
+
+    def test_no_target(self):
+        self.tracker.update(frame(300), now=0)
+
+        assert self.tracker.update(frame(), now=1) is None
+        assert self.tracker.target is None
+
+
+class TestColourTable(TestCase):
+
+    def test_agrees_with_hsv_thresholding(self):
+        colours = benchmark_colours(3)
+        hsv = vision.TargetDetector(
+            colours=colours, roi=None, scale=1, thresholding='hsv'
+        )
+        table = vision.TargetDetector(
+            colours=colours, roi=None, scale=1, thresholding='table'
+        )
+        image = numpy.random.RandomState(0).randint(
+            0, 256, (120, 160, 3)
+        ).astype(numpy.uint8)
+
+        expected = hsv.threshold(image).copy()
+        labels = table.threshold(image)
+
+        assert set(numpy.unique(labels)) <= {0, 1, 2, 3}
+        assert (labels == expected).mean() > 0.99
+
+    def test_invalid_bits(self):
+        with self.assertRaises(Exception):
+            vision.ColourTable(benchmark_colours(1), bits=9)
+
+
+class TestMultipleColours(TestCase):
+
+    def setUp(self):
+        self.colours = benchmark_colours(2)
+        low, high = self.colours[1]
+        # Centre of the second class, in the detector's RGB2HSV order
+        second = cv2.cvtColor(numpy.array([[[
+            (low[0] + high[0]) // 2, 200, 200
+        ]]], dtype=numpy.uint8), cv2.COLOR_HSV2RGB)[0, 0]
+        self.image = frame(100)
+        self.image[300:330, 400:430] = second
+
+    def detector(self, thresholding):
+        return vision.TargetDetector(
+            colours=self.colours, roi=None, scale=1, thresholding=thresholding
+        )
+
+    def test_detect_all(self):
+        for thresholding in ('hsv', 'table'):
+            first, second = self.detector(thresholding).detect_all(self.image)
+
+            assert first == {'x': 100, 'area': 400}
+            assert second == {'x': 415, 'area': 900}
+
+    def test_detect_colour(self):
+        detector = self.detector('table')
+
+        assert detector.detect(self.image, colour=0)['x'] == 100
+        # Largest of any colour
+        assert detector.detect(self.image)['x'] == 415
+
+    def test_tracker_shares_the_table(self):
+        detector = self.detector('table')
+
+        tracker = vision.TargetTracker(detector=detector)
+
+        assert tracker.window_detector.table is detector.table
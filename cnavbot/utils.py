@@ -1,5 +1,59 @@
 from contextlib import contextmanager
+import importlib
 import logging
+import os
+import time
+
+
+# Set when the first cnavbot module is imported
+STARTED_AT = time.time()
+
+# Module name to seconds it took to import
+IMPORT_TIMES = {}
+
+
+class LazyModule(object):
+    """Stands in for a module and imports it on first attribute access"""
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def load(self):
+        if self._module is None:
+            started_at = time.time()
+            self.__dict__['_module'] = importlib.import_module(self._name)
+            IMPORT_TIMES[self._name] = time.time() - started_at
+            logging.getLogger().debug('Imported {} in {:.3f}s'.format(
+                self._name, IMPORT_TIMES[self._name]
+            ))
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self.load(), attribute)
+
+    def __setattr__(self, attribute, value):
+        setattr(self.load(), attribute, value)
+
+    def __repr__(self):
+        return '<LazyModule {}{}>'.format(
+            self._name, '' if self._module is None else ' (loaded)'
+        )
+
+
+def log_startup(name):
+    """Logs how long the process took to start and what it imported"""
+    logging.getLogger().info(
+        '{} ready {:.3f}s after start (pid {}), lazy imports: {}'.format(
+            name,
+            time.time() - STARTED_AT,
+            os.getpid(),
+            ', '.join(
+                '{} {:.3f}s'.format(module, seconds)
+                for module, seconds in sorted(IMPORT_TIMES.items())
+            ) or 'none',
+        )
+    )
 
 
 @contextmanager